@@ -1161,12 +1161,12 @@ def get_orders_summary():
             'approved_revenue': 0
         }
     
-    all_statuses = [order['status'] for order in orders]
-    pending_orders = len([o for o in orders if o['status'] == 'pending'])
-    approved_orders = len([o for o in orders if o['status'] in ['processing', 'shipped', 'delivered']])
+    all_statuses = [order.status for order in orders]
+    pending_orders = len([o for o in orders if o.status == 'pending'])
+    approved_orders = len([o for o in orders if o.status in ['processing', 'shipped', 'delivered']])
     
-    total_revenue = sum(order['total_amount'] for order in orders)
-    approved_revenue = sum(order['total_amount'] for order in orders if order['status'] in ['processing', 'shipped', 'delivered'])
+    total_revenue = sum(order.total_amount for order in orders)
+    approved_revenue = sum(order.total_amount for order in orders if order.status in ['processing', 'shipped', 'delivered'])
     
     return {
         'total_orders': len(orders),
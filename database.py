@@ -1,189 +1,277 @@
 import os
 import sqlite3
-from typing import List, Optional, Dict, Any
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime
 import hashlib
 # import streamlit as st  # Comentado para evitar problemas de importação
 import time
 
+import bcrypt
+
 DB_PATH = os.path.join(os.path.dirname(__file__), "ecommerce.db")
 
 
-def get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
-    conn.row_factory = sqlite3.Row
-    return conn
+_now = time.time
 
+# Prazo, em segundos, até um pagamento pendente expirar (cartão não expira)
+PAYMENT_EXPIRY_SECONDS = {
+    'PIX': 30 * 60,
+    'Boleto Bancário': 3 * 24 * 60 * 60,
+}
 
-def init_db() -> None:
-    conn = get_conn()
-    cur = conn.cursor()
+# Tipos de linha já criados, indexados pelos nomes das colunas do SELECT
+_row_types: Dict[Tuple[str, ...], type] = {}
 
-    # Users table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash BLOB NOT NULL,
-            first_name TEXT NOT NULL,
-            last_name TEXT NOT NULL,
-            phone TEXT,
-            role TEXT NOT NULL DEFAULT 'customer',
-            status TEXT NOT NULL DEFAULT 'active',
-            created_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
-        )
-    """)
 
-    # Categories table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS categories (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            image_url TEXT,
-            parent_id INTEGER,
-            is_active BOOLEAN DEFAULT 1,
-            created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
-            FOREIGN KEY(parent_id) REFERENCES categories(id)
-        )
-    """)
+def _build_row_type(columns: Tuple[str, ...]) -> type:
+    """Cria uma namedtuple que também aceita acesso por nome (row['coluna'])"""
+    index = {}
+    for i, name in enumerate(columns):
+        # Em colunas duplicadas vale a primeira, como no sqlite3.Row
+        index.setdefault(name, i)
+        index.setdefault(name.lower(), i)
 
-    # Products table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            price DECIMAL(10,2) NOT NULL,
-            stock INTEGER NOT NULL DEFAULT 0,
-            category_id INTEGER,
-            image_url TEXT,
-            sku TEXT UNIQUE,
-            is_active BOOLEAN DEFAULT 1,
-            created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
-            updated_at INTEGER DEFAULT (strftime('%s','now')),
-            FOREIGN KEY(category_id) REFERENCES categories(id)
-        )
-    """)
+    base = namedtuple("R", columns, rename=True)
 
-    # Cart table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS cart (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            product_id INTEGER NOT NULL,
-            quantity INTEGER NOT NULL DEFAULT 1,
-            created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
-            FOREIGN KEY(user_id) REFERENCES users(id),
-            FOREIGN KEY(product_id) REFERENCES products(id),
-            UNIQUE(user_id, product_id)
-        )
-    """)
+    class Row(base):
+        __slots__ = ()
 
-    # Orders table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            order_number TEXT UNIQUE NOT NULL,
-            status TEXT NOT NULL DEFAULT 'pending',
-            total_amount DECIMAL(10,2) NOT NULL,
-            shipping_address TEXT,
-            billing_address TEXT,
-            payment_method TEXT,
-            payment_status TEXT DEFAULT 'pending',
-            created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
-            updated_at INTEGER DEFAULT (strftime('%s','now')),
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-    """)
+        def __getitem__(self, key):
+            if isinstance(key, str):
+                key = index[key] if key in index else index[key.lower()]
+            return tuple.__getitem__(self, key)
 
-    # Order items table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS order_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id INTEGER NOT NULL,
-            product_id INTEGER NOT NULL,
-            quantity INTEGER NOT NULL,
-            price DECIMAL(10,2) NOT NULL,
-            FOREIGN KEY(order_id) REFERENCES orders(id),
-            FOREIGN KEY(product_id) REFERENCES products(id)
-        )
-    """)
+        def keys(self) -> List[str]:
+            return list(columns)
 
-    # Payment transactions table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS payment_transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id INTEGER NOT NULL,
-            transaction_id TEXT UNIQUE NOT NULL,
-            payment_method TEXT NOT NULL,
-            amount DECIMAL(10,2) NOT NULL,
-            status TEXT NOT NULL DEFAULT 'pending',
-            gateway_response TEXT,
-            pix_key TEXT,
-            pix_qr_code TEXT,
-            boleto_number TEXT,
-            boleto_barcode TEXT,
-            boleto_due_date INTEGER,
-            card_last_four TEXT,
-            card_brand TEXT,
-            installments INTEGER DEFAULT 1,
-            created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
-            updated_at INTEGER DEFAULT (strftime('%s','now')),
-            FOREIGN KEY(order_id) REFERENCES orders(id)
-        )
-    """)
+    return Row
 
-    # Payment notifications table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS payment_notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            transaction_id TEXT NOT NULL,
-            notification_type TEXT NOT NULL,
-            status TEXT NOT NULL,
-            message TEXT,
-            processed_at INTEGER,
-            created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
-            FOREIGN KEY(transaction_id) REFERENCES payment_transactions(transaction_id)
-        )
-    """)
 
-    # Payment methods configuration table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS payment_methods_config (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            method_name TEXT UNIQUE NOT NULL,
-            is_active BOOLEAN DEFAULT 1,
-            processing_fee DECIMAL(5,2) DEFAULT 0.00,
-            min_amount DECIMAL(10,2) DEFAULT 0.00,
-            max_amount DECIMAL(10,2) DEFAULT 999999.99,
-            config_data TEXT,
-            created_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
-        )
-    """)
+def make_row_factory(cur: sqlite3.Cursor, row: tuple):
+    """Row factory baseada em namedtuple: acesso por atributo nos loops quentes"""
+    columns = tuple(c[0] for c in cur.description)
+    row_type = _row_types.get(columns)
+    if row_type is None:
+        row_type = _row_types.setdefault(columns, _build_row_type(columns))
+    return row_type(*row)
 
-    # Invoices table (Notas Fiscais)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS invoices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            invoice_number TEXT UNIQUE NOT NULL,
-            order_id INTEGER NOT NULL,
-            customer_name TEXT NOT NULL,
-            customer_email TEXT NOT NULL,
-            subtotal DECIMAL(10,2) NOT NULL,
-            tax_amount DECIMAL(10,2) NOT NULL,
-            total DECIMAL(10,2) NOT NULL,
-            payment_method TEXT,
-            status TEXT DEFAULT 'EMITIDA',
-            invoice_data TEXT NOT NULL,
-            created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
-            FOREIGN KEY(order_id) REFERENCES orders(id)
-        )
-    """)
 
-    conn.commit()
+def get_conn(check_same_thread: bool = True) -> sqlite3.Connection:
+    # Autocommit: cada comando isolado já é sua própria transação;
+    # operações com vários comandos usam tx() explicitamente
+    conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES, isolation_level=None,
+                           check_same_thread=check_same_thread)
+    conn.row_factory = make_row_factory
+    return conn
+
+
+@contextmanager
+def tx(conn: sqlite3.Connection):
+    """Transação explícita (BEGIN IMMEDIATE ... COMMIT/ROLLBACK)"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+# Schema completo, idempotente via IF NOT EXISTS
+_SCHEMA_SQL = """
+BEGIN;
+
+-- Users table
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    password_hash BLOB NOT NULL,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    phone TEXT,
+    role TEXT NOT NULL DEFAULT 'customer',
+    status TEXT NOT NULL DEFAULT 'active',
+    created_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
+);
+
+-- Categories table
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    description TEXT,
+    image_url TEXT,
+    parent_id INTEGER,
+    is_active BOOLEAN DEFAULT 1,
+    created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
+    FOREIGN KEY(parent_id) REFERENCES categories(id)
+);
+
+-- Products table
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    description TEXT,
+    price DECIMAL(10,2) NOT NULL,
+    stock INTEGER NOT NULL DEFAULT 0,
+    category_id INTEGER,
+    image_url TEXT,
+    sku TEXT UNIQUE,
+    is_active BOOLEAN DEFAULT 1,
+    created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
+    updated_at INTEGER DEFAULT (strftime('%s','now')),
+    FOREIGN KEY(category_id) REFERENCES categories(id)
+);
+
+-- Cart table
+CREATE TABLE IF NOT EXISTS cart (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL DEFAULT 1,
+    created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
+    FOREIGN KEY(user_id) REFERENCES users(id),
+    FOREIGN KEY(product_id) REFERENCES products(id),
+    UNIQUE(user_id, product_id)
+);
+
+-- Orders table
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    order_number TEXT UNIQUE NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    total_amount DECIMAL(10,2) NOT NULL,
+    shipping_address TEXT,
+    billing_address TEXT,
+    payment_method TEXT,
+    payment_status TEXT DEFAULT 'pending',
+    created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
+    updated_at INTEGER DEFAULT (strftime('%s','now')),
+    FOREIGN KEY(user_id) REFERENCES users(id)
+);
+
+-- Order items table
+CREATE TABLE IF NOT EXISTS order_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    price DECIMAL(10,2) NOT NULL,
+    FOREIGN KEY(order_id) REFERENCES orders(id),
+    FOREIGN KEY(product_id) REFERENCES products(id)
+);
+
+-- Payment transactions table
+CREATE TABLE IF NOT EXISTS payment_transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER NOT NULL,
+    transaction_id TEXT UNIQUE NOT NULL,
+    payment_method TEXT NOT NULL,
+    amount DECIMAL(10,2) NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    gateway_response TEXT,
+    pix_key TEXT,
+    pix_qr_code TEXT,
+    boleto_number TEXT,
+    boleto_barcode TEXT,
+    boleto_due_date INTEGER,
+    card_last_four TEXT,
+    card_brand TEXT,
+    installments INTEGER DEFAULT 1,
+    created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
+    updated_at INTEGER DEFAULT (strftime('%s','now')),
+    expires_at INTEGER,
+    FOREIGN KEY(order_id) REFERENCES orders(id)
+);
+
+-- Pendentes em ordem de criação (monitor) sem varredura nem ordenação
+CREATE INDEX IF NOT EXISTS idx_pt_status_created ON payment_transactions(status, created_at);
+
+-- Payment notifications table
+CREATE TABLE IF NOT EXISTS payment_notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    transaction_id TEXT NOT NULL,
+    notification_type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    message TEXT,
+    processed_at INTEGER,
+    created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
+    FOREIGN KEY(transaction_id) REFERENCES payment_transactions(transaction_id)
+);
+
+-- Payment methods configuration table
+CREATE TABLE IF NOT EXISTS payment_methods_config (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    method_name TEXT UNIQUE NOT NULL,
+    is_active BOOLEAN DEFAULT 1,
+    processing_fee DECIMAL(5,2) DEFAULT 0.00,
+    min_amount DECIMAL(10,2) DEFAULT 0.00,
+    max_amount DECIMAL(10,2) DEFAULT 999999.99,
+    config_data TEXT,
+    created_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
+);
+
+-- Invoices table (Notas Fiscais)
+CREATE TABLE IF NOT EXISTS invoices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    invoice_number TEXT UNIQUE NOT NULL,
+    order_id INTEGER NOT NULL,
+    customer_name TEXT NOT NULL,
+    customer_email TEXT NOT NULL,
+    subtotal DECIMAL(10,2) NOT NULL,
+    tax_amount DECIMAL(10,2) NOT NULL,
+    total DECIMAL(10,2) NOT NULL,
+    payment_method TEXT,
+    status TEXT DEFAULT 'EMITIDA',
+    invoice_data BLOB NOT NULL,
+    created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
+    FOREIGN KEY(order_id) REFERENCES orders(id)
+);
+
+COMMIT;
+"""
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    """Aplica alterações de schema em bancos criados por versões anteriores"""
+    user_columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+    if 'password_quickcheck' in user_columns:
+        # Verificador rápido de senha (removido): o bcrypt é o único verificador.
+        # Apaga os digests antes; sem DROP COLUMN (SQLite < 3.35) a coluna fica vazia
+        conn.execute("UPDATE users SET password_quickcheck = NULL")
+        try:
+            conn.execute("ALTER TABLE users DROP COLUMN password_quickcheck")
+        except sqlite3.OperationalError:
+            pass
+
+    payment_columns = {row[1] for row in conn.execute("PRAGMA table_info(payment_transactions)")}
+    # Coluna, índice e preenchimento juntos: uma interrupção no meio não deixa pendentes sem prazo
+    with tx(conn):
+        if 'expires_at' not in payment_columns:
+            conn.execute("ALTER TABLE payment_transactions ADD COLUMN expires_at INTEGER")
+        # Expirados entre os pendentes sem varrer a tabela
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_pt_status_expires ON payment_transactions(status, expires_at)")
+        # Pendentes ainda sem prazo (bancos antigos): pelo índice acima, barato quando não há nenhum
+        for method, seconds in PAYMENT_EXPIRY_SECONDS.items():
+            conn.execute("""
+                UPDATE payment_transactions SET expires_at = created_at + ?
+                WHERE status = 'pending' AND expires_at IS NULL AND payment_method = ?
+            """, (seconds, method))
+
+    # Nome de categoria único, usado pelo INSERT OR IGNORE do seed
+    try:
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_categories_name ON categories(name)")
+    except sqlite3.IntegrityError as e:
+        print(f"Categorias duplicadas, índice único não criado: {e}")
+
+
+def init_db() -> None:
+    conn = get_conn()
+    conn.executescript(_SCHEMA_SQL)
+    _migrate(conn)
     conn.close()
 
 
@@ -191,66 +279,52 @@ def seed_initial_data() -> None:
     conn = get_conn()
     cur = conn.cursor()
 
-    # Check if admin user exists
-    cur.execute("SELECT COUNT(*) FROM users WHERE role = 'admin'")
-    admin_count = cur.fetchone()[0]
-    
-    if admin_count == 0:
-        # Create default admin
-        import bcrypt
-        admin_password = bcrypt.hashpw("admin123".encode('utf-8'), bcrypt.gensalt())
-        cur.execute("""
-            INSERT INTO users (username, email, password_hash, first_name, last_name, role)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, ("admin", "admin@ecommerce.com", admin_password, "Admin", "System", "admin"))
-
-    # Check if categories exist
-    cur.execute("SELECT COUNT(*) FROM categories")
-    cat_count = cur.fetchone()[0]
-    
-    if cat_count == 0:
-        # Insert default categories
-        categories = [
-            ("Eletrônicos", "Produtos eletrônicos em geral"),
-            ("Roupas", "Vestuário masculino e feminino"),
-            ("Casa e Jardim", "Itens para casa e jardim"),
-            ("Livros", "Livros e materiais educativos"),
-            ("Esportes", "Artigos esportivos")
-        ]
-        
-        for name, desc in categories:
+    # Default categories
+    categories = [
+        ("Eletrônicos", "Produtos eletrônicos em geral"),
+        ("Roupas", "Vestuário masculino e feminino"),
+        ("Casa e Jardim", "Itens para casa e jardim"),
+        ("Livros", "Livros e materiais educativos"),
+        ("Esportes", "Artigos esportivos")
+    ]
+
+    # Default products
+    products = [
+        ("Smartphone Galaxy S23", "O mais novo smartphone com o melhor custo-benefício", 899.99, 50, 1, "smartphone-01"),
+        ("Notebook Dell Inspiron", "Notebook para uso doméstico e profissional", 2499.99, 25, 1, "notebook-01"),
+        ("Camiseta Premium", "Camiseta 100% algodão", 49.99, 100, 2, "camiseta-01"),
+        ("Tênis Esportivo", "Tênis para corrida e caminhada", 299.99, 75, 5, "tenis-01"),
+        ("Smart Watch", "Relógio inteligente com GPS", 599.99, 30, 1, "smartwatch-01"),
+        ("Livro Python", "Aprenda Python do zero", 89.99, 200, 4, "livro-01")
+    ]
+
+    with tx(conn):
+        # Admin padrão só se não houver nenhum admin (renomeado ou não); o bcrypt só roda nesse caso
+        if not cur.execute("SELECT 1 FROM users WHERE role = 'admin' LIMIT 1").fetchone():
+            admin_password = bcrypt.hashpw("admin123".encode('utf-8'), bcrypt.gensalt())
             cur.execute("""
-                INSERT INTO categories (name, description)
+                INSERT OR IGNORE INTO users (username, email, password_hash, first_name, last_name, role)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, ("admin", "admin@ecommerce.com", admin_password, "Admin", "System", "admin"))
+
+        # Catálogo padrão só em tabelas vazias: itens apagados pelo operador não voltam
+        if not cur.execute("SELECT 1 FROM categories LIMIT 1").fetchone():
+            cur.executemany("""
+                INSERT OR IGNORE INTO categories (name, description)
                 VALUES (?, ?)
-            """, (name, desc))
-
-    # Check if products exist
-    cur.execute("SELECT COUNT(*) FROM products")
-    prod_count = cur.fetchone()[0]
-    
-    if prod_count == 0:
-        # Insert default products
-        products = [
-            ("Smartphone Galaxy S23", "O mais novo smartphone com o melhor custo-benefício", 899.99, 50, 1, "smartphone-01"),
-            ("Notebook Dell Inspiron", "Notebook para uso doméstico e profissional", 2499.99, 25, 1, "notebook-01"),
-            ("Camiseta Premium", "Camiseta 100% algodão", 49.99, 100, 2, "camiseta-01"),
-            ("Tênis Esportivo", "Tênis para corrida e caminhada", 299.99, 75, 5, "tenis-01"),
-            ("Smart Watch", "Relógio inteligente com GPS", 599.99, 30, 1, "smartwatch-01"),
-            ("Livro Python", "Aprenda Python do zero", 89.99, 200, 4, "livro-01")
-        ]
-        
-        for name, desc, price, stock, category, sku in products:
-            cur.execute("""
-                INSERT INTO products (name, description, price, stock, category_id, sku)
+            """, categories)
+
+        if not cur.execute("SELECT 1 FROM products LIMIT 1").fetchone():
+            cur.executemany("""
+                INSERT OR IGNORE INTO products (name, description, price, stock, category_id, sku)
                 VALUES (?, ?, ?, ?, ?, ?)
-            """, (name, desc, price, stock, category, sku))
+            """, products)
 
-    # Seed payment methods
-    seed_payment_methods()
-    
-    conn.commit()
     conn.close()
 
+    # Seed payment methods (conexão própria, fora da transação acima)
+    seed_payment_methods()
+
 
 # User functions
 def create_user(username: str, email: str, password_hash: bytes, first_name: str, last_name: str, phone: str = None) -> int:
@@ -295,7 +369,6 @@ def get_user_by_id(user_id: int) -> Optional[sqlite3.Row]:
 def authenticate_user(username: str, password: str) -> Optional[sqlite3.Row]:
     user = get_user_by_username(username)
     if user:
-        import bcrypt
         if bcrypt.checkpw(password.encode('utf-8'), user['password_hash']):
             return user
     return None
@@ -343,6 +416,19 @@ def get_product_by_id(product_id: int) -> Optional[sqlite3.Row]:
     return product
 
 
+def get_products_by_ids(product_ids: List[int]) -> List[sqlite3.Row]:
+    """Busca vários produtos ativos em uma única consulta"""
+    if not product_ids:
+        return []
+    conn = get_conn()
+    cur = conn.cursor()
+    placeholders = ",".join("?" * len(product_ids))
+    cur.execute(f"SELECT * FROM products WHERE id IN ({placeholders}) AND is_active = 1", list(product_ids))
+    products = cur.fetchall()
+    conn.close()
+    return products
+
+
 def update_product_stock(product_id: int, quantity: int, decrease: bool = False) -> bool:
     conn = get_conn()
     cur = conn.cursor()
@@ -382,28 +468,28 @@ def delete_product(product_id: int) -> bool:
     cur = conn.cursor()
     
     try:
-        # Verificar se o produto existe
-        cur.execute("SELECT id FROM products WHERE id = ?", (product_id,))
-        if not cur.fetchone():
-            return False
+        with tx(conn):
+            # Verificar se o produto existe
+            cur.execute("SELECT id FROM products WHERE id = ?", (product_id,))
+            if not cur.fetchone():
+                return False
         
-        # Verificar se há pedidos com este produto
-        cur.execute("""
-            SELECT COUNT(*) as count FROM order_items oi 
-            JOIN orders o ON oi.order_id = o.id 
-            WHERE oi.product_id = ? AND o.status IN ('pending', 'approved')
-        """, (product_id,))
+            # Verificar se há pedidos com este produto
+            cur.execute("""
+                SELECT COUNT(*) as count FROM order_items oi 
+                JOIN orders o ON oi.order_id = o.id 
+                WHERE oi.product_id = ? AND o.status IN ('pending', 'approved')
+            """, (product_id,))
         
-        active_orders = cur.fetchone()['count']
+            active_orders = cur.fetchone()['count']
         
-        if active_orders > 0:
-            # Se há pedidos ativos, apenas marcar como inativo
-            cur.execute("UPDATE products SET is_active = 0 WHERE id = ?", (product_id,))
-        else:
-            # Se não há pedidos ativos, pode excluir completamente
-            cur.execute("DELETE FROM products WHERE id = ?", (product_id,))
+            if active_orders > 0:
+                # Se há pedidos ativos, apenas marcar como inativo
+                cur.execute("UPDATE products SET is_active = 0 WHERE id = ?", (product_id,))
+            else:
+                # Se não há pedidos ativos, pode excluir completamente
+                cur.execute("DELETE FROM products WHERE id = ?", (product_id,))
         
-        conn.commit()
         return True
     except Exception as e:
         print(f"Erro ao excluir produto: {e}")
@@ -418,17 +504,17 @@ def add_to_cart(user_id: int, product_id: int, quantity: int = 1) -> bool:
     cur = conn.cursor()
     
     try:
-        existing = cur.execute("SELECT * FROM cart WHERE user_id = ? AND product_id = ?", 
-                             (user_id, product_id)).fetchone()
+        with tx(conn):
+            existing = cur.execute("SELECT * FROM cart WHERE user_id = ? AND product_id = ?", 
+                                 (user_id, product_id)).fetchone()
         
-        if existing:
-            cur.execute("UPDATE cart SET quantity = quantity + ? WHERE user_id = ? AND product_id = ?",
-                       (quantity, user_id, product_id))
-        else:
-            cur.execute("INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)",
-                       (user_id, product_id, quantity))
+            if existing:
+                cur.execute("UPDATE cart SET quantity = quantity + ? WHERE user_id = ? AND product_id = ?",
+                           (quantity, user_id, product_id))
+            else:
+                cur.execute("INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)",
+                           (user_id, product_id, quantity))
         
-        conn.commit()
         return True
     except:
         return False
@@ -495,34 +581,33 @@ def create_order(user_id: int, cart_items: List, shipping_address: str, payment_
         # Generate order number
         order_number = f"ORD-{datetime.now().strftime('%Y%m%d%H%M%S')}{user_id}"
         
-        # Create order
-        cur.execute("""
-            INSERT INTO orders (user_id, order_number, total_amount, shipping_address, payment_method)
-            VALUES (?, ?, ?, ?, ?)
-        """, (user_id, order_number, total, shipping_address, payment_method))
+        with tx(conn):
+            # Create order
+            cur.execute("""
+                INSERT INTO orders (user_id, order_number, total_amount, shipping_address, payment_method)
+                VALUES (?, ?, ?, ?, ?)
+            """, (user_id, order_number, total, shipping_address, payment_method))
         
-        order_id = cur.lastrowid
+            order_id = cur.lastrowid
         
-        # Create order items
-        for item in cart_items:
-            # Usar 'id' se disponível, senão usar 'product_id'
-            product_id = item['id'] if 'id' in item.keys() else item['product_id']
-            cur.execute("""
-                INSERT INTO order_items (order_id, product_id, quantity, price)
-                VALUES (?, ?, ?, ?)
-            """, (order_id, product_id, item['quantity'], item['price']))
+            # Create order items
+            for item in cart_items:
+                # Usar 'id' se disponível, senão usar 'product_id'
+                product_id = item['id'] if 'id' in item.keys() else item['product_id']
+                cur.execute("""
+                    INSERT INTO order_items (order_id, product_id, quantity, price)
+                    VALUES (?, ?, ?, ?)
+                """, (order_id, product_id, item['quantity'], item['price']))
             
-            # Update stock
-            cur.execute("UPDATE products SET stock = stock - ? WHERE id = ?", (item['quantity'], product_id))
+                # Update stock
+                cur.execute("UPDATE products SET stock = stock - ? WHERE id = ?", (item['quantity'], product_id))
         
-        # Clear cart
-        cur.execute("DELETE FROM cart WHERE user_id = ?", (user_id,))
+            # Clear cart
+            cur.execute("DELETE FROM cart WHERE user_id = ?", (user_id,))
         
-        conn.commit()
         return order_id
         
     except Exception as e:
-        conn.rollback()
         return None
     finally:
         conn.close()
@@ -609,58 +694,56 @@ def update_product(product_id: int, name: str = None, description: str = None,
     cur = conn.cursor()
     
     try:
-        # Verificar se o produto existe
-        cur.execute("SELECT id FROM products WHERE id = ?", (product_id,))
-        if not cur.fetchone():
-            print(f"Produto com ID {product_id} não encontrado")
-            return False
+        with tx(conn):
+            # Verificar se o produto existe
+            cur.execute("SELECT id FROM products WHERE id = ?", (product_id,))
+            if not cur.fetchone():
+                print(f"Produto com ID {product_id} não encontrado")
+                return False
         
-        # Construir query dinâmica
-        fields_to_update = []
-        values = []
+            # Construir query dinâmica
+            fields_to_update = []
+            values = []
         
-        if name is not None:
-            fields_to_update.append('name = ?')
-            values.append(name)
-        if description is not None:
-            fields_to_update.append('description = ?')
-            values.append(description)
-        if price is not None:
-            fields_to_update.append('price = ?')
-            values.append(price)
-        if stock is not None:
-            fields_to_update.append('stock = ?')
-            values.append(stock)
-        if category_id is not None:
-            fields_to_update.append('category_id = ?')
-            values.append(category_id)
-        if image_url is not None:
-            fields_to_update.append('image_url = ?')
-            values.append(image_url)
-        if sku is not None:
-            fields_to_update.append('sku = ?')
-            values.append(sku)
+            if name is not None:
+                fields_to_update.append('name = ?')
+                values.append(name)
+            if description is not None:
+                fields_to_update.append('description = ?')
+                values.append(description)
+            if price is not None:
+                fields_to_update.append('price = ?')
+                values.append(price)
+            if stock is not None:
+                fields_to_update.append('stock = ?')
+                values.append(stock)
+            if category_id is not None:
+                fields_to_update.append('category_id = ?')
+                values.append(category_id)
+            if image_url is not None:
+                fields_to_update.append('image_url = ?')
+                values.append(image_url)
+            if sku is not None:
+                fields_to_update.append('sku = ?')
+                values.append(sku)
         
-        if fields_to_update:
-            import time
-            fields_to_update.append('updated_at = ?')
-            values.append(int(time.time()))
+            if fields_to_update:
+                fields_to_update.append('updated_at = ?')
+                values.append(int(_now()))
             
-            query = f"UPDATE products SET {', '.join(fields_to_update)} WHERE id = ?"
-            values.append(product_id)
+                query = f"UPDATE products SET {', '.join(fields_to_update)} WHERE id = ?"
+                values.append(product_id)
             
-            cur.execute(query, values)
-            conn.commit()
+                cur.execute(query, values)
             
-            # Verificar se a atualização foi bem-sucedida
-            rows_affected = cur.rowcount
-            return rows_affected > 0
-        else:
-            return False
+                # Verificar se a atualização foi bem-sucedida
+                rows_affected = cur.rowcount
+                return rows_affected > 0
+            else:
+                return False
             
     except Exception as e:
         print(f"Erro ao atualizar produto: {e}")
-        conn.rollback()
         return False
     finally:
         conn.close()
@@ -688,12 +771,11 @@ def update_order_status(order_id: int, status: str) -> bool:
     cur = conn.cursor()
     
     try:
-        import time
         cur.execute("""
             UPDATE orders 
             SET status = ?, updated_at = ? 
             WHERE id = ?
-        """, (status, int(time.time()), order_id))
+        """, (status, int(_now()), order_id))
         
         conn.commit()
         return True
@@ -738,6 +820,9 @@ def get_order_details_full(order_id: int):
 def create_payment_transaction(order_id: int, transaction_id: str, payment_method: str, 
                              amount: float, **kwargs) -> int:
     """Criar nova transação de pagamento"""
+    expiry = PAYMENT_EXPIRY_SECONDS.get(payment_method)
+    expires_at = int(_now()) + expiry if expiry else None
+    
     conn = get_conn()
     cur = conn.cursor()
     
@@ -747,13 +832,14 @@ def create_payment_transaction(order_id: int, transaction_id: str, payment_metho
                 order_id, transaction_id, payment_method, amount, status,
                 gateway_response, pix_key, pix_qr_code, boleto_number, 
                 boleto_barcode, boleto_due_date, card_last_four, 
-                card_brand, installments
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                card_brand, installments, expires_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (
             order_id, transaction_id, payment_method, amount, kwargs.get('status', 'pending'),
             kwargs.get('gateway_response'), kwargs.get('pix_key'), kwargs.get('pix_qr_code'),
             kwargs.get('boleto_number'), kwargs.get('boleto_barcode'), kwargs.get('boleto_due_date'),
-            kwargs.get('card_last_four'), kwargs.get('card_brand'), kwargs.get('installments', 1)
+            kwargs.get('card_last_four'), kwargs.get('card_brand'), kwargs.get('installments', 1),
+            expires_at
         ))
         
         payment_id = cur.lastrowid
@@ -772,12 +858,11 @@ def update_payment_status(transaction_id: str, status: str, gateway_response: st
     cur = conn.cursor()
     
     try:
-        import time
         cur.execute("""
             UPDATE payment_transactions 
             SET status = ?, gateway_response = ?, updated_at = ?
             WHERE transaction_id = ?
-        """, (status, gateway_response, int(time.time()), transaction_id))
+        """, (status, gateway_response, int(_now()), transaction_id))
         
         conn.commit()
         return True
@@ -787,6 +872,54 @@ def update_payment_status(transaction_id: str, status: str, gateway_response: st
         conn.close()
 
 
+def apply_payment_checks(approved: List[Tuple[str, str, str]], failed: List[str]) -> Optional[Tuple[int, int]]:
+    """Aplica em lote o resultado da verificação de pendentes.
+
+    approved: (transaction_id, gateway_response, mensagem) -> aprovado + notificação
+    failed: transaction_ids expirados -> 'failed'
+
+    Só linhas ainda 'pending' mudam (outra verificação simultânea pode ter
+    chegado antes) e só elas geram notificação. Retorna (aprovados, falhos)
+    efetivamente gravados, ou None se nada foi gravado.
+    """
+    if not approved and not failed:
+        return 0, 0
+    
+    conn = get_conn()
+    cur = conn.cursor()
+    now = int(_now())
+    
+    try:
+        with tx(conn):
+            notifications = []
+            for tid, response, message in approved:
+                cur.execute("""
+                    UPDATE payment_transactions 
+                    SET status = 'approved', gateway_response = ?, updated_at = ?
+                    WHERE transaction_id = ? AND status = 'pending'
+                """, (response, now, tid))
+                if cur.rowcount:
+                    notifications.append((tid, message, now))
+            cur.executemany("""
+                INSERT INTO payment_notifications (
+                    transaction_id, notification_type, status, message, processed_at
+                ) VALUES (?, 'payment_approved', 'success', ?, ?)
+            """, notifications)
+            failed_count = 0
+            if failed:
+                cur.executemany("""
+                    UPDATE payment_transactions 
+                    SET status = 'failed', gateway_response = 'Pagamento expirado', updated_at = ?
+                    WHERE transaction_id = ? AND status = 'pending'
+                """, [(now, tid) for tid in failed])
+                failed_count = cur.rowcount
+        return len(notifications), failed_count
+    except Exception as e:
+        return None
+    finally:
+        conn.close()
+
+
 def get_payment_transaction(transaction_id: str):
     """Obter transação de pagamento por ID"""
     conn = get_conn()
@@ -820,12 +953,11 @@ def create_payment_notification(transaction_id: str, notification_type: str,
     cur = conn.cursor()
     
     try:
-        import time
         cur.execute("""
             INSERT INTO payment_notifications (
                 transaction_id, notification_type, status, message, processed_at
             ) VALUES (?, ?, ?, ?, ?)
-        """, (transaction_id, notification_type, status, message, int(time.time())))
+        """, (transaction_id, notification_type, status, message, int(_now())))
         
         notification_id = cur.lastrowid
         conn.commit()
@@ -921,27 +1053,21 @@ def seed_payment_methods():
     cur = conn.cursor()
     
     try:
-        # Verificar se já existem métodos
-        cur.execute("SELECT COUNT(*) FROM payment_methods_config")
-        count = cur.fetchone()[0]
-        
-        if count == 0:
-            payment_methods = [
-                ("PIX", 1, 0.00, 0.01, 999999.99, '{"instant": true, "qr_code": true}'),
-                ("Cartão de Crédito", 1, 2.99, 1.00, 999999.99, '{"installments": true, "brands": ["visa", "mastercard", "elo"]}'),
-                ("Cartão de Débito", 1, 1.50, 1.00, 999999.99, '{"installments": false, "brands": ["visa", "mastercard", "elo"], "instant": true}'),
-                ("Boleto Bancário", 1, 0.00, 1.00, 999999.99, '{"due_days": 3, "bank_slip": true}')
-            ]
-            
-            for method_name, is_active, processing_fee, min_amount, max_amount, config_data in payment_methods:
-                cur.execute("""
-                    INSERT INTO payment_methods_config (
-                        method_name, is_active, processing_fee, min_amount, max_amount, config_data
-                    ) VALUES (?, ?, ?, ?, ?, ?)
-                """, (method_name, is_active, processing_fee, min_amount, max_amount, config_data))
+        payment_methods = [
+            ("PIX", 1, 0.00, 0.01, 999999.99, '{"instant": true, "qr_code": true}'),
+            ("Cartão de Crédito", 1, 2.99, 1.00, 999999.99, '{"installments": true, "brands": ["visa", "mastercard", "elo"]}'),
+            ("Cartão de Débito", 1, 1.50, 1.00, 999999.99, '{"installments": false, "brands": ["visa", "mastercard", "elo"], "instant": true}'),
+            ("Boleto Bancário", 1, 0.00, 1.00, 999999.99, '{"due_days": 3, "bank_slip": true}')
+        ]
         
-        conn.commit()
+        with tx(conn):
+            # method_name é UNIQUE: métodos já cadastrados são ignorados
+            cur.executemany("""
+                INSERT OR IGNORE INTO payment_methods_config (
+                    method_name, is_active, processing_fee, min_amount, max_amount, config_data
+                ) VALUES (?, ?, ?, ?, ?, ?)
+            """, payment_methods)
     except Exception as e:
-        conn.rollback()
+        pass
     finally:
         conn.close()
@@ -5,33 +5,83 @@ Automatiza o processo de deploy e configuração
 
 import os
 import sys
+import atexit
+import logging
+import logging.handlers
+import queue
+import shutil
 import subprocess
+import threading
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+LOG_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
 class DeployManager:
     def __init__(self):
         self.start_time = datetime.now()
         self.log_file = f"deploy_{self.start_time.strftime('%Y%m%d_%H%M%S')}.log"
+        # Log assíncrono: as mensagens vão para uma fila e uma thread
+        # grava no terminal e no arquivo sem bloquear o deploy
+        formatter = logging.Formatter("[%(asctime)s] %(message)s", LOG_TIME_FORMAT)
+        file_handler = logging.FileHandler(self.log_file, encoding="utf-8")
+        stream_handler = logging.StreamHandler(sys.stdout)
+        file_handler.setFormatter(formatter)
+        stream_handler.setFormatter(formatter)
+        log_queue = queue.Queue(-1)
+        self._listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler)
+        self._listener.start()
+        atexit.register(self.stop_logging)
+        self._logger = logging.getLogger(f"deploy.{id(self)}")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        self._logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        # Sessão HTTP reaproveitada entre as verificações (keep-alive)
+        self._http = requests.Session()
+        self._http.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=0))
+        # Caminhos dos executáveis resolvidos uma única vez
+        self._bin_cache = {}
         
     def log(self, message):
         """Log de mensagens"""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_message = f"[{timestamp}] {message}"
-        print(log_message)
-        
-        with open(self.log_file, "a", encoding="utf-8") as f:
-            f.write(log_message + "\n")
+        self._logger.info(message)
+    
+    def stop_logging(self):
+        """Esvaziar a fila de log e encerrar a thread de escrita"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
     
-    def run_command(self, command, description=""):
-        """Executar comando e capturar resultado"""
+    def _which(self, name):
+        """Caminho completo de um executável (cacheado)"""
+        if name not in self._bin_cache:
+            self._bin_cache[name] = shutil.which(name)
+        return self._bin_cache[name]
+    
+    def run_command(self, cmd_list, description="", stream=False):
+        """Executar comando (lista de argumentos, sem shell) e capturar resultado
+        
+        Com stream=True a saída é registrada linha a linha enquanto o
+        comando roda, sem acumular tudo em memória.
+        """
+        command = " ".join(cmd_list)
         self.log(f"Executando: {description or command}")
         
+        binary = self._which(cmd_list[0])
+        if binary is None:
+            self.log(f"❌ Erro: {description or command}")
+            self.log(f"Erro: executável '{cmd_list[0]}' não encontrado")
+            return False
+        
+        if stream:
+            return self._run_streaming([binary, *cmd_list[1:]], description or command)
+        
         try:
             result = subprocess.run(
-                command, 
-                shell=True, 
+                [binary, *cmd_list[1:]],
                 capture_output=True, 
                 text=True, 
                 check=True
@@ -45,6 +95,25 @@ class DeployManager:
             self.log(f"Erro: {e.stderr}")
             return False
     
+    def _run_streaming(self, argv, description):
+        """Executar comando enviando stdout/stderr para o log linha a linha"""
+        with subprocess.Popen(
+            argv,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1
+        ) as proc:
+            for line in proc.stdout:
+                self.log(line.rstrip())
+            returncode = proc.wait()
+        
+        if returncode != 0:
+            self.log(f"❌ Erro: {description} (código {returncode})")
+            return False
+        self.log(f"✅ Sucesso: {description}")
+        return True
+    
     def check_dependencies(self):
         """Verificar dependências necessárias"""
         self.log("🔍 Verificando dependências...")
@@ -56,7 +125,7 @@ class DeployManager:
         ]
         
         for cmd, name in dependencies:
-            if not self.run_command(f"which {cmd}", f"Verificar {name}"):
+            if self._which(cmd) is None:
                 self.log(f"❌ {name} não encontrado!")
                 return False
         
@@ -68,8 +137,9 @@ class DeployManager:
         self.log("📦 Instalando dependências Python...")
         
         if not self.run_command(
-            "pip install -r requirements_fastapi.txt",
-            "Instalar dependências FastAPI"
+            ["pip", "install", "-r", "requirements_fastapi.txt"],
+            "Instalar dependências FastAPI",
+            stream=True
         ):
             return False
         
@@ -81,8 +151,9 @@ class DeployManager:
         self.log("🐳 Construindo imagens Docker...")
         
         if not self.run_command(
-            "docker-compose build",
-            "Construir imagens Docker"
+            ["docker-compose", "build"],
+            "Construir imagens Docker",
+            stream=True
         ):
             return False
         
@@ -94,7 +165,7 @@ class DeployManager:
         self.log("🚀 Iniciando serviços...")
         
         if not self.run_command(
-            "docker-compose up -d",
+            ["docker-compose", "up", "-d"],
             "Iniciar serviços Docker"
         ):
             return False
@@ -102,32 +173,60 @@ class DeployManager:
         self.log("✅ Serviços iniciados")
         return True
     
+    def _probe(self, url, head=True):
+        """Status HTTP de um endpoint sem baixar o corpo da resposta"""
+        if head:
+            response = self._http.head(url, timeout=5, allow_redirects=True)
+            if response.status_code != 405:
+                return response.status_code
+        # Endpoints sem HEAD: GET em streaming, fechado antes de ler o corpo
+        response = self._http.get(url, timeout=5, stream=True)
+        response.close()
+        return response.status_code
+    
+    def _wait_one(self, url, name, timeout, head=True, stop=None):
+        """Aguardar um único serviço responder 200 (stop: Event que interrompe a espera)"""
+        self.log(f"Aguardando {name}...")
+        stop = stop or threading.Event()
+        start_time = time.time()
+        
+        while time.time() - start_time < timeout and not stop.is_set():
+            try:
+                if self._probe(url, head) == 200:
+                    self.log(f"✅ {name} está pronto")
+                    return True
+            except requests.RequestException:
+                pass
+            
+            stop.wait(0.5)
+        
+        if not stop.is_set():
+            self.log(f"❌ {name} não ficou pronto em {timeout}s")
+        return False
+    
     def wait_for_services(self, timeout=60):
         """Aguardar serviços ficarem prontos"""
         self.log("⏳ Aguardando serviços ficarem prontos...")
         
         services = [
-            ("http://localhost:8000/health", "FastAPI"),
-            ("http://localhost:8501", "Streamlit")
+            ("http://localhost:8000/health", "FastAPI", True),
+            ("http://localhost:8501", "Streamlit", False)
         ]
         
-        for url, name in services:
-            self.log(f"Aguardando {name}...")
-            start_time = time.time()
-            
-            while time.time() - start_time < timeout:
-                try:
-                    response = requests.get(url, timeout=5)
-                    if response.status_code == 200:
-                        self.log(f"✅ {name} está pronto")
-                        break
-                except requests.RequestException:
-                    pass
-                
-                time.sleep(2)
-            else:
-                self.log(f"❌ {name} não ficou pronto em {timeout}s")
-                return False
+        # Serviços verificados em paralelo: o tempo total é o do mais lento
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=len(services))
+        futures = [executor.submit(self._wait_one, url, name, timeout, head, stop)
+                   for url, name, head in services]
+        try:
+            for future in as_completed(futures):
+                if not future.result():
+                    return False
+        finally:
+            # Um serviço já falhou: as esperas restantes param no próximo ciclo
+            # (no máximo o timeout de uma sonda), sem segurar a saída do script
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
         
         return True
     
@@ -136,8 +235,9 @@ class DeployManager:
         self.log("🧪 Executando testes...")
         
         if not self.run_command(
-            "python test_fastapi.py",
-            "Executar testes da API"
+            ["python", "test_fastapi.py"],
+            "Executar testes da API",
+            stream=True
         ):
             self.log("⚠️ Alguns testes falharam, mas continuando...")
         
@@ -148,21 +248,21 @@ class DeployManager:
         """Mostrar status dos serviços"""
         self.log("📊 Status dos serviços:")
         
-        self.run_command("docker-compose ps", "Status dos containers")
+        self.run_command(["docker-compose", "ps"], "Status dos containers")
         
         # Testar endpoints
         endpoints = [
-            ("http://localhost:8000/", "API Root"),
-            ("http://localhost:8000/health", "Health Check"),
-            ("http://localhost:8000/docs", "API Documentation"),
-            ("http://localhost:8501", "Streamlit App")
+            ("http://localhost:8000/", "API Root", True),
+            ("http://localhost:8000/health", "Health Check", True),
+            ("http://localhost:8000/docs", "API Documentation", False),
+            ("http://localhost:8501", "Streamlit App", False)
         ]
         
-        for url, name in endpoints:
+        for url, name, head in endpoints:
             try:
-                response = requests.get(url, timeout=5)
-                status = "✅" if response.status_code == 200 else "❌"
-                self.log(f"{status} {name}: {response.status_code}")
+                status_code = self._probe(url, head)
+                status = "✅" if status_code == 200 else "❌"
+                self.log(f"{status} {name}: {status_code}")
             except requests.RequestException as e:
                 self.log(f"❌ {name}: Erro - {e}")
     
@@ -171,7 +271,7 @@ class DeployManager:
         self.log("🧹 Limpando recursos...")
         
         self.run_command(
-            "docker-compose down",
+            ["docker-compose", "down"],
             "Parar serviços Docker"
         )
         
@@ -215,6 +315,7 @@ def main():
     
     try:
         success = deploy_manager.deploy()
+        deploy_manager.stop_logging()
         
         if success:
             print("\n✅ Deploy realizado com sucesso!")
@@ -231,10 +332,12 @@ def main():
     except KeyboardInterrupt:
         print("\n⏹️ Deploy interrompido pelo usuário")
         deploy_manager.cleanup()
+        deploy_manager.stop_logging()
         sys.exit(1)
     except Exception as e:
         print(f"\n💥 Erro inesperado: {e}")
         deploy_manager.cleanup()
+        deploy_manager.stop_logging()
         sys.exit(1)
 
 if __name__ == "__main__":
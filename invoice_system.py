@@ -8,8 +8,70 @@ import sqlite3
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 import json
+import threading
+import pandas as pd
 import streamlit as st
-from database import get_conn, get_order_details_full, get_user_by_id, get_product_by_id
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+from database import get_conn, tx, get_order_details_full, get_user_by_id, get_products_by_ids
+
+_SCHEMA_READY = False
+# Cabeçalho de um frame zstd; BLOBs sem ele são JSON em bytes
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+_INSERT_INVOICE_SQL = """
+    INSERT INTO invoices (
+        invoice_number, order_id, customer_name, customer_email,
+        subtotal, tax_amount, total, payment_method, status, invoice_data
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+_INDEXES = {
+    # Filtro status='completed' + ORDER BY created_at DESC (relatório e seleção de pedidos)
+    "idx_orders_status_created": "CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, created_at DESC)",
+    # get_invoices_by_order
+    "idx_invoices_order_created": "CREATE INDEX IF NOT EXISTS idx_invoices_order_created ON invoices(order_id, created_at DESC)",
+}
+
+
+def _ensure_schema(conn: sqlite3.Connection) -> None:
+    """Cria a tabela de notas fiscais e os índices uma única vez por processo"""
+    global _SCHEMA_READY
+    if _SCHEMA_READY:
+        return
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS invoices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            invoice_number TEXT UNIQUE NOT NULL,
+            order_id INTEGER NOT NULL,
+            customer_name TEXT NOT NULL,
+            customer_email TEXT NOT NULL,
+            subtotal DECIMAL(10,2) NOT NULL,
+            tax_amount DECIMAL(10,2) NOT NULL,
+            total DECIMAL(10,2) NOT NULL,
+            payment_method TEXT,
+            status TEXT DEFAULT 'EMITIDA',
+            invoice_data BLOB NOT NULL,
+            created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
+            FOREIGN KEY(order_id) REFERENCES orders(id)
+        )
+    """)
+    for sql in _INDEXES.values():
+        conn.execute(sql)
+    # Estatísticas para o planner escolher os índices recém-criados
+    if not existing.issuperset(_INDEXES):
+        conn.execute("ANALYZE")
+    _SCHEMA_READY = True
 
 class InvoiceGenerator:
     """Gerador de notas fiscais e relatórios"""
@@ -27,6 +89,46 @@ class InvoiceGenerator:
             "telefone": "(11) 99999-9999",
             "email": "contato@estore.com"
         }
+        # Conexão única reaproveitada por todos os métodos (inclusive entre threads do Streamlit);
+        # todo uso fica sob _conn_lock, senão transações de sessões diferentes se misturam
+        self._conn = get_conn(check_same_thread=False)
+        self._conn_lock = threading.Lock()
+        # JSON da nota comprimido com zstd; compressor/descompressor reaproveitados
+        self._zstd_lock = threading.Lock()
+        if ZSTD_AVAILABLE:
+            self._compressor = zstandard.ZstdCompressor(level=3)
+            self._decompressor = zstandard.ZstdDecompressor()
+        with self._conn_lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            _ensure_schema(self._conn)
+    
+    def close(self) -> None:
+        """Fecha a conexão com o banco"""
+        with self._conn_lock:
+            self._conn.close()
+    
+    def _encode_invoice(self, invoice: Dict):
+        """Serializa a nota para a coluna invoice_data"""
+        if ORJSON_AVAILABLE:
+            data = orjson.dumps(invoice, option=orjson.OPT_NON_STR_KEYS)
+        else:
+            data = json.dumps(invoice, ensure_ascii=False).encode("utf-8")
+        if not ZSTD_AVAILABLE:
+            return data.decode("utf-8")
+        with self._zstd_lock:
+            return self._compressor.compress(data)
+    
+    def _decode_invoice(self, data) -> Dict:
+        """Lê invoice_data: BLOB zstd, JSON em bytes ou JSON em texto (notas antigas)"""
+        if isinstance(data, bytes) and data[:4] == _ZSTD_MAGIC:
+            if not ZSTD_AVAILABLE:
+                raise RuntimeError("Nota fiscal comprimida com zstd, mas o pacote zstandard não está instalado")
+            with self._zstd_lock:
+                data = self._decompressor.decompress(data)
+        if ORJSON_AVAILABLE:
+            return orjson.loads(data)
+        return json.loads(data)
     
     def generate_invoice(self, order_id: int) -> Dict:
         """Gera nota fiscal para um pedido"""
@@ -54,10 +156,11 @@ class InvoiceGenerator:
             total = subtotal + tax_amount
             
             # Estrutura da nota fiscal
+            now = datetime.now()
             invoice = {
                 "invoice_number": invoice_number,
-                "invoice_date": datetime.now().strftime("%d/%m/%Y"),
-                "invoice_time": datetime.now().strftime("%H:%M:%S"),
+                "invoice_date": now.strftime("%d/%m/%Y"),
+                "invoice_time": now.strftime("%H:%M:%S"),
                 "order_number": order["order_number"],
                 "order_id": order_id,
                 
@@ -88,12 +191,14 @@ class InvoiceGenerator:
                 
                 # Status
                 "status": "EMITIDA",
-                "created_at": datetime.now().isoformat()
+                "created_at": now.isoformat()
             }
             
-            # Processar itens
+            # Processar itens (produtos buscados em uma única consulta)
+            product_ids = list({item["product_id"] for item in items})
+            products = {p["id"]: p for p in get_products_by_ids(product_ids)}
             for item in items:
-                product = get_product_by_id(item["product_id"])
+                product = products.get(item["product_id"])
                 if product:
                     invoice["items"].append({
                         "product_id": item["product_id"],
@@ -125,49 +230,21 @@ class InvoiceGenerator:
     def _save_invoice(self, invoice: Dict) -> bool:
         """Salva nota fiscal no banco de dados"""
         try:
-            conn = get_conn()
-            cur = conn.cursor()
-            
-            # Criar tabela se não existir
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS invoices (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    invoice_number TEXT UNIQUE NOT NULL,
-                    order_id INTEGER NOT NULL,
-                    customer_name TEXT NOT NULL,
-                    customer_email TEXT NOT NULL,
-                    subtotal DECIMAL(10,2) NOT NULL,
-                    tax_amount DECIMAL(10,2) NOT NULL,
-                    total DECIMAL(10,2) NOT NULL,
-                    payment_method TEXT,
-                    status TEXT DEFAULT 'EMITIDA',
-                    invoice_data TEXT NOT NULL,
-                    created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
-                    FOREIGN KEY(order_id) REFERENCES orders(id)
-                )
-            """)
+            with self._conn_lock, tx(self._conn):
+                # Inserir nota fiscal
+                self._conn.execute(_INSERT_INVOICE_SQL, (
+                    invoice["invoice_number"],
+                    invoice["order_id"],
+                    invoice["customer"]["name"],
+                    invoice["customer"]["email"],
+                    invoice["subtotal"],
+                    invoice["tax_amount"],
+                    invoice["total"],
+                    invoice["payment_method"],
+                    invoice["status"],
+                    self._encode_invoice(invoice)
+                ))
             
-            # Inserir nota fiscal
-            cur.execute("""
-                INSERT INTO invoices (
-                    invoice_number, order_id, customer_name, customer_email,
-                    subtotal, tax_amount, total, payment_method, status, invoice_data
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                invoice["invoice_number"],
-                invoice["order_id"],
-                invoice["customer"]["name"],
-                invoice["customer"]["email"],
-                invoice["subtotal"],
-                invoice["tax_amount"],
-                invoice["total"],
-                invoice["payment_method"],
-                invoice["status"],
-                json.dumps(invoice, ensure_ascii=False)
-            ))
-            
-            conn.commit()
-            conn.close()
             return True
             
         except Exception as e:
@@ -177,15 +254,13 @@ class InvoiceGenerator:
     def get_invoice(self, invoice_number: str) -> Optional[Dict]:
         """Busca nota fiscal por número"""
         try:
-            conn = get_conn()
-            cur = conn.cursor()
-            
-            cur.execute("SELECT * FROM invoices WHERE invoice_number = ?", (invoice_number,))
-            row = cur.fetchone()
-            conn.close()
+            with self._conn_lock:
+                row = self._conn.execute(
+                    "SELECT invoice_data FROM invoices WHERE invoice_number = ?", (invoice_number,)
+                ).fetchone()
             
             if row:
-                return json.loads(row["invoice_data"])
+                return self._decode_invoice(row["invoice_data"])
             return None
             
         except Exception as e:
@@ -195,108 +270,140 @@ class InvoiceGenerator:
     def get_invoices_by_order(self, order_id: int) -> List[Dict]:
         """Busca notas fiscais de um pedido"""
         try:
-            conn = get_conn()
-            cur = conn.cursor()
-            
-            cur.execute("SELECT * FROM invoices WHERE order_id = ? ORDER BY created_at DESC", (order_id,))
-            rows = cur.fetchall()
-            conn.close()
-            
-            invoices = []
-            for row in rows:
-                invoices.append(json.loads(row["invoice_data"]))
-            
-            return invoices
+            with self._conn_lock:
+                rows = self._conn.execute(
+                    "SELECT invoice_data FROM invoices WHERE order_id = ? ORDER BY created_at DESC", (order_id,)
+                ).fetchall()
+            return [self._decode_invoice(row[0]) for row in rows]
             
         except Exception as e:
             print(f"Erro ao buscar notas fiscais: {e}")
             return []
     
-    def generate_sales_report(self, start_date: str = None, end_date: str = None) -> Dict:
-        """Gera relatório de vendas"""
+    def generate_sales_report(self, start_date: str = None, end_date: str = None,
+                              include_orders: bool = False) -> Dict:
+        """Gera relatório de vendas (agregações feitas no SQLite)"""
         try:
-            conn = get_conn()
-            cur = conn.cursor()
-            
-            # Query base
-            query = """
-                SELECT 
-                    o.id,
-                    o.order_number,
-                    o.total_amount,
-                    o.payment_method,
-                    o.payment_status,
-                    o.created_at,
-                    u.first_name,
-                    u.last_name,
-                    u.email
-                FROM orders o
-                JOIN users u ON o.user_id = u.id
-                WHERE o.status = 'completed'
-            """
-            
+            # Filtro base, compartilhado pelas consultas via CTE
+            where = "o.status = 'completed'"
             params = []
             if start_date:
                 start_timestamp = int(datetime.strptime(start_date, "%Y-%m-%d").timestamp())
-                query += " AND o.created_at >= ?"
+                where += " AND o.created_at >= ?"
                 params.append(start_timestamp)
             
             if end_date:
                 end_timestamp = int(datetime.strptime(end_date, "%Y-%m-%d").timestamp()) + 86399
-                query += " AND o.created_at <= ?"
+                where += " AND o.created_at <= ?"
                 params.append(end_timestamp)
             
-            query += " ORDER BY o.created_at DESC"
-            
-            cur.execute(query, params)
-            orders = cur.fetchall()
-            
-            # Calcular estatísticas
-            total_orders = len(orders)
-            total_revenue = sum(float(order["total_amount"]) for order in orders)
+            filtered = f"""
+                WITH f AS (
+                    SELECT o.total_amount, o.payment_method, o.created_at
+                    FROM orders o
+                    JOIN users u ON o.user_id = u.id
+                    WHERE {where}
+                )
+            """
             
-            # Vendas por método de pagamento
-            payment_methods = {}
-            for order in orders:
-                method = order["payment_method"] or "Não informado"
-                if method not in payment_methods:
-                    payment_methods[method] = {"count": 0, "amount": 0}
-                payment_methods[method]["count"] += 1
-                payment_methods[method]["amount"] += float(order["total_amount"])
+            with self._conn_lock:
+                cur = self._conn.cursor()
+                
+                # Calcular estatísticas
+                cur.execute(filtered + "SELECT COUNT(*), COALESCE(SUM(total_amount), 0) FROM f", params)
+                total_orders, total_revenue = cur.fetchone()
+                total_revenue = float(total_revenue)
+            
+                # Vendas por método de pagamento
+                cur.execute(filtered + """
+                    SELECT COALESCE(payment_method, 'Não informado'), COUNT(*), SUM(total_amount)
+                    FROM f GROUP BY 1 ORDER BY 1
+                """, params)
+                payment_methods = {
+                    method: {"count": count, "amount": float(amount)}
+                    for method, count, amount in cur.fetchall()
+                }
             
-            # Vendas por dia
-            daily_sales = {}
-            for order in orders:
-                date = datetime.fromtimestamp(order["created_at"]).strftime("%Y-%m-%d")
-                if date not in daily_sales:
-                    daily_sales[date] = {"orders": 0, "revenue": 0}
-                daily_sales[date]["orders"] += 1
-                daily_sales[date]["revenue"] += float(order["total_amount"])
+                # Vendas por dia
+                cur.execute(filtered + """
+                    SELECT date(created_at, 'unixepoch', 'localtime'),
+                           strftime('%d/%m', created_at, 'unixepoch', 'localtime'),
+                           COUNT(*), SUM(total_amount)
+                    FROM f GROUP BY 1 ORDER BY 1 DESC
+                """, params)
+                daily_sales = {
+                    date: {"label": label, "orders": count, "revenue": float(revenue)}
+                    for date, label, count, revenue in cur.fetchall()
+                }
             
-            conn.close()
+                # Lista de pedidos apenas quando solicitada, só com as colunas exibidas
+                orders = None
+                if include_orders:
+                    cur.execute(f"""
+                        SELECT 
+                            o.id,
+                            o.order_number,
+                            o.total_amount,
+                            o.payment_method,
+                            o.created_at
+                        FROM orders o
+                        JOIN users u ON o.user_id = u.id
+                        WHERE {where}
+                        ORDER BY o.created_at DESC
+                    """, params)
+                    orders = [dict(order) for order in cur.fetchall()]
+            
+            report = {
+                "period": {
+                    "start_date": start_date,
+                    "end_date": end_date
+                },
+                "summary": {
+                    "total_orders": total_orders,
+                    "total_revenue": total_revenue,
+                    "average_order_value": total_revenue / total_orders if total_orders > 0 else 0
+                },
+                "payment_methods": payment_methods,
+                "daily_sales": daily_sales,
+                "generated_at": datetime.now().isoformat()
+            }
+            if orders is not None:
+                report["orders"] = orders
             
             return {
                 "success": True,
-                "report": {
-                    "period": {
-                        "start_date": start_date,
-                        "end_date": end_date
-                    },
-                    "summary": {
-                        "total_orders": total_orders,
-                        "total_revenue": total_revenue,
-                        "average_order_value": total_revenue / total_orders if total_orders > 0 else 0
-                    },
-                    "payment_methods": payment_methods,
-                    "daily_sales": daily_sales,
-                    "orders": [dict(order) for order in orders],
-                    "generated_at": datetime.now().isoformat()
-                }
+                "report": report
             }
             
         except Exception as e:
             return {"success": False, "error": f"Erro ao gerar relatório: {str(e)}"}
 
+    def recent_completed_orders(self, limit: int = 50) -> List[Dict]:
+        """Pedidos concluídos mais recentes (seleção da aba de emissão)"""
+        with self._conn_lock:
+            cur = self._conn.execute("""
+                SELECT o.id, o.order_number, o.total_amount, o.created_at, 
+                       u.first_name, u.last_name, u.email
+                FROM orders o
+                JOIN users u ON o.user_id = u.id
+                WHERE o.status = 'completed'
+                ORDER BY o.created_at DESC
+                LIMIT ?
+            """, (limit,))
+            return [dict(order) for order in cur.fetchall()]
+
+@st.cache_resource
+def _get_generator() -> InvoiceGenerator:
+    """Instância única do gerador, compartilhada entre reruns"""
+    return InvoiceGenerator()
+
+
+@st.cache_data(ttl=30)
+def _recent_completed_orders(limit: int = 50) -> List[Dict]:
+    """Pedidos concluídos mais recentes para a seleção da aba de emissão"""
+    return _get_generator().recent_completed_orders(limit)
+
+
 def render_invoice_page():
     """Renderiza página de notas fiscais"""
     st.markdown("## 🧾 Sistema de Notas Fiscais")
@@ -308,20 +415,7 @@ def render_invoice_page():
         st.markdown("### 📋 Gerar Nota Fiscal")
         
         # Buscar pedidos para gerar nota
-        conn = get_conn()
-        cur = conn.cursor()
-        
-        cur.execute("""
-            SELECT o.id, o.order_number, o.total_amount, o.created_at, 
-                   u.first_name, u.last_name, u.email
-            FROM orders o
-            JOIN users u ON o.user_id = u.id
-            WHERE o.status = 'completed'
-            ORDER BY o.created_at DESC
-            LIMIT 50
-        """)
-        orders = cur.fetchall()
-        conn.close()
+        orders = _recent_completed_orders(50)
         
         if orders:
             # Selecionar pedido
@@ -336,7 +430,7 @@ def render_invoice_page():
                 order_id = order_options[selected_order]
                 
                 with st.spinner("Gerando nota fiscal..."):
-                    generator = InvoiceGenerator()
+                    generator = _get_generator()
                     result = generator.generate_invoice(order_id)
                     
                     if result["success"]:
@@ -391,8 +485,10 @@ def render_invoice_page():
         conn = get_conn()
         cur = conn.cursor()
         
+        # Data formatada pelo SQLite no horário local (com horário de verão correto por linha)
         cur.execute("""
-            SELECT invoice_number, order_id, customer_name, total, created_at
+            SELECT invoice_number, order_id, customer_name, total,
+                   strftime('%d/%m/%Y %H:%M', created_at, 'unixepoch', 'localtime') AS created_fmt
             FROM invoices
             ORDER BY created_at DESC
             LIMIT 50
@@ -402,18 +498,18 @@ def render_invoice_page():
         
         if invoices:
             for invoice in invoices:
-                with st.expander(f"Nota {invoice['invoice_number']} - R$ {invoice['total']:,.2f}"):
+                with st.expander(f"Nota {invoice.invoice_number} - R$ {invoice.total:,.2f}"):
                     col1, col2 = st.columns(2)
                     with col1:
-                        st.markdown(f"**Cliente:** {invoice['customer_name']}")
-                        st.markdown(f"**Pedido:** {invoice['order_id']}")
+                        st.markdown(f"**Cliente:** {invoice.customer_name}")
+                        st.markdown(f"**Pedido:** {invoice.order_id}")
                     with col2:
-                        st.markdown(f"**Total:** R$ {invoice['total']:,.2f}")
-                        st.markdown(f"**Data:** {datetime.fromtimestamp(invoice['created_at']).strftime('%d/%m/%Y %H:%M')}")
+                        st.markdown(f"**Total:** R$ {invoice.total:,.2f}")
+                        st.markdown(f"**Data:** {invoice.created_fmt}")
                     
-                    if st.button(f"Ver Detalhes", key=f"view_{invoice['invoice_number']}"):
-                        generator = InvoiceGenerator()
-                        invoice_data = generator.get_invoice(invoice['invoice_number'])
+                    if st.button(f"Ver Detalhes", key=f"view_{invoice.invoice_number}"):
+                        generator = _get_generator()
+                        invoice_data = generator.get_invoice(invoice.invoice_number)
                         if invoice_data:
                             st.json(invoice_data)
         else:
@@ -430,7 +526,7 @@ def render_invoice_page():
         
         if st.button("📈 Gerar Relatório", type="primary"):
             with st.spinner("Gerando relatório..."):
-                generator = InvoiceGenerator()
+                generator = _get_generator()
                 result = generator.generate_sales_report(
                     start_date.strftime("%Y-%m-%d"),
                     end_date.strftime("%Y-%m-%d")
@@ -460,16 +556,12 @@ def render_invoice_page():
                     
                     # Vendas diárias
                     st.markdown("### 📅 Vendas Diárias")
-                    daily_data = []
-                    for date, data in report["daily_sales"].items():
-                        daily_data.append({
-                            "Data": datetime.strptime(date, "%Y-%m-%d").strftime("%d/%m"),
-                            "Pedidos": data["orders"],
-                            "Receita": data["revenue"]
-                        })
+                    daily_data = [
+                        {"Data": data["label"], "Pedidos": data["orders"], "Receita": data["revenue"]}
+                        for data in report["daily_sales"].values()
+                    ]
                     
                     if daily_data:
-                        import pandas as pd
                         df = pd.DataFrame(daily_data)
                         st.dataframe(df, use_container_width=True)
                 else:
@@ -481,7 +573,7 @@ def render_invoice_page():
         st.info("Configurações da empresa para emissão de notas fiscais")
         
         # Mostrar configurações atuais
-        generator = InvoiceGenerator()
+        generator = _get_generator()
         company = generator.company_info
         
         st.markdown("**Dados Atuais:**")
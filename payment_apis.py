@@ -3,75 +3,370 @@ Integração com APIs Reais de Pagamento
 Suporte a Stripe, PagSeguro, Mercado Pago e outros gateways
 """
 
+import numpy as np
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import hashlib
 import hmac
+import os
+import random
+import secrets
+import threading
 import time
-from typing import Dict, Optional, Any
+from functools import lru_cache
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Any, Tuple, Iterator
 from datetime import datetime, timedelta
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+try:
+    import ijson
+    IJSON_AVAILABLE = True
+except ImportError:
+    IJSON_AVAILABLE = False
+try:
+    import msgspec
+    MSGSPEC_AVAILABLE = True
+except ImportError:
+    MSGSPEC_AVAILABLE = False
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+# Pool para disparar chamadas independentes ao gateway em paralelo
+_REQUEST_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="payment-api")
+
+
+class _PaymentRetry(Retry):
+    """Retry que nunca reenvia um POST já processado pelo gateway
+    
+    POST cria cobranças: só é repetido em 429 (recusado antes de processar)
+    e em erro de conexão (o pedido nem saiu). 5xx e timeout de leitura
+    podem ter cobrado, então não são repetidos.
+    """
+    
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if method.upper() == 'POST':
+            return status_code == 429
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def _build_retry() -> Retry:
+    """Retentativas com backoff exponencial para 429/5xx, respeitando Retry-After"""
+    options = dict(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        # POST fora da lista: sem retentativa em timeout de leitura (ver _PaymentRetry)
+        allowed_methods=["GET", "PUT"],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    try:
+        # Jitter disponível a partir do urllib3 2.0
+        return _PaymentRetry(backoff_jitter=0.5, **options)
+    except TypeError:
+        return _PaymentRetry(**options)
+
+
+_RETRY = _build_retry()
+
+# Um único pool de conexões HTTPS para todos os gateways
+_SHARED_ADAPTER = HTTPAdapter(pool_connections=30, pool_maxsize=100, max_retries=_RETRY)
+
+API_CONFIG_FILE = 'payment_apis_config.json'
+
+# Resultados por chave de idempotência (cliques duplicados / retentativas)
+IDEMPOTENCY_TTL = 600
+IDEMPOTENCY_MAXSIZE = 10_000
+
+# Respostas de GET guardadas para revalidação por ETag, por instância de API
+ETAG_CACHE_MAXSIZE = 1_000
+
+
+# Campos obrigatórios do cartão lidos de uma vez
+_card_get = itemgetter('number', 'expiry', 'cvv')
+
+
+def _format_cents(amount_cents: int) -> str:
+    """Centavos -> 'R.CC' usando só aritmética inteira"""
+    return f"{amount_cents // 100}.{amount_cents % 100:02d}"
+
+
+def _parse_expiry(expiry: str) -> Tuple[int, int]:
+    """Converte validade 'MM/AA' (ou 'MM/AAAA') em (mês, ano com 4 dígitos)"""
+    month, year = expiry.split('/', 1)
+    return int(month), 2000 + int(year) if len(year) == 2 else int(year)
+
+
+def _json_dumps(obj, indent: bool = False, sort_keys: bool = False) -> bytes:
+    """Serializa para JSON em bytes UTF-8 (orjson quando disponível)"""
+    if ORJSON_AVAILABLE:
+        option = (orjson.OPT_INDENT_2 if indent else 0) | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False,
+                      sort_keys=sort_keys).encode('utf-8')
+
+
+def _json_loads(data: bytes):
+    """Desserializa JSON (orjson quando disponível)"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+if MSGSPEC_AVAILABLE:
+    class GatewayConfig(msgspec.Struct):
+        """Formato de uma entrada de payment_apis_config.json"""
+        enabled: bool = False
+        environment: str = 'sandbox'
+        api_key: str = ''
+        secret_key: str = ''
+        webhook_secret: str = ''
+        access_token: str = ''
+        base_url: str = ''
+        notification_url: str = ''
+        success_url: str = ''
+        failure_url: str = ''
+        pending_url: str = ''
+        cancel_url: str = ''
+        etag_ttl: int = 86400
+        redis_url: str = ''
+        cache_ttl_seconds: Dict[str, int] = {}
+        connect_timeout: float = 3.0
+        read_timeout: float = 10.0
+
+
+@lru_cache(maxsize=1)
+def _read_api_configs(mtime_ns: int) -> Dict:
+    """Lê o JSON de configuração; a chave mtime_ns invalida o cache quando o arquivo muda
+    
+    Com msgspec, o arquivo é validado na leitura (tipos errados viram erro
+    aqui, e não na primeira requisição ao gateway).
+    """
+    with open(API_CONFIG_FILE, 'rb') as f:
+        raw = f.read()
+    if MSGSPEC_AVAILABLE:
+        configs = msgspec.json.decode(raw, type=Dict[str, GatewayConfig])
+        return {name: msgspec.structs.asdict(cfg) for name, cfg in configs.items()}
+    return _json_loads(raw)
 
 
 class PaymentAPIBase:
     """Classe base para APIs de pagamento"""
     
+    # URL base por ambiente; subclasses sobrescrevem
+    _BASE_URLS: Dict[str, str] = {}
+    
     def __init__(self, config: Dict):
         self.config = config
-        self.base_url = config.get('base_url', '')
         self.api_key = config.get('api_key', '')
         self.secret_key = config.get('secret_key', '')
         self.environment = config.get('environment', 'sandbox')
-    
-    def _make_request(self, method: str, endpoint: str, data: Dict = None, headers: Dict = None) -> Dict:
-        """Faz requisição HTTP para a API"""
-        url = f"{self.base_url}{endpoint}"
-        
-        default_headers = {
+        # Sem timeout um gateway travado prende a thread do Streamlit indefinidamente
+        self._timeout = (config.get('connect_timeout', 3.0), config.get('read_timeout', 10.0))
+        # Qualquer ambiente diferente de 'sandbox' é tratado como produção
+        env = 'sandbox' if self.environment == 'sandbox' else 'production'
+        self.base_url = self._BASE_URLS.get(env) or config.get('base_url', '')
+        # Sessão por gateway (headers próprios) sobre o pool compartilhado,
+        # mantendo a conexão TLS aberta entre as chamadas
+        self._session = requests.Session()
+        self._session.mount('https://', _SHARED_ADAPTER)
+        # Headers fixos montados uma vez; a Session os aplica em toda requisição
+        self._base_headers = {
             'Content-Type': 'application/json',
             'Authorization': f'Bearer {self.api_key}'
         }
+        self._session.headers.update(self._base_headers)
+        # GETs condicionais: (endpoint, params) -> (etag, dados, instante)
+        self._etag_cache: Dict[Tuple, Tuple[str, Any, float]] = {}
+        self._etag_ttl = config.get('etag_ttl', 86400)
+        # Cache Redis opcional para GETs; TTL configurado por endpoint
+        redis_url = config.get('redis_url') or os.environ.get('REDIS_URL', '')
+        self._cache = redis.Redis.from_url(redis_url) if REDIS_AVAILABLE and redis_url else None
+        self._cache_ttls = config.get('cache_ttl_seconds') or {}
+        self.cache_stats = {'hits': 0, 'misses': 0}
+    
+    def close(self):
+        """Fecha as conexões HTTP do gateway"""
+        self._session.close()
+    
+    def verify_signature(self, raw_body: bytes, signature_hex: str) -> bool:
+        """Valida a assinatura HMAC-SHA256 de um webhook
         
-        if headers:
-            default_headers.update(headers)
+        raw_body deve ser o corpo exatamente como recebido (bytes), sem
+        decodificar e recodificar.
+        """
+        secret = (self.config.get('webhook_secret') or self.secret_key).encode()
+        expected = hmac.new(secret, raw_body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature_hex)
+    
+    def _redis_key(self, endpoint: str, params: Optional[Dict]) -> Tuple[Optional[str], int]:
+        """Chave e TTL do cache Redis para um GET (None quando o endpoint não é cacheado)"""
+        ttl = self._cache_ttls.get(endpoint)
+        if self._cache is None or not ttl:
+            return None, 0
+        digest = hashlib.blake2b(_json_dumps(params or {}), digest_size=8).hexdigest()
+        return f"{self.__class__.__name__}:{endpoint}:{digest}", ttl
+    
+    def _redis_get(self, key: str):
+        """Resposta guardada no Redis; indisponibilidade do Redis conta como miss"""
+        try:
+            raw = self._cache.get(key)
+        except redis.RedisError:
+            raw = None
+        if raw is None:
+            self.cache_stats['misses'] += 1
+            return None
+        self.cache_stats['hits'] += 1
+        return _json_loads(raw)
+    
+    def _redis_set(self, key: str, ttl: int, result):
+        """Guarda a resposta no Redis com expiração (falhas são ignoradas)"""
+        try:
+            self._cache.setex(key, ttl, _json_dumps(result))
+        except redis.RedisError:
+            pass
+    
+    @staticmethod
+    def _etag_key(endpoint: str, params: Optional[Dict]) -> Optional[Tuple[str, Optional[bytes]]]:
+        """Chave do cache de ETag; parâmetros aninhados (listas, dicts) entram pelo JSON ordenado"""
+        if not params:
+            return endpoint, None
+        try:
+            return endpoint, _json_dumps(params, sort_keys=True)
+        except TypeError:
+            # Parâmetro não serializável: a requisição segue, só sem cache
+            return None
+    
+    def _etag_store(self, key: Tuple, entry: Tuple[str, Any, float]):
+        """Guarda a resposta, descartando as mais antigas quando cheio"""
+        cache = self._etag_cache
+        cache.pop(key, None)
+        while len(cache) >= ETAG_CACHE_MAXSIZE:
+            cache.pop(next(iter(cache), None), None)
+        cache[key] = entry
+    
+    def _make_request(self, method: str, endpoint: str, data: Dict = None, headers: Dict = None) -> Dict:
+        """Faz requisição HTTP para a API"""
+        url = f"{self.base_url}{endpoint}"
         
+        method = method.upper()
         try:
-            if method.upper() == 'GET':
-                response = requests.get(url, headers=default_headers, params=data)
-            elif method.upper() == 'POST':
-                response = requests.post(url, headers=default_headers, json=data)
-            elif method.upper() == 'PUT':
-                response = requests.put(url, headers=default_headers, json=data)
+            if method == 'GET':
+                redis_key, redis_ttl = self._redis_key(endpoint, data)
+                if redis_key:
+                    hit = self._redis_get(redis_key)
+                    if hit is not None:
+                        return {"success": True, "data": hit}
+                cache_key = self._etag_key(endpoint, data)
+                cached = self._etag_cache.get(cache_key) if cache_key else None
+                if cached and time.monotonic() - cached[2] < self._etag_ttl:
+                    headers = {**(headers or {}), 'If-None-Match': cached[0]}
+                response = self._session.request(method, url, headers=headers, params=data,
+                                                 timeout=self._timeout)
+                if response.status_code == 304 and cached:
+                    # Nada mudou no servidor: reaproveita o corpo guardado
+                    return {"success": True, "data": cached[1]}
+            elif method in ('POST', 'PUT'):
+                # Corpo serializado aqui; Content-Type já vai nos headers da Session
+                body = _json_dumps(data) if data is not None else None
+                response = self._session.request(method, url, headers=headers, data=body,
+                                                 timeout=self._timeout)
             else:
                 return {"success": False, "error": f"Método HTTP não suportado: {method}"}
             
+            if response.status_code == 429:
+                # Retentativas esgotadas e o gateway continua limitando
+                return {
+                    "success": False,
+                    "error": "rate_limited",
+                    "retry_after": response.headers.get('Retry-After')
+                }
             response.raise_for_status()
-            return {"success": True, "data": response.json()}
+            result = _json_loads(response.content)
+            etag = response.headers.get('ETag')
+            if method == 'GET' and etag and cache_key:
+                self._etag_store(cache_key, (etag, result, time.monotonic()))
+            if method == 'GET' and redis_key:
+                self._redis_set(redis_key, redis_ttl, result)
+            return {"success": True, "data": result}
             
+        except requests.exceptions.Timeout:
+            return {"success": False, "error": "gateway_timeout", "retryable": True}
         except requests.exceptions.RequestException as e:
             return {"success": False, "error": f"Erro na requisição: {str(e)}"}
         except json.JSONDecodeError:
             return {"success": False, "error": "Resposta inválida da API"}
+    
+    def _make_request_stream(self, method: str, endpoint: str, data: Dict = None,
+                             json_path: str = 'data.item') -> Iterator[Any]:
+        """Itera os elementos de uma listagem grande sem carregar a resposta inteira
+        
+        json_path segue a sintaxe do ijson ('data.item' = cada elemento da
+        lista em "data"). Erros HTTP são levantados como exceções do requests.
+        """
+        url = f"{self.base_url}{endpoint}"
+        method = method.upper()
+        if method == 'GET':
+            response = self._session.request(method, url, params=data, stream=True,
+                                             timeout=self._timeout)
+        else:
+            body = _json_dumps(data) if data is not None else None
+            response = self._session.request(method, url, data=body, stream=True,
+                                             timeout=self._timeout)
+        
+        with response:
+            response.raise_for_status()
+            if IJSON_AVAILABLE:
+                response.raw.decode_content = True
+                yield from ijson.items(response.raw, json_path)
+                return
+            
+            # Sem ijson: decodifica tudo e percorre o mesmo caminho
+            node = _json_loads(response.content)
+            *keys, last = json_path.split('.')
+            for key in keys:
+                node = node[key]
+            if last == 'item':
+                yield from node
+            else:
+                yield node[last]
 
 
 class StripeAPI(PaymentAPIBase):
     """Integração com Stripe"""
     
-    def __init__(self, config: Dict):
-        super().__init__(config)
-        if self.environment == 'sandbox':
-            self.base_url = 'https://api.stripe.com/v1'
-        else:
-            self.base_url = 'https://api.stripe.com/v1'
+    _BASE_URLS = {
+        'sandbox': 'https://api.stripe.com/v1',
+        'production': 'https://api.stripe.com/v1'
+    }
     
-    def create_payment_intent(self, amount: float, currency: str = 'brl', 
-                             payment_method_types: list = None) -> Dict:
+    @staticmethod
+    def _idempotency_headers(idempotency_key: Optional[str], step: str) -> Optional[Dict]:
+        """Header Idempotency-Key do Stripe, distinto por etapa do fluxo"""
+        if not idempotency_key:
+            return None
+        return {'Idempotency-Key': f'{idempotency_key}-{step}'}
+    
+    def create_payment_intent(self, amount_cents: int, currency: str = 'brl', 
+                             payment_method_types: list = None,
+                             idempotency_key: Optional[str] = None) -> Dict:
         """Cria intenção de pagamento no Stripe"""
         if payment_method_types is None:
             payment_method_types = ['card']
         
         data = {
-            'amount': int(amount * 100),  # Stripe usa centavos
+            'amount': amount_cents,  # Stripe usa centavos
             'currency': currency,
             'payment_method_types': payment_method_types,
             'automatic_payment_methods': {
@@ -79,17 +374,20 @@ class StripeAPI(PaymentAPIBase):
             }
         }
         
-        return self._make_request('POST', '/payment_intents', data)
+        return self._make_request('POST', '/payment_intents', data,
+                                  self._idempotency_headers(idempotency_key, 'pi'))
     
-    def create_payment_method(self, card_data: Dict) -> Dict:
+    def create_payment_method(self, card_data: Dict, idempotency_key: Optional[str] = None) -> Dict:
         """Cria método de pagamento no Stripe"""
+        number, expiry, cvv = _card_get(card_data)
+        exp_month, exp_year = _parse_expiry(expiry)
         data = {
             'type': 'card',
             'card': {
-                'number': card_data['number'],
-                'exp_month': int(card_data['expiry'].split('/')[0]),
-                'exp_year': int('20' + card_data['expiry'].split('/')[1]),
-                'cvc': card_data['cvv']
+                'number': number,
+                'exp_month': exp_month,
+                'exp_year': exp_year,
+                'cvc': cvv
             },
             'billing_details': {
                 'name': card_data.get('name', ''),
@@ -97,35 +395,36 @@ class StripeAPI(PaymentAPIBase):
             }
         }
         
-        return self._make_request('POST', '/payment_methods', data)
+        return self._make_request('POST', '/payment_methods', data,
+                                  self._idempotency_headers(idempotency_key, 'pm'))
     
-    def confirm_payment_intent(self, payment_intent_id: str, payment_method_id: str) -> Dict:
+    def confirm_payment_intent(self, payment_intent_id: str, payment_method_id: str,
+                               idempotency_key: Optional[str] = None) -> Dict:
         """Confirma intenção de pagamento"""
         data = {
             'payment_method': payment_method_id
         }
         
-        return self._make_request('POST', f'/payment_intents/{payment_intent_id}/confirm', data)
+        return self._make_request('POST', f'/payment_intents/{payment_intent_id}/confirm', data,
+                                  self._idempotency_headers(idempotency_key, 'confirm'))
 
 
 class PagSeguroAPI(PaymentAPIBase):
     """Integração com PagSeguro"""
     
-    def __init__(self, config: Dict):
-        super().__init__(config)
-        if self.environment == 'sandbox':
-            self.base_url = 'https://sandbox.pagseguro.uol.com.br'
-        else:
-            self.base_url = 'https://ws.pagseguro.uol.com.br'
+    _BASE_URLS = {
+        'sandbox': 'https://sandbox.pagseguro.uol.com.br',
+        'production': 'https://ws.pagseguro.uol.com.br'
+    }
     
-    def create_payment_request(self, amount: float, reference: str, 
+    def create_payment_request(self, amount_cents: int, reference: str, 
                               customer_data: Dict, items: list) -> Dict:
         """Cria solicitação de pagamento no PagSeguro"""
         data = {
             'currency': 'BRL',
             'reference': reference,
             'amount': {
-                'value': f"{amount:.2f}"
+                'value': _format_cents(amount_cents)
             },
             'customer': {
                 'name': customer_data.get('name', ''),
@@ -142,16 +441,18 @@ class PagSeguroAPI(PaymentAPIBase):
     
     def create_credit_card_payment(self, charge_id: str, card_data: Dict) -> Dict:
         """Cria pagamento com cartão de crédito"""
+        number, expiry, cvv = _card_get(card_data)
+        exp_month, exp_year = _parse_expiry(expiry)
         data = {
             'payment_method': {
                 'type': 'CREDIT_CARD',
                 'installments': card_data.get('installments', 1),
                 'capture': True,
                 'card': {
-                    'number': card_data['number'],
-                    'exp_month': card_data['expiry'].split('/')[0],
-                    'exp_year': card_data['expiry'].split('/')[1],
-                    'security_code': card_data['cvv'],
+                    'number': number,
+                    'exp_month': exp_month,
+                    'exp_year': exp_year,
+                    'security_code': cvv,
                     'holder': {
                         'name': card_data.get('name', '')
                     }
@@ -165,12 +466,10 @@ class PagSeguroAPI(PaymentAPIBase):
 class MercadoPagoAPI(PaymentAPIBase):
     """Integração com Mercado Pago"""
     
-    def __init__(self, config: Dict):
-        super().__init__(config)
-        if self.environment == 'sandbox':
-            self.base_url = 'https://api.mercadopago.com'
-        else:
-            self.base_url = 'https://api.mercadopago.com'
+    _BASE_URLS = {
+        'sandbox': 'https://api.mercadopago.com',
+        'production': 'https://api.mercadopago.com'
+    }
     
     def create_preference(self, items: list, payer: Dict, 
                          back_urls: Dict = None) -> Dict:
@@ -196,12 +495,22 @@ class MercadoPagoAPI(PaymentAPIBase):
         
         return self._make_request('POST', '/checkout/preferences', data)
     
-    def create_payment(self, transaction_amount: float, token: str, 
+    def create_preferences_batch(self, preferences: list) -> list:
+        """Cria várias preferências de uma vez
+        
+        Cada item é um dict com os argumentos de create_preference. O Mercado
+        Pago não tem endpoint em lote, então as requisições seguem em paralelo
+        pela mesma Session (conexões keep-alive reaproveitadas).
+        """
+        futures = [_REQUEST_POOL.submit(self.create_preference, **pref) for pref in preferences]
+        return [future.result() for future in futures]
+    
+    def create_payment(self, amount_cents: int, token: str, 
                       description: str, installments: int = 1,
                       payment_method_id: str = 'visa') -> Dict:
         """Cria pagamento no Mercado Pago"""
         data = {
-            'transaction_amount': transaction_amount,
+            'transaction_amount': amount_cents / 100,  # API do Mercado Pago usa reais
             'token': token,
             'description': description,
             'installments': installments,
@@ -214,57 +523,154 @@ class MercadoPagoAPI(PaymentAPIBase):
         return self._make_request('POST', '/v1/payments', data)
 
 
+GATEWAY_CLASSES = {
+    'stripe': StripeAPI,
+    'pagseguro': PagSeguroAPI,
+    'mercadopago': MercadoPagoAPI
+}
+
+
 class PaymentAPIManager:
     """Gerenciador de APIs de pagamento"""
     
     def __init__(self):
         self.apis = {}
+        self._idempotency_cache: Dict[str, Tuple[float, Dict]] = {}
+        self._idempotency_lock = threading.Lock()
         self.load_configurations()
     
     def load_configurations(self):
         """Carrega configurações das APIs"""
         try:
-            with open('payment_apis_config.json', 'r', encoding='utf-8') as f:
-                configs = json.load(f)
-                
+            configs = _read_api_configs(os.stat(API_CONFIG_FILE).st_mtime_ns)
+            
+            unknown = set(configs) - set(GATEWAY_CLASSES)
+            if unknown:
+                st.warning(f"Gateways desconhecidos na configuração: {', '.join(sorted(unknown))}")
+            
             for api_name, config in configs.items():
-                if config.get('enabled', False):
-                    if api_name == 'stripe':
-                        self.apis['stripe'] = StripeAPI(config)
-                    elif api_name == 'pagseguro':
-                        self.apis['pagseguro'] = PagSeguroAPI(config)
-                    elif api_name == 'mercadopago':
-                        self.apis['mercadopago'] = MercadoPagoAPI(config)
-                        
+                if config.get('enabled', False) and api_name in GATEWAY_CLASSES:
+                    self.apis[api_name] = GATEWAY_CLASSES[api_name](config)
+                    
         except FileNotFoundError:
             st.warning("Arquivo de configuração de APIs não encontrado. Usando modo simulado.")
         except Exception as e:
             st.error(f"Erro ao carregar configurações das APIs: {e}")
     
-    def process_credit_card_payment(self, card_data: Dict, amount: float, 
-                                   gateway: str = 'stripe') -> Dict:
-        """Processa pagamento com cartão de crédito"""
+    def close(self):
+        """Fecha as sessões HTTP de todos os gateways"""
+        for api in self.apis.values():
+            api.close()
+    
+    def process_payments_batch(self, orders: list, gateway: str = 'mercadopago') -> list:
+        """Processa uma lista de pagamentos, na ordem recebida
+        
+        No Mercado Pago cada pedido traz os argumentos de create_preference;
+        nos demais gateways, 'card_data' e 'amount_cents' para pagamento com cartão.
+        """
+        api = self.apis.get(gateway)
+        if isinstance(api, MercadoPagoAPI):
+            return api.create_preferences_batch(orders)
+        if gateway == 'mercadopago':
+            # Pedidos no formato de preferência, mas o Mercado Pago não está configurado
+            return [{'success': False, 'error': 'Mercado Pago não configurado'} for _ in orders]
+        
+        # Gateways sem envio em lote: processamento sequencial
+        return [
+            self.process_credit_card_payment(order['card_data'], order['amount_cents'], gateway)
+            if 'card_data' in order and 'amount_cents' in order
+            else {'success': False, 'error': 'Pedido sem card_data/amount_cents'}
+            for order in orders
+        ]
+    
+    def _cached_result(self, key: str) -> Optional[Dict]:
+        """Resultado ainda válido para a chave de idempotência, se houver"""
+        with self._idempotency_lock:
+            entry = self._idempotency_cache.get(key)
+            if entry and time.monotonic() - entry[0] < IDEMPOTENCY_TTL:
+                return entry[1]
+        return None
+    
+    def _store_result(self, key: str, result: Dict):
+        """Guarda o resultado, descartando expirados (ou os mais antigos) quando cheio"""
+        now = time.monotonic()
+        with self._idempotency_lock:
+            cache = self._idempotency_cache
+            if len(cache) >= IDEMPOTENCY_MAXSIZE:
+                for k in [k for k, (ts, _) in cache.items() if now - ts >= IDEMPOTENCY_TTL]:
+                    del cache[k]
+                while len(cache) >= IDEMPOTENCY_MAXSIZE:
+                    del cache[next(iter(cache))]
+            cache[key] = (now, result)
+    
+    @staticmethod
+    def _derive_idempotency_key(card_type: str, card_data: Dict, amount_cents: int, order_id) -> str:
+        """Chave de idempotência do pedido: tipo, final do cartão, valor e order_id"""
+        raw = f"{card_type}:{card_data['number'][-4:]}:{amount_cents}:{order_id}".encode()
+        return hashlib.blake2b(raw, digest_size=16).hexdigest()
+    
+    def _run_idempotent(self, idempotency_key: Optional[str], call) -> Dict:
+        """Executa call() uma vez por chave; só pagamentos aprovados ficam guardados
+        
+        Recusas, timeouts e rate limit não são guardados: uma nova tentativa
+        depois de um erro transitório vai de novo ao gateway.
+        """
+        if idempotency_key:
+            cached = self._cached_result(idempotency_key)
+            if cached is not None:
+                return cached
+        
+        result = call()
+        if idempotency_key and result and result.get('success'):
+            self._store_result(idempotency_key, result)
+        return result
+    
+    def process_credit_card_payment(self, card_data: Dict, amount_cents: int, 
+                                   gateway: str = 'stripe', order_id: Optional[str] = None,
+                                   idempotency_key: Optional[str] = None) -> Dict:
+        """Processa pagamento com cartão de crédito (valor em centavos)
+        
+        Com idempotency_key (ou order_id, de onde a chave é derivada), uma
+        tentativa repetida dentro de IDEMPOTENCY_TTL depois de uma aprovação
+        devolve o resultado anterior sem nova chamada ao gateway.
+        """
+        if idempotency_key is None and order_id is not None:
+            idempotency_key = self._derive_idempotency_key('credit', card_data, amount_cents, order_id)
+        
         if gateway not in self.apis:
-            return self._fallback_payment(card_data, amount, 'credit')
+            return self._run_idempotent(
+                idempotency_key, lambda: self._fallback_payment(card_data, amount_cents, 'credit')
+            )
         
+        return self._run_idempotent(
+            idempotency_key,
+            lambda: self._process_credit_card_gateway(card_data, amount_cents, gateway, idempotency_key)
+        )
+    
+    def _process_credit_card_gateway(self, card_data: Dict, amount_cents: int, gateway: str,
+                                     idempotency_key: Optional[str]) -> Dict:
+        """Fluxo de cartão no gateway configurado"""
         api = self.apis[gateway]
         
         try:
             if gateway == 'stripe':
-                # Criar método de pagamento
-                pm_result = api.create_payment_method(card_data)
+                # Método e intenção de pagamento não dependem um do outro:
+                # as duas requisições seguem juntas, economizando um round trip
+                pm_future = _REQUEST_POOL.submit(api.create_payment_method, card_data, idempotency_key)
+                pi_future = _REQUEST_POOL.submit(api.create_payment_intent, amount_cents,
+                                                 idempotency_key=idempotency_key)
+                pm_result = pm_future.result()
+                pi_result = pi_future.result()
                 if not pm_result['success']:
                     return pm_result
-                
-                # Criar intenção de pagamento
-                pi_result = api.create_payment_intent(amount)
                 if not pi_result['success']:
                     return pi_result
                 
                 # Confirmar pagamento
                 confirm_result = api.confirm_payment_intent(
                     pi_result['data']['id'], 
-                    pm_result['data']['id']
+                    pm_result['data']['id'],
+                    idempotency_key
                 )
                 
                 if confirm_result['success']:
@@ -279,39 +685,43 @@ class PaymentAPIManager:
                     
             elif gateway == 'pagseguro':
                 # Implementar fluxo do PagSeguro
-                return self._fallback_payment(card_data, amount, 'credit')
+                return self._fallback_payment(card_data, amount_cents, 'credit')
                 
             elif gateway == 'mercadopago':
                 # Implementar fluxo do Mercado Pago
-                return self._fallback_payment(card_data, amount, 'credit')
+                return self._fallback_payment(card_data, amount_cents, 'credit')
                 
         except Exception as e:
             return {'success': False, 'error': f'Erro na API {gateway}: {str(e)}'}
     
-    def process_debit_card_payment(self, card_data: Dict, amount: float, 
-                                  gateway: str = 'stripe') -> Dict:
-        """Processa pagamento com cartão de débito"""
+    def process_debit_card_payment(self, card_data: Dict, amount_cents: int, 
+                                  gateway: str = 'stripe', order_id: Optional[str] = None) -> Dict:
+        """Processa pagamento com cartão de débito (valor em centavos)"""
+        idempotency_key = None
+        if order_id is not None:
+            idempotency_key = self._derive_idempotency_key('debit', card_data, amount_cents, order_id)
+        
         if gateway not in self.apis:
-            return self._fallback_payment(card_data, amount, 'debit')
+            return self._run_idempotent(
+                idempotency_key, lambda: self._fallback_payment(card_data, amount_cents, 'debit')
+            )
         
         # Para débito, usar o mesmo fluxo do crédito mas sem parcelamento
         card_data['installments'] = 1
-        return self.process_credit_card_payment(card_data, amount, gateway)
+        return self.process_credit_card_payment(card_data, amount_cents, gateway,
+                                                idempotency_key=idempotency_key)
     
-    def process_pix_payment(self, amount: float, description: str = '', 
+    def process_pix_payment(self, amount_cents: int, description: str = '', 
                            gateway: str = 'mercadopago') -> Dict:
-        """Processa pagamento via PIX"""
+        """Processa pagamento via PIX (valor em centavos)"""
         if gateway not in self.apis:
-            return self._fallback_pix_payment(amount, description)
+            return self._fallback_pix_payment(amount_cents, description)
         
         # Implementar PIX para diferentes gateways
-        return self._fallback_pix_payment(amount, description)
+        return self._fallback_pix_payment(amount_cents, description)
     
-    def _fallback_payment(self, card_data: Dict, amount: float, card_type: str) -> Dict:
+    def _fallback_payment(self, card_data: Dict, amount_cents: int, card_type: str) -> Dict:
         """Fallback para pagamento simulado"""
-        import secrets
-        import random
-        
         transaction_id = f"{card_type.upper()}{int(time.time())}{secrets.randbelow(1000):03d}"
         success_rate = 0.92 if card_type == 'debit' else 0.85
         
@@ -334,10 +744,43 @@ class PaymentAPIManager:
                 'transaction_id': transaction_id
             }
     
-    def _fallback_pix_payment(self, amount: float, description: str) -> Dict:
-        """Fallback para PIX simulado"""
-        import secrets
+    def _fallback_payment_batch(self, card_datas: list, amounts_cents: list, card_type: str) -> list:
+        """Versão em lote de _fallback_payment (simulações e testes de carga)
+        
+        Sorteia aprovações e códigos para os N pagamentos de uma vez.
+        """
+        n = len(amounts_cents)
+        prefix = f"{card_type.upper()}{int(time.time())}"
+        success_rate = 0.92 if card_type == 'debit' else 0.85
+        approved = np.random.random(n) < success_rate
+        suffixes = np.random.randint(0, 1000, n)
+        auth_codes = np.random.randint(0, 2**32, n, dtype=np.uint64)
         
+        results = []
+        for ok, suffix, auth in zip(approved.tolist(), suffixes.tolist(), auth_codes.tolist()):
+            transaction_id = f"{prefix}{suffix:03d}"
+            if ok:
+                results.append({
+                    'success': True,
+                    'transaction_id': transaction_id,
+                    'status': 'approved',
+                    'message': f'Pagamento {card_type} aprovado (simulado)',
+                    'gateway_response': {
+                        'authorization_code': f'AUTH{auth:08X}',
+                        'processor_response': '00',
+                        'processor_message': 'Approved'
+                    }
+                })
+            else:
+                results.append({
+                    'success': False,
+                    'error': f'Pagamento {card_type} recusado (simulado)',
+                    'transaction_id': transaction_id
+                })
+        return results
+    
+    def _fallback_pix_payment(self, amount_cents: int, description: str) -> Dict:
+        """Fallback para PIX simulado"""
         transaction_id = f"PIX{int(time.time())}{secrets.randbelow(1000):03d}"
         pix_key = secrets.token_hex(16)
         
@@ -346,7 +789,7 @@ class PaymentAPIManager:
             'transaction_id': transaction_id,
             'status': 'pending',
             'pix_key': pix_key,
-            'qr_code': f"https://via.placeholder.com/200x200/667eea/white?text=PIX+{amount}",
+            'qr_code': f"https://via.placeholder.com/200x200/667eea/white?text=PIX+{_format_cents(amount_cents)}",
             'expires_at': datetime.now() + timedelta(minutes=30),
             'message': 'PIX gerado (simulado)'
         }
@@ -381,13 +824,17 @@ def create_payment_apis_config():
         }
     }
     
-    with open('payment_apis_config.json', 'w', encoding='utf-8') as f:
-        json.dump(config, f, indent=2, ensure_ascii=False)
+    with open(API_CONFIG_FILE, 'wb') as f:
+        f.write(_json_dumps(config, indent=True))
+    
+    # Recriar o gerenciador na próxima chamada com a configuração nova
+    get_payment_api_manager.clear()
     
     return config
 
 
+@st.cache_resource
 def get_payment_api_manager() -> PaymentAPIManager:
-    """Retorna instância do gerenciador de APIs"""
+    """Retorna instância do gerenciador de APIs (uma por processo, reaproveitada entre reruns)"""
     return PaymentAPIManager()
 
@@ -4,10 +4,261 @@ Gerencia chaves PIX, dados bancários e configurações de gateway
 """
 
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
+import base64
+import binascii
+import copy
+import io
 import json
+import logging
 import os
-from typing import Dict, Optional
-from database import get_conn
+import random
+import threading
+import time
+import unicodedata
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, Optional, Tuple
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# qrcode é opcional e pesado: importado só na primeira geração de PIX
+_QRCODE = None
+
+
+def _get_qrcode():
+    """Módulo qrcode (None se não instalado), importado uma única vez"""
+    global _QRCODE
+    if _QRCODE is None:
+        try:
+            import qrcode
+            _QRCODE = qrcode
+        except ImportError:
+            _QRCODE = False
+    return _QRCODE or None
+
+
+# Bandeira por prefixo do número; prefixos mais longos são testados primeiro
+_BRAND_BY_PREFIX = {
+    '6011': 'Discover',
+    '51': 'Mastercard', '52': 'Mastercard', '53': 'Mastercard', '54': 'Mastercard', '55': 'Mastercard',
+    '34': 'American Express', '37': 'American Express',
+    '30': 'Diners Club', '36': 'Diners Club', '38': 'Diners Club',
+    '4': 'Visa'
+}
+_BRAND_PREFIX_LENS = (4, 2, 1)
+_CARD_STRIP_TABLE = str.maketrans('', '', ' -')
+# IDs de transação só precisam ser únicos, não imprevisíveis: sem syscall por ID
+_rng = random.Random()
+
+
+def _txid(prefix: str, now_ns: Optional[int] = None) -> str:
+    """ID de transação: prefixo + microssegundos + sufixo aleatório"""
+    if now_ns is None:
+        now_ns = time.time_ns()
+    return f"{prefix}{now_ns // 1000}{_rng.randrange(1000):03d}"
+
+
+# Limiares sobre um byte aleatório (0-255) para as taxas de aprovação simuladas
+_CREDIT_APPROVAL_BYTE = round(0.85 * 256)  # ~85%
+_DEBIT_APPROVAL_BYTE = round(0.92 * 256)   # ~92%
+_HYPHEN_STRIP_TABLE = str.maketrans('', '', '-')
+
+def _freeze(value):
+    """Cópia somente leitura de um dict aninhado"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    return value
+
+
+def _thaw(value):
+    """Cópia mutável (dicts comuns) de um template congelado"""
+    if isinstance(value, Mapping):
+        return {k: _thaw(v) for k, v in value.items()}
+    return value
+
+
+# Configuração padrão (somente leitura); o arquivo guarda apenas o que difere dela
+_DEFAULT_CONFIG = _freeze({
+    "pix": {
+        "enabled": True,
+        "chave_pix": "",
+        "nome_recebedor": "E-Store",
+        "cidade": "São Paulo",
+        "descricao": "Pagamento E-commerce"
+    },
+    "boleto": {
+        "enabled": True,
+        "banco": "341",  # Itaú
+        "agencia": "1234",
+        "conta": "12345-6",
+        "cedente": "E-Store LTDA",
+        "cnpj": "12.345.678/0001-90",
+        "endereco": "Rua das Flores, 123 - São Paulo/SP",
+        "dias_vencimento": 3
+    },
+    "cartao": {
+        "enabled": True,
+        "gateway": "simulado",
+        "merchant_id": "MERCHANT123",
+        "api_key": "API_KEY_SIMULADA",
+        "webhook_url": "https://seudominio.com/webhook",
+        "taxa_porcentagem": 2.99,
+        "taxa_fixa": 0.50
+    },
+    "notificacoes": {
+        "email": {
+            "enabled": True,
+            "smtp_server": "smtp.gmail.com",
+            "smtp_port": 587,
+            "email": "contato@estore.com",
+            "senha": ""
+        },
+        "webhook": {
+            "enabled": False,
+            "url": "",
+            "secret": ""
+        }
+    }
+})
+
+# Marca, no arquivo, chaves padrão removidas pelo usuário
+_REMOVED = None
+
+
+def _merge_overlay(base: Dict, overlay: Dict) -> Dict:
+    """Aplica as alterações do arquivo sobre a configuração padrão (in-place em base)"""
+    for key, value in overlay.items():
+        if value is _REMOVED:
+            base.pop(key, None)
+        elif isinstance(value, dict) and isinstance(base.get(key), dict):
+            _merge_overlay(base[key], value)
+        else:
+            base[key] = value
+    return base
+
+
+def _diff_overlay(config: Dict, defaults: Mapping) -> Dict:
+    """Somente as folhas de config diferentes do padrão"""
+    overlay = {}
+    for key, value in config.items():
+        default = defaults.get(key, _REMOVED)
+        if isinstance(value, dict) and isinstance(default, Mapping):
+            sub = _diff_overlay(value, default)
+            if sub:
+                overlay[key] = sub
+        elif value != default or key not in defaults:
+            overlay[key] = value
+    for key in defaults:
+        if key not in config:
+            overlay[key] = _REMOVED
+    return overlay
+
+
+# Config já lida por arquivo: caminho -> (mtime_ns, dict parseado)
+_CONFIG_CACHE: Dict[str, Tuple[int, Dict]] = {}
+
+
+# QRCode e buffer PNG reaproveitados por thread entre gerações de PIX
+_QR_TLS = threading.local()
+
+
+def _get_qr(qrcode):
+    """QRCode da thread atual, limpo e de volta à versão inicial"""
+    qr = getattr(_QR_TLS, "qr", None)
+    if qr is None:
+        qr = _QR_TLS.qr = qrcode.QRCode(version=1, box_size=10, border=5)
+        _QR_TLS.buf = io.BytesIO()
+    else:
+        qr.clear()
+        # make(fit=True) aumenta a versão conforme os dados; recomeçar da 1
+        qr.version = 1
+    return qr
+
+
+def _emv(field_id: str, value: str) -> str:
+    """Campo EMV: ID + tamanho (2 dígitos) + valor"""
+    return f"{field_id}{len(value):02d}{value}"
+
+
+# Campos fixos do BR Code: formato, MCC, moeda (BRL) e país
+_PIX_GUI = _emv("00", "br.gov.bcb.pix")
+_PIX_HEADER = _emv("00", "01")
+_PIX_FIXED = _emv("52", "0000") + _emv("53", "986")
+_PIX_COUNTRY = _emv("58", "BR")
+_PIX_TXID = _emv("62", _emv("05", "***"))
+# Campo 26 tem no máximo 99 caracteres: GUI + ID/tamanho da chave (4) + chave
+_PIX_KEY_MAX = 99 - len(_PIX_GUI) - 4
+
+
+def _pix_ascii(text: str) -> str:
+    """Texto sem acentos: o tamanho EMV conta caracteres, o CRC e o QR contam bytes ("São" = 4 bytes)"""
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+
+
+def _pix_payload(amount: float, key: str, merchant: str, city: str, desc: str) -> str:
+    """Payload PIX estático (BR Code/EMV) com CRC16 no final"""
+    merchant, city, desc = _pix_ascii(merchant), _pix_ascii(city), _pix_ascii(desc)
+    if len(key) > _PIX_KEY_MAX:
+        # Truncar geraria um QR válido para outra chave: recusa
+        raise ValueError(f"Chave PIX com mais de {_PIX_KEY_MAX} caracteres")
+    account = _PIX_GUI + _emv("01", key)
+    # A descrição é opcional e só entra se couber no campo 26 (máx. 99)
+    if desc and len(account) + 4 + len(desc) <= 99:
+        account += _emv("02", desc)
+    payload = (
+        _PIX_HEADER
+        + _emv("26", account)
+        + _PIX_FIXED
+        + _emv("54", f"{amount:.2f}")
+        + _PIX_COUNTRY
+        + _emv("59", merchant[:25])
+        + _emv("60", city[:15])
+        + _PIX_TXID
+        + "6304"
+    )
+    # CRC16-CCITT (polinômio 0x1021, início 0xFFFF) sobre o payload incluindo "6304"
+    return f"{payload}{binascii.crc_hqx(payload.encode('utf-8'), 0xFFFF):04X}"
+
+
+@lru_cache(maxsize=256)
+def _render_pix_qr(amount: float, key: str, merchant: str, city: str, desc: str) -> str:
+    """QR Code PIX como data URI PNG; mesmo valor e recebedor reaproveitam a imagem"""
+    # Tentar gerar QR Code real
+    qrcode = _get_qrcode()
+    if qrcode is None:
+        # Fallback para placeholder
+        return f"https://via.placeholder.com/200x200/667eea/white?text=PIX+{amount}"
+    
+    qr = _get_qr(qrcode)
+    qr.add_data(_pix_payload(amount, key, merchant, city, desc))
+    qr.make(fit=True)
+    
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffer = _QR_TLS.buf
+    buffer.seek(0)
+    buffer.truncate()
+    img.save(buffer, format='PNG')
+    img_str = base64.b64encode(buffer.getvalue()).decode()
+    
+    return f"data:image/png;base64,{img_str}"
+
+
+def _as_fee(value, field: str) -> float:
+    """Taxa do cartão como float; valor inválido no arquivo cai no padrão em vez de quebrar a construção"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        if value is not None:
+            logger.warning("Valor inválido para cartao.%s; usando o padrão", field)
+        return _DEFAULT_CONFIG["cartao"][field]
 
 
 class PaymentConfig:
@@ -15,149 +266,233 @@ class PaymentConfig:
     
     def __init__(self):
         self.config_file = "payment_config.json"
+        # Callbacks chamados com o nome da seção alterada (ex.: "boleto")
+        self._listeners = []
+        # Config em memória ainda não gravada (primeira execução, ver load_config)
+        self._dirty = False
+        # Seções editadas, em cópias: só substituem self.config depois de gravadas (ver flush)
+        self._pending: Dict[str, Dict] = {}
+        self._lock = threading.RLock()
         self.load_config()
     
     def load_config(self) -> Dict:
         """Carrega configurações do arquivo"""
-        if os.path.exists(self.config_file):
-            try:
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    self.config = json.load(f)
-            except:
-                self.config = self.get_default_config()
-        else:
+        try:
+            mtime = os.stat(self.config_file).st_mtime_ns
+            cached = _CONFIG_CACHE.get(self.config_file)
+            if cached and cached[0] == mtime:
+                # Arquivo inalterado: só o stat, sem reabrir nem reparsear
+                self.config = copy.deepcopy(cached[1])
+                self._bind_sections()
+                return self.config
+            with open(self.config_file, 'rb') as f:
+                raw = f.read()
+            overlay = orjson.loads(raw) if ORJSON_AVAILABLE else json.loads(raw)
+            if not isinstance(overlay, dict):
+                # O arquivo guarda só as diferenças, então "pix" pode faltar; mas deve ser um objeto
+                raise ValueError(f"esperado objeto JSON, obtido {type(overlay).__name__}")
+            self.config = _merge_overlay(self.get_default_config(), overlay)
+            _CONFIG_CACHE[self.config_file] = (mtime, copy.deepcopy(self.config))
+        except FileNotFoundError:
+            # Primeira execução: o padrão só é gravado no primeiro flush
             self.config = self.get_default_config()
-            self.save_config()
+            self._dirty = True
+        except (OSError, ValueError) as e:
+            # Arquivo ilegível/corrompido: usa o padrão sem sobrescrever o arquivo
+            logger.warning("Falha ao ler %s: %s", self.config_file, e)
+            self.config = self.get_default_config()
+        self._bind_sections()
         return self.config
     
-    def save_config(self) -> bool:
-        """Salva configurações no arquivo"""
+    def _bind_sections(self):
+        """Referências diretas às seções, evitando config.get(...) a cada leitura"""
+        self.pix = self.config.setdefault("pix", {})
+        self.boleto = self.config.setdefault("boleto", {})
+        self.cartao = self.config.setdefault("cartao", {})
+        self.notif = self.config.setdefault("notificacoes", {})
+        self._refresh_fees()
+    
+    def _refresh_fees(self):
+        """Pré-calcula (percentual/100, taxa fixa) de crédito e débito"""
+        taxa_porcentagem = _as_fee(self.cartao.get("taxa_porcentagem"), "taxa_porcentagem")
+        taxa_fixa = _as_fee(self.cartao.get("taxa_fixa"), "taxa_fixa")
+        self._credit_fee = (taxa_porcentagem / 100, taxa_fixa)
+        # Débito: metade da taxa de crédito
+        self._debit_fee = (taxa_porcentagem * 0.005, taxa_fixa * 0.5)
+    
+    def save_config(self, config: Optional[Dict] = None) -> bool:
+        """Salva no arquivo apenas as diferenças em relação ao padrão (config: padrão self.config)"""
+        if config is None:
+            config = self.config
         try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, indent=2, ensure_ascii=False)
+            overlay = _diff_overlay(config, _DEFAULT_CONFIG)
+            if ORJSON_AVAILABLE:
+                data = orjson.dumps(overlay, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+            else:
+                data = json.dumps(overlay, indent=2, ensure_ascii=False).encode('utf-8')
+            # Escrita atômica: leitores nunca veem o JSON pela metade.
+            # Temporário por processo e thread: sessões do Streamlit rodam em threads
+            tmp_file = f"{self.config_file}.tmp.{os.getpid()}.{threading.get_ident()}"
+            with open(tmp_file, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.config_file)
+            # Já sabemos o conteúdo gravado: o próximo load não precisa reparsear
+            _CONFIG_CACHE[self.config_file] = (
+                os.stat(self.config_file).st_mtime_ns, copy.deepcopy(config)
+            )
             return True
         except Exception as e:
             st.error(f"Erro ao salvar configurações: {e}")
             return False
     
+    def flush(self) -> bool:
+        """Grava as alterações pendentes em uma única escrita
+        
+        A instância é compartilhada entre sessões: as seções editadas só passam
+        a valer depois de gravadas. Se a gravação falhar, a edição é descartada
+        e não vaza para o próximo flush.
+        """
+        with self._lock:
+            if not self._dirty and not self._pending:
+                return True
+            pending, self._pending = self._pending, {}
+            candidate = {**self.config, **pending}
+            if not self.save_config(candidate):
+                return False
+            self.config = candidate
+            self._dirty = False
+            self._bind_sections()
+        for section in pending:
+            self._notify(section)
+        return True
+    
+    def _stage(self, section: str) -> Dict:
+        """Cópia editável da seção, aplicada no próximo flush"""
+        staged = self._pending.get(section)
+        if staged is None:
+            staged = self._pending[section] = copy.deepcopy(self.config.get(section, {}))
+        return staged
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        return False
+    
+    def add_listener(self, callback):
+        """Registra callback(section) chamado após alterações salvas em uma seção"""
+        self._listeners.append(callback)
+    
+    def _notify(self, section: str):
+        """Avisa os interessados que a seção mudou"""
+        for callback in self._listeners:
+            callback(section)
+    
     def get_default_config(self) -> Dict:
         """Retorna configuração padrão"""
-        return {
-            "pix": {
-                "enabled": True,
-                "chave_pix": "",
-                "nome_recebedor": "E-Store",
-                "cidade": "São Paulo",
-                "descricao": "Pagamento E-commerce"
-            },
-            "boleto": {
-                "enabled": True,
-                "banco": "341",  # Itaú
-                "agencia": "1234",
-                "conta": "12345-6",
-                "cedente": "E-Store LTDA",
-                "cnpj": "12.345.678/0001-90",
-                "endereco": "Rua das Flores, 123 - São Paulo/SP",
-                "dias_vencimento": 3
-            },
-            "cartao": {
-                "enabled": True,
-                "gateway": "simulado",
-                "merchant_id": "MERCHANT123",
-                "api_key": "API_KEY_SIMULADA",
-                "webhook_url": "https://seudominio.com/webhook",
-                "taxa_porcentagem": 2.99,
-                "taxa_fixa": 0.50
-            },
-            "notificacoes": {
-                "email": {
-                    "enabled": True,
-                    "smtp_server": "smtp.gmail.com",
-                    "smtp_port": 587,
-                    "email": "contato@estore.com",
-                    "senha": ""
-                },
-                "webhook": {
-                    "enabled": False,
-                    "url": "",
-                    "secret": ""
-                }
-            }
-        }
+        return _thaw(_DEFAULT_CONFIG)
     
     def get_pix_config(self) -> Dict:
         """Retorna configuração do PIX"""
-        return self.config.get("pix", {})
+        return self.pix
     
     def get_boleto_config(self) -> Dict:
         """Retorna configuração do boleto"""
-        return self.config.get("boleto", {})
+        return self.boleto
     
     def get_cartao_config(self) -> Dict:
         """Retorna configuração do cartão"""
-        return self.config.get("cartao", {})
+        return self.cartao
     
     def update_pix_config(self, chave_pix: str, nome_recebedor: str, cidade: str, descricao: str = "") -> bool:
-        """Atualiza configuração do PIX"""
-        self.config["pix"]["chave_pix"] = chave_pix
-        self.config["pix"]["nome_recebedor"] = nome_recebedor
-        self.config["pix"]["cidade"] = cidade
-        if descricao:
-            self.config["pix"]["descricao"] = descricao
-        return self.save_config()
+        """Atualiza configuração do PIX (vale após flush)"""
+        if len(chave_pix) > _PIX_KEY_MAX:
+            # Não caberia no campo 26 do BR Code
+            return False
+        with self._lock:
+            pix = self._stage("pix")
+            pix["chave_pix"] = chave_pix
+            pix["nome_recebedor"] = nome_recebedor
+            pix["cidade"] = cidade
+            if descricao:
+                pix["descricao"] = descricao
+        return True
     
     def update_boleto_config(self, banco: str, agencia: str, conta: str, cedente: str, cnpj: str, dias_vencimento: int = 3) -> bool:
-        """Atualiza configuração do boleto"""
-        self.config["boleto"]["banco"] = banco
-        self.config["boleto"]["agencia"] = agencia
-        self.config["boleto"]["conta"] = conta
-        self.config["boleto"]["cedente"] = cedente
-        self.config["boleto"]["cnpj"] = cnpj
-        self.config["boleto"]["dias_vencimento"] = dias_vencimento
-        return self.save_config()
-    
-    def update_cartao_config(self, merchant_id: str, taxa_porcentagem: float, taxa_fixa: float, gateway: str = "Simulado") -> bool:
-        """Atualiza configuração do cartão"""
-        self.config["cartao"]["merchant_id"] = merchant_id
-        self.config["cartao"]["taxa_porcentagem"] = taxa_porcentagem
-        self.config["cartao"]["taxa_fixa"] = taxa_fixa
-        self.config["cartao"]["gateway"] = gateway
-        return self.save_config()
+        """Atualiza configuração do boleto (vale após flush)"""
+        try:
+            dias_vencimento = int(dias_vencimento)
+        except (TypeError, ValueError):
+            return False
+        with self._lock:
+            boleto = self._stage("boleto")
+            boleto["banco"] = banco
+            boleto["agencia"] = agencia
+            boleto["conta"] = conta
+            boleto["cedente"] = cedente
+            boleto["cnpj"] = cnpj
+            boleto["dias_vencimento"] = dias_vencimento
+        return True
+    
+    def update_cartao_config(self, merchant_id: str, taxa_porcentagem: float, taxa_fixa: float, gateway: str = "Simulado",
+                             api_key: Optional[str] = None) -> bool:
+        """Atualiza configuração do cartão (vale após flush); taxas inválidas não alteram nada"""
+        try:
+            taxa_porcentagem = float(taxa_porcentagem)
+            taxa_fixa = float(taxa_fixa)
+        except (TypeError, ValueError):
+            return False
+        with self._lock:
+            cartao = self._stage("cartao")
+            cartao["merchant_id"] = merchant_id
+            if api_key is not None:
+                cartao["api_key"] = api_key
+            cartao["taxa_porcentagem"] = taxa_porcentagem
+            cartao["taxa_fixa"] = taxa_fixa
+            cartao["gateway"] = gateway
+        return True
     
     def clear_pix_config(self) -> bool:
-        """Limpa configuração do PIX"""
-        self.config["pix"] = {
-            "enabled": False,
-            "chave_pix": "",
-            "nome_recebedor": "",
-            "cidade": "",
-            "descricao": ""
-        }
-        return self.save_config()
+        """Limpa configuração do PIX (vale após flush)"""
+        with self._lock:
+            self._pending["pix"] = {
+                "enabled": False,
+                "chave_pix": "",
+                "nome_recebedor": "",
+                "cidade": "",
+                "descricao": ""
+            }
+        return True
     
     def clear_boleto_config(self) -> bool:
-        """Limpa configuração do Boleto"""
-        self.config["boleto"] = {
-            "enabled": False,
-            "banco": "",
-            "agencia": "",
-            "conta": "",
-            "cedente": "",
-            "cnpj": "",
-            "dias_vencimento": 3
-        }
-        return self.save_config()
+        """Limpa configuração do Boleto (vale após flush)"""
+        with self._lock:
+            self._pending["boleto"] = {
+                "enabled": False,
+                "banco": "",
+                "agencia": "",
+                "conta": "",
+                "cedente": "",
+                "cnpj": "",
+                "dias_vencimento": 3
+            }
+        return True
     
     def clear_cartao_config(self) -> bool:
-        """Limpa configuração do Cartão"""
-        self.config["cartao"] = {
-            "enabled": False,
-            "merchant_id": "",
-            "taxa_porcentagem": 3.5,
-            "taxa_fixa": 0.39,
-            "gateway": "Simulado"
-        }
-        return self.save_config()
+        """Limpa configuração do Cartão (vale após flush)"""
+        with self._lock:
+            self._pending["cartao"] = {
+                "enabled": False,
+                "merchant_id": "",
+                "taxa_porcentagem": 3.5,
+                "taxa_fixa": 0.39,
+                "gateway": "Simulado"
+            }
+        return True
 
 
 class PaymentGateway:
@@ -165,6 +500,20 @@ class PaymentGateway:
     
     def __init__(self, config: PaymentConfig):
         self.config = config
+        self._refresh_boleto_prefix()
+        config.add_listener(self._on_config_change)
+    
+    def _on_config_change(self, section: str):
+        """Recalcula os dados derivados da seção alterada"""
+        if section == "boleto":
+            self._refresh_boleto_prefix()
+    
+    def _refresh_boleto_prefix(self):
+        """Pré-formata 'banco.agencia.conta.' usado em todo número de boleto"""
+        boleto_config = self.config.get_boleto_config()
+        agencia = boleto_config.get("agencia", "").zfill(4)
+        conta = boleto_config.get("conta", "").translate(_HYPHEN_STRIP_TABLE).zfill(8)
+        self._boleto_prefix = f"{boleto_config.get('banco', '')}.{agencia}.{conta}."
     
     def process_pix_payment(self, amount: float, description: str = "") -> Dict:
         """Processa pagamento PIX"""
@@ -175,12 +524,14 @@ class PaymentGateway:
                 "success": False,
                 "error": "Chave PIX não configurada. Configure no painel administrativo."
             }
+        if len(pix_config["chave_pix"]) > _PIX_KEY_MAX:
+            return {
+                "success": False,
+                "error": f"Chave PIX inválida (máx. {_PIX_KEY_MAX} caracteres). Corrija no painel administrativo."
+            }
         
         # Simular processamento PIX
-        import secrets
-        import time
-        
-        transaction_id = f"PIX{int(time.time())}{secrets.randbelow(1000):03d}"
+        transaction_id = _txid("PIX")
         
         return {
             "success": True,
@@ -203,14 +554,11 @@ class PaymentGateway:
                 "error": "Configuração bancária não encontrada. Configure no painel administrativo."
             }
         
-        # Gerar boleto
-        import secrets
-        import time
-        from datetime import datetime, timedelta
-        
-        transaction_id = f"BOL{int(time.time())}{secrets.randbelow(1000):03d}"
-        boleto_number = self._generate_boleto_number(boleto_config)
-        due_date = datetime.now() + timedelta(days=due_date_days)
+        # Gerar boleto; um único relógio para ID e vencimento
+        now_ns = time.time_ns()
+        transaction_id = _txid("BOL", now_ns)
+        boleto_number = self._generate_boleto_number()
+        due_date = datetime.fromtimestamp(now_ns / 1e9) + timedelta(days=due_date_days)
         
         return {
             "success": True,
@@ -218,7 +566,7 @@ class PaymentGateway:
             "status": "pending",
             "payment_method": "Boleto Bancário",
             "boleto_number": boleto_number,
-            "barcode": self._generate_boleto_barcode(boleto_number, amount, due_date),
+            "barcode": self._generate_boleto_barcode(boleto_config["banco"], amount, due_date),
             "due_date": due_date.timestamp(),
             "cedente": boleto_config["cedente"],
             "cnpj": boleto_config["cnpj"],
@@ -229,33 +577,33 @@ class PaymentGateway:
         """Processa pagamento com cartão de crédito"""
         cartao_config = self.config.get_cartao_config()
         
-        # Simular validação e processamento
-        import secrets
-        import time
-        import random
-        
-        transaction_id = f"CC{int(time.time())}{secrets.randbelow(1000):03d}"
+        # Simular validação e processamento: uma única leitura de bytes
+        # aleatórios fornece decisão e código de autorização
+        transaction_id = _txid("CC")
+        buf = os.urandom(5)
         
         # Simular diferentes cenários (85% aprovação)
-        if random.random() < 0.85:
+        if buf[0] < _CREDIT_APPROVAL_BYTE:
+            card_brand = self._detect_card_brand(card_data["number"])
+            last_four = card_data["number"][-4:]
             return {
                 "success": True,
                 "transaction_id": transaction_id,
                 "status": "approved",
                 "payment_method": "Cartão de Crédito",
-                "card_last_four": card_data["number"][-4:],
-                "card_brand": self._detect_card_brand(card_data["number"]),
+                "card_last_four": last_four,
+                "card_brand": card_brand,
                 "installments": card_data.get("installments", 1),
-                "authorization_code": f"AUTH{secrets.token_hex(4).upper()}",
+                "authorization_code": f"AUTH{buf[1:5].hex().upper()}",
                 "processor_response": "00",
                 "processor_message": "Approved",
                 "gateway_response": {
                     "merchant_id": cartao_config.get("merchant_id", "MERCHANT123"),
                     "amount": card_data["amount"],
                     "installments": card_data.get("installments", 1),
-                    "card_brand": self._detect_card_brand(card_data["number"]),
-                    "last_four": card_data["number"][-4:],
-                    "processing_fee": self._calculate_processing_fee(card_data["amount"], cartao_config)
+                    "card_brand": card_brand,
+                    "last_four": last_four,
+                    "processing_fee": self._calculate_processing_fee(card_data["amount"])
                 }
             }
         else:
@@ -271,32 +619,32 @@ class PaymentGateway:
         """Processa pagamento com cartão de débito"""
         cartao_config = self.config.get_cartao_config()
         
-        # Simular validação e processamento
-        import secrets
-        import time
-        import random
-        
-        transaction_id = f"DC{int(time.time())}{secrets.randbelow(1000):03d}"
+        # Simular validação e processamento: uma única leitura de bytes
+        # aleatórios fornece decisão e código de autorização
+        transaction_id = _txid("DC")
+        buf = os.urandom(5)
         
         # Simular diferentes cenários (92% aprovação para débito)
-        if random.random() < 0.92:
+        if buf[0] < _DEBIT_APPROVAL_BYTE:
+            card_brand = self._detect_card_brand(card_data["number"])
+            last_four = card_data["number"][-4:]
             return {
                 "success": True,
                 "transaction_id": transaction_id,
                 "status": "approved",
                 "payment_method": "Cartão de Débito",
-                "card_last_four": card_data["number"][-4:],
-                "card_brand": self._detect_card_brand(card_data["number"]),
-                "authorization_code": f"AUTH{secrets.token_hex(4).upper()}",
+                "card_last_four": last_four,
+                "card_brand": card_brand,
+                "authorization_code": f"AUTH{buf[1:5].hex().upper()}",
                 "processor_response": "00",
                 "processor_message": "Approved",
                 "gateway_response": {
                     "merchant_id": cartao_config.get("merchant_id", "MERCHANT123"),
                     "amount": card_data["amount"],
                     "installments": 1,  # Débito sempre à vista
-                    "card_brand": self._detect_card_brand(card_data["number"]),
-                    "last_four": card_data["number"][-4:],
-                    "processing_fee": self._calculate_debit_processing_fee(card_data["amount"], cartao_config),
+                    "card_brand": card_brand,
+                    "last_four": last_four,
+                    "processing_fee": self._calculate_processing_fee(card_data["amount"], debit=True),
                     "card_type": "debit"
                 }
             }
@@ -311,52 +659,23 @@ class PaymentGateway:
     
     def _generate_pix_qr_code(self, amount: float, pix_config: Dict) -> str:
         """Gera QR Code PIX"""
-        # Dados do PIX no formato EMV
-        pix_data = {
-            "amount": amount,
-            "key": pix_config["chave_pix"],
-            "merchant": pix_config["nome_recebedor"],
-            "city": pix_config["cidade"],
-            "description": pix_config.get("descricao", "Pagamento E-commerce")
-        }
-        
-        # Tentar gerar QR Code real
-        try:
-            import qrcode
-            import io
-            import base64
-            
-            qr = qrcode.QRCode(version=1, box_size=10, border=5)
-            qr.add_data(json.dumps(pix_data))
-            qr.make(fit=True)
-            
-            img = qr.make_image(fill_color="black", back_color="white")
-            buffer = io.BytesIO()
-            img.save(buffer, format='PNG')
-            img_str = base64.b64encode(buffer.getvalue()).decode()
-            
-            return f"data:image/png;base64,{img_str}"
-        except ImportError:
-            # Fallback para placeholder
-            return f"https://via.placeholder.com/200x200/667eea/white?text=PIX+{amount}"
+        return _render_pix_qr(
+            amount,
+            pix_config["chave_pix"],
+            pix_config["nome_recebedor"],
+            pix_config["cidade"],
+            pix_config.get("descricao", "Pagamento E-commerce")
+        )
     
-    def _generate_boleto_number(self, boleto_config: Dict) -> str:
+    def _generate_boleto_number(self) -> str:
         """Gera número do boleto"""
-        import secrets
-        banco = boleto_config["banco"]
-        agencia = boleto_config["agencia"].zfill(4)
-        conta = boleto_config["conta"].replace("-", "").zfill(8)
-        
-        # Gerar número sequencial
-        sequencial = f"{secrets.randbelow(100000):05d}"
-        
-        return f"{banco}.{agencia}.{conta}.{sequencial}"
+        # Prefixo banco/agência/conta pré-formatado + número sequencial
+        return self._boleto_prefix + f"{_rng.randrange(100000):05d}"
     
-    def _generate_boleto_barcode(self, boleto_number: str, amount: float, due_date) -> str:
+    def _generate_boleto_barcode(self, banco: str, amount: float, due_date) -> str:
         """Gera código de barras do boleto"""
-        # Formato simplificado do código de barras
-        banco = boleto_number.split('.')[0]
-        valor = f"{amount:010.2f}".replace('.', '').replace(',', '')
+        # Formato simplificado do código de barras; valor em centavos
+        valor = f"{int(round(amount * 100)):010d}"
         vencimento = due_date.strftime('%d%m%Y')
         
         # Gerar código de barras (formato simplificado)
@@ -369,590 +688,661 @@ class PaymentGateway:
     
     def _detect_card_brand(self, card_number: str) -> str:
         """Detecta a bandeira do cartão"""
-        card_number = card_number.replace(' ', '').replace('-', '')
-        
-        if card_number.startswith('4'):
-            return 'Visa'
-        elif card_number.startswith(('51', '52', '53', '54', '55')):
-            return 'Mastercard'
-        elif card_number.startswith(('34', '37')):
-            return 'American Express'
-        elif card_number.startswith(('30', '36', '38')):
-            return 'Diners Club'
-        elif card_number.startswith('6011'):
-            return 'Discover'
-        else:
-            return 'Elo'
-    
-    def _calculate_processing_fee(self, amount: float, cartao_config: Dict) -> float:
-        """Calcula taxa de processamento para crédito"""
-        taxa_porcentagem = cartao_config.get("taxa_porcentagem", 2.99)
-        taxa_fixa = cartao_config.get("taxa_fixa", 0.50)
+        card_number = card_number.translate(_CARD_STRIP_TABLE)
         
-        return (amount * taxa_porcentagem / 100) + taxa_fixa
+        for length in _BRAND_PREFIX_LENS:
+            brand = _BRAND_BY_PREFIX.get(card_number[:length])
+            if brand:
+                return brand
+        return 'Elo'
     
-    def _calculate_debit_processing_fee(self, amount: float, cartao_config: Dict) -> float:
-        """Calcula taxa de processamento para débito (reduzida)"""
-        # Taxa reduzida para débito (50% da taxa de crédito)
-        taxa_porcentagem = cartao_config.get("taxa_porcentagem", 2.99) * 0.5
-        taxa_fixa = cartao_config.get("taxa_fixa", 0.50) * 0.5
-        
-        return (amount * taxa_porcentagem / 100) + taxa_fixa
+    def _calculate_processing_fee(self, amount: float, debit: bool = False) -> float:
+        """Calcula taxa de processamento (débito usa a taxa reduzida)"""
+        rate, fixed = self.config._debit_fee if debit else self.config._credit_fee
+        return amount * rate + fixed
 
 
-def render_payment_config_page():
-    """Renderiza página de configuração de pagamentos"""
-    st.markdown("## ⚙️ Configuração de Pagamentos")
+_BANCO_LABELS = {
+    "341": "Itaú (341)",
+    "001": "Banco do Brasil (001)",
+    "104": "Caixa Econômica (104)",
+    "237": "Bradesco (237)",
+    "033": "Santander (033)",
+    "756": "Sicoob (756)"
+}
+_BANCO_OPTIONS = tuple(_BANCO_LABELS)
+
+
+def _banco_index(banco: str) -> int:
+    """Posição do banco nas opções do selectbox (Itaú se desconhecido/vazio)"""
+    return _BANCO_OPTIONS.index(banco) if banco in _BANCO_LABELS else 0
+
+
+_GATEWAYS = ("Simulado", "Stripe", "PagSeguro", "Mercado Pago")
+
+
+def _gateway_index(gateway: str) -> int:
+    """Posição do gateway nas opções do selectbox (Simulado se desconhecido)"""
+    return _GATEWAYS.index(gateway) if gateway in _GATEWAYS else 0
+
+
+@st.cache_data
+def _fmt_pix_info(chave: str, nome: str, cidade: str) -> str:
+    """Markdown do resumo da configuração PIX"""
+    return f"""
+                **🔑 Chave PIX:** `{chave}`  
+                **👤 Recebedor:** {nome}  
+                **🏙️ Cidade:** {cidade}
+                """
+
+
+@st.cache_data
+def _fmt_boleto_info(banco: str, agencia: str, conta: str, cedente: str, cnpj: str) -> str:
+    """Markdown do resumo da configuração de boleto"""
+    return f"""
+                **🏦 Banco:** {banco}  
+                **🏢 Agência:** {agencia}  
+                **💳 Conta:** {conta}  
+                **🏢 Cedente:** {cedente}  
+                **📄 CNPJ:** {cnpj}
+                """
+
+
+@st.cache_data
+def _fmt_cartao_info(merchant_id: str, taxa_porcentagem: float, taxa_fixa: float, gateway: str) -> str:
+    """Markdown do resumo da configuração de cartão"""
+    return f"""
+                **🆔 Merchant ID:** {merchant_id}  
+                **📊 Taxa:** {taxa_porcentagem}% + R$ {taxa_fixa}  
+                **🔧 Gateway:** {gateway}
+                """
+
+
+def _rerun_tab():
+    """Reexecuta só a aba (fragmento) atual; numa execução completa, o app todo"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+
+@st.fragment
+def _render_pix_tab():
+    """Aba de configuração do PIX (fragmento: reexecuta só esta aba)"""
+    config = _get_payment_config()
     
-    config = PaymentConfig()
+    st.markdown("### 📱 Configuração PIX")
     
-    # Tabs para diferentes configurações
-    tab1, tab2, tab3, tab4 = st.tabs(["📱 PIX", "🏦 Boleto", "💳 Cartão", "📧 Notificações"])
+    pix_config = config.get_pix_config()
     
-    with tab1:
-        st.markdown("### 📱 Configuração PIX")
+    with st.form("pix_config_form"):
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            chave_pix = st.text_input(
+                "🔑 Chave PIX",
+                value=pix_config.get("chave_pix") or "",
+                placeholder="CPF, CNPJ, email ou chave aleatória",
+                help="Digite sua chave PIX (CPF, CNPJ, email ou chave aleatória)"
+            )
+            
+            nome_recebedor = st.text_input(
+                "👤 Nome do Recebedor",
+                value=pix_config.get("nome_recebedor") or "",
+                placeholder="Nome da empresa ou pessoa"
+            )
+        
+        with col2:
+            cidade = st.text_input(
+                "🏙️ Cidade",
+                value=pix_config.get("cidade") or "",
+                placeholder="Cidade do recebedor"
+            )
+            
+            descricao = st.text_input(
+                "📝 Descrição",
+                value=pix_config.get("descricao") or "",
+                placeholder="Descrição do pagamento"
+            )
+        
+        if st.form_submit_button("💾 Salvar Configuração PIX", use_container_width=True):
+            if chave_pix and nome_recebedor and cidade:
+                if config.update_pix_config(chave_pix, nome_recebedor, cidade) and config.flush():
+                    st.success("✅ Configuração PIX salva com sucesso!")
+                else:
+                    st.error("❌ Erro ao salvar configuração PIX!")
+            else:
+                st.error("❌ Preencha todos os campos obrigatórios!")
+    
+    # Mostrar configuração atual (relida: um flush acima troca a seção)
+    pix_config = config.get_pix_config()
+    if pix_config.get("chave_pix"):
+        st.markdown("### 📋 Configuração PIX Atual")
         
-        pix_config = config.get_pix_config()
+        col1, col2 = st.columns([3, 1])
+        
+        with col1:
+            st.info(_fmt_pix_info(pix_config['chave_pix'], pix_config['nome_recebedor'], pix_config['cidade']))
+        
+        with col2:
+            st.markdown("**⚙️ Ações:**")
+            
+            if st.button("🔧 Editar PIX", key="edit_pix", use_container_width=True, type="primary"):
+                st.session_state.edit_pix_config = True
+                _rerun_tab()
+            
+            if st.button("🗑️ Excluir PIX", key="delete_pix", use_container_width=True, type="secondary"):
+                st.session_state.delete_pix_config = True
+                _rerun_tab()
+    
+    # Modal de confirmação de exclusão PIX
+    if st.session_state.get('delete_pix_config', False):
+        st.markdown("---")
+        st.markdown("### ⚠️ Confirmar Exclusão PIX")
+        st.warning("**Você tem certeza que deseja excluir a configuração PIX?**")
+        st.info("💡 **Importante:** Isso desabilitará completamente os pagamentos via PIX.")
         
-        with st.form("pix_config_form"):
+        col1, col2, col3 = st.columns([1, 1, 1])
+        
+        with col1:
+            if st.button("✅ Sim, Excluir PIX", key="confirm_delete_pix", type="primary", use_container_width=True):
+                if config.clear_pix_config() and config.flush():
+                    st.success("✅ Configuração PIX excluída com sucesso!")
+                    st.session_state.pop('delete_pix_config', None)
+                    _rerun_tab()
+                else:
+                    st.error("❌ Erro ao excluir configuração PIX!")
+        
+        with col2:
+            if st.button("❌ Cancelar", key="cancel_delete_pix", use_container_width=True):
+                st.session_state.pop('delete_pix_config', None)
+                _rerun_tab()
+    
+    # Formulário de edição PIX
+    if st.session_state.get('edit_pix_config', False):
+        st.markdown("---")
+        st.markdown("### ✏️ Editando Configuração PIX")
+        
+        if st.button("❌ Cancelar Edição PIX", key="cancel_edit_pix"):
+            st.session_state.pop('edit_pix_config', None)
+            _rerun_tab()
+        
+        with st.form("edit_pix_config_form"):
             col1, col2 = st.columns(2)
             
             with col1:
-                chave_pix = st.text_input(
-                    "🔑 Chave PIX",
-                    value=pix_config.get("chave_pix", ""),
-                    placeholder="CPF, CNPJ, email ou chave aleatória",
-                    help="Digite sua chave PIX (CPF, CNPJ, email ou chave aleatória)"
+                new_chave_pix = st.text_input(
+                    "🔑 Nova Chave PIX",
+                    value=pix_config.get("chave_pix") or "",
+                    placeholder="CPF, CNPJ, email ou chave aleatória"
                 )
                 
-                nome_recebedor = st.text_input(
-                    "👤 Nome do Recebedor",
-                    value=pix_config.get("nome_recebedor", ""),
+                new_nome_recebedor = st.text_input(
+                    "👤 Novo Nome do Recebedor",
+                    value=pix_config.get("nome_recebedor") or "",
                     placeholder="Nome da empresa ou pessoa"
                 )
             
             with col2:
-                cidade = st.text_input(
-                    "🏙️ Cidade",
-                    value=pix_config.get("cidade", ""),
+                new_cidade = st.text_input(
+                    "🏙️ Nova Cidade",
+                    value=pix_config.get("cidade") or "",
                     placeholder="Cidade do recebedor"
                 )
                 
-                descricao = st.text_input(
-                    "📝 Descrição",
-                    value=pix_config.get("descricao", ""),
+                new_descricao = st.text_input(
+                    "📝 Nova Descrição",
+                    value=pix_config.get("descricao") or "",
                     placeholder="Descrição do pagamento"
                 )
             
-            if st.form_submit_button("💾 Salvar Configuração PIX", use_container_width=True):
-                if chave_pix and nome_recebedor and cidade:
-                    if config.update_pix_config(chave_pix, nome_recebedor, cidade):
-                        st.success("✅ Configuração PIX salva com sucesso!")
+            if st.form_submit_button("💾 Salvar Alterações PIX", use_container_width=True):
+                if new_chave_pix and new_nome_recebedor and new_cidade:
+                    if config.update_pix_config(new_chave_pix, new_nome_recebedor, new_cidade, new_descricao) and config.flush():
+                        st.success("✅ Configuração PIX atualizada com sucesso!")
+                        st.session_state.pop('edit_pix_config', None)
+                        _rerun_tab()
                     else:
-                        st.error("❌ Erro ao salvar configuração PIX!")
+                        st.error("❌ Erro ao atualizar configuração PIX!")
                 else:
                     st.error("❌ Preencha todos os campos obrigatórios!")
+
+
+@st.fragment
+def _render_boleto_tab():
+    """Aba de configuração do boleto (fragmento: reexecuta só esta aba)"""
+    config = _get_payment_config()
+    
+    st.markdown("### 🏦 Configuração Boleto Bancário")
+    
+    boleto_config = config.get_boleto_config()
+    
+    with st.form("boleto_config_form"):
+        col1, col2 = st.columns(2)
         
-        # Mostrar configuração atual
-        if pix_config.get("chave_pix"):
-            st.markdown("### 📋 Configuração PIX Atual")
-            
-            col1, col2 = st.columns([3, 1])
-            
-            with col1:
-                st.info(f"""
-                **🔑 Chave PIX:** `{pix_config['chave_pix']}`  
-                **👤 Recebedor:** {pix_config['nome_recebedor']}  
-                **🏙️ Cidade:** {pix_config['cidade']}
-                """)
+        with col1:
+            banco = st.selectbox(
+                "🏦 Banco",
+                options=_BANCO_OPTIONS,
+                format_func=_BANCO_LABELS.get,
+                index=_banco_index(boleto_config.get("banco", "341"))
+            )
             
-            with col2:
-                st.markdown("**⚙️ Ações:**")
-                
-                if st.button("🔧 Editar PIX", key="edit_pix", use_container_width=True, type="primary"):
-                    st.session_state.edit_pix_config = True
-                    st.rerun()
-                
-                if st.button("🗑️ Excluir PIX", key="delete_pix", use_container_width=True, type="secondary"):
-                    st.session_state.delete_pix_config = True
-                    st.rerun()
-        
-        # Modal de confirmação de exclusão PIX
-        if st.session_state.get('delete_pix_config', False):
-            st.markdown("---")
-            st.markdown("### ⚠️ Confirmar Exclusão PIX")
-            st.warning("**Você tem certeza que deseja excluir a configuração PIX?**")
-            st.info("💡 **Importante:** Isso desabilitará completamente os pagamentos via PIX.")
+            agencia = st.text_input(
+                "🏢 Agência",
+                value=boleto_config.get("agencia") or "",
+                placeholder="1234"
+            )
             
-            col1, col2, col3 = st.columns([1, 1, 1])
+            conta = st.text_input(
+                "💳 Conta",
+                value=boleto_config.get("conta") or "",
+                placeholder="12345-6"
+            )
+        
+        with col2:
+            cedente = st.text_input(
+                "🏢 Nome do Cedente",
+                value=boleto_config.get("cedente") or "",
+                placeholder="Nome da empresa"
+            )
             
-            with col1:
-                if st.button("✅ Sim, Excluir PIX", key="confirm_delete_pix", type="primary", use_container_width=True):
-                    if config.clear_pix_config():
-                        st.success("✅ Configuração PIX excluída com sucesso!")
-                        st.session_state.pop('delete_pix_config', None)
-                        st.rerun()
-                    else:
-                        st.error("❌ Erro ao excluir configuração PIX!")
+            cnpj = st.text_input(
+                "📄 CNPJ",
+                value=boleto_config.get("cnpj") or "",
+                placeholder="12.345.678/0001-90"
+            )
             
-            with col2:
-                if st.button("❌ Cancelar", key="cancel_delete_pix", use_container_width=True):
-                    st.session_state.pop('delete_pix_config', None)
-                    st.rerun()
+            dias_vencimento = st.number_input(
+                "📅 Dias para Vencimento",
+                value=boleto_config.get("dias_vencimento", 3),
+                min_value=1,
+                max_value=30
+            )
         
-        # Formulário de edição PIX
-        if st.session_state.get('edit_pix_config', False):
-            st.markdown("---")
-            st.markdown("### ✏️ Editando Configuração PIX")
+        if st.form_submit_button("💾 Salvar Configuração Boleto", use_container_width=True):
+            if banco and agencia and conta and cedente and cnpj:
+                if config.update_boleto_config(banco, agencia, conta, cedente, cnpj) and config.flush():
+                    st.success("✅ Configuração de boleto salva com sucesso!")
+                else:
+                    st.error("❌ Erro ao salvar configuração de boleto!")
+            else:
+                st.error("❌ Preencha todos os campos obrigatórios!")
+    
+    # Mostrar configuração atual (relida: um flush acima troca a seção)
+    boleto_config = config.get_boleto_config()
+    if boleto_config.get("banco"):
+        st.markdown("### 📋 Configuração Boleto Atual")
+        
+        col1, col2 = st.columns([3, 1])
+        
+        with col1:
+            st.info(_fmt_boleto_info(
+                boleto_config['banco'], boleto_config['agencia'], boleto_config['conta'],
+                boleto_config['cedente'], boleto_config['cnpj']
+            ))
+        
+        with col2:
+            st.markdown("**⚙️ Ações:**")
             
-            if st.button("❌ Cancelar Edição PIX", key="cancel_edit_pix"):
-                st.session_state.pop('edit_pix_config', None)
-                st.rerun()
+            if st.button("🔧 Editar Boleto", key="edit_boleto", use_container_width=True, type="primary"):
+                st.session_state.edit_boleto_config = True
+                _rerun_tab()
             
-            with st.form("edit_pix_config_form"):
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    new_chave_pix = st.text_input(
-                        "🔑 Nova Chave PIX",
-                        value=pix_config.get("chave_pix", ""),
-                        placeholder="CPF, CNPJ, email ou chave aleatória"
-                    )
-                    
-                    new_nome_recebedor = st.text_input(
-                        "👤 Novo Nome do Recebedor",
-                        value=pix_config.get("nome_recebedor", ""),
-                        placeholder="Nome da empresa ou pessoa"
-                    )
-                
-                with col2:
-                    new_cidade = st.text_input(
-                        "🏙️ Nova Cidade",
-                        value=pix_config.get("cidade", ""),
-                        placeholder="Cidade do recebedor"
-                    )
-                    
-                    new_descricao = st.text_input(
-                        "📝 Nova Descrição",
-                        value=pix_config.get("descricao", ""),
-                        placeholder="Descrição do pagamento"
-                    )
-                
-                if st.form_submit_button("💾 Salvar Alterações PIX", use_container_width=True):
-                    if new_chave_pix and new_nome_recebedor and new_cidade:
-                        if config.update_pix_config(new_chave_pix, new_nome_recebedor, new_cidade, new_descricao):
-                            st.success("✅ Configuração PIX atualizada com sucesso!")
-                            st.session_state.pop('edit_pix_config', None)
-                            st.rerun()
-                        else:
-                            st.error("❌ Erro ao atualizar configuração PIX!")
-                    else:
-                        st.error("❌ Preencha todos os campos obrigatórios!")
+            if st.button("🗑️ Excluir Boleto", key="delete_boleto", use_container_width=True, type="secondary"):
+                st.session_state.delete_boleto_config = True
+                _rerun_tab()
     
-    with tab2:
-        st.markdown("### 🏦 Configuração Boleto Bancário")
+    # Modal de confirmação de exclusão Boleto
+    if st.session_state.get('delete_boleto_config', False):
+        st.markdown("---")
+        st.markdown("### ⚠️ Confirmar Exclusão Boleto")
+        st.warning("**Você tem certeza que deseja excluir a configuração de Boleto?**")
+        st.info("💡 **Importante:** Isso desabilitará completamente os pagamentos via Boleto.")
         
-        boleto_config = config.get_boleto_config()
+        col1, col2, col3 = st.columns([1, 1, 1])
         
-        with st.form("boleto_config_form"):
+        with col1:
+            if st.button("✅ Sim, Excluir Boleto", key="confirm_delete_boleto", type="primary", use_container_width=True):
+                if config.clear_boleto_config() and config.flush():
+                    st.success("✅ Configuração Boleto excluída com sucesso!")
+                    st.session_state.pop('delete_boleto_config', None)
+                    _rerun_tab()
+                else:
+                    st.error("❌ Erro ao excluir configuração Boleto!")
+        
+        with col2:
+            if st.button("❌ Cancelar", key="cancel_delete_boleto", use_container_width=True):
+                st.session_state.pop('delete_boleto_config', None)
+                _rerun_tab()
+    
+    # Formulário de edição Boleto
+    if st.session_state.get('edit_boleto_config', False):
+        st.markdown("---")
+        st.markdown("### ✏️ Editando Configuração Boleto")
+        
+        if st.button("❌ Cancelar Edição Boleto", key="cancel_edit_boleto"):
+            st.session_state.pop('edit_boleto_config', None)
+            _rerun_tab()
+        
+        with st.form("edit_boleto_config_form"):
             col1, col2 = st.columns(2)
             
             with col1:
-                banco = st.selectbox(
-                    "🏦 Banco",
-                    options=["341", "001", "104", "237", "033", "756"],
-                    format_func=lambda x: {
-                        "341": "Itaú (341)",
-                        "001": "Banco do Brasil (001)",
-                        "104": "Caixa Econômica (104)",
-                        "237": "Bradesco (237)",
-                        "033": "Santander (033)",
-                        "756": "Sicoob (756)"
-                    }.get(x, x),
-                    index=0 if boleto_config.get("banco") == "341" else 0
+                new_banco = st.selectbox(
+                    "🏦 Novo Banco",
+                    options=_BANCO_OPTIONS,
+                    format_func=_BANCO_LABELS.get,
+                    index=_banco_index(boleto_config.get("banco", "341"))
                 )
                 
-                agencia = st.text_input(
-                    "🏢 Agência",
-                    value=boleto_config.get("agencia", ""),
+                new_agencia = st.text_input(
+                    "🏢 Nova Agência",
+                    value=boleto_config.get("agencia") or "",
                     placeholder="1234"
                 )
                 
-                conta = st.text_input(
-                    "💳 Conta",
-                    value=boleto_config.get("conta", ""),
+                new_conta = st.text_input(
+                    "💳 Nova Conta",
+                    value=boleto_config.get("conta") or "",
                     placeholder="12345-6"
                 )
             
             with col2:
-                cedente = st.text_input(
-                    "🏢 Nome do Cedente",
-                    value=boleto_config.get("cedente", ""),
+                new_cedente = st.text_input(
+                    "🏢 Novo Nome do Cedente",
+                    value=boleto_config.get("cedente") or "",
                     placeholder="Nome da empresa"
                 )
                 
-                cnpj = st.text_input(
-                    "📄 CNPJ",
-                    value=boleto_config.get("cnpj", ""),
+                new_cnpj = st.text_input(
+                    "📄 Novo CNPJ",
+                    value=boleto_config.get("cnpj") or "",
                     placeholder="12.345.678/0001-90"
                 )
                 
-                dias_vencimento = st.number_input(
-                    "📅 Dias para Vencimento",
+                new_dias_vencimento = st.number_input(
+                    "📅 Novos Dias para Vencimento",
                     value=boleto_config.get("dias_vencimento", 3),
                     min_value=1,
                     max_value=30
                 )
             
-            if st.form_submit_button("💾 Salvar Configuração Boleto", use_container_width=True):
-                if banco and agencia and conta and cedente and cnpj:
-                    if config.update_boleto_config(banco, agencia, conta, cedente, cnpj):
-                        st.success("✅ Configuração de boleto salva com sucesso!")
+            if st.form_submit_button("💾 Salvar Alterações Boleto", use_container_width=True):
+                if new_banco and new_agencia and new_conta and new_cedente and new_cnpj:
+                    if config.update_boleto_config(new_banco, new_agencia, new_conta, new_cedente, new_cnpj, new_dias_vencimento) and config.flush():
+                        st.success("✅ Configuração Boleto atualizada com sucesso!")
+                        st.session_state.pop('edit_boleto_config', None)
+                        _rerun_tab()
                     else:
-                        st.error("❌ Erro ao salvar configuração de boleto!")
+                        st.error("❌ Erro ao atualizar configuração Boleto!")
                 else:
                     st.error("❌ Preencha todos os campos obrigatórios!")
+
+
+@st.fragment
+def _render_cartao_tab():
+    """Aba de configuração do cartão (fragmento: reexecuta só esta aba)"""
+    config = _get_payment_config()
+    
+    st.markdown("### 💳 Configuração Gateway de Cartão")
+    
+    cartao_config = config.get_cartao_config()
+    
+    with st.form("cartao_config_form"):
+        col1, col2 = st.columns(2)
         
-        # Mostrar configuração atual
-        if boleto_config.get("banco"):
-            st.markdown("### 📋 Configuração Boleto Atual")
-            
-            col1, col2 = st.columns([3, 1])
-            
-            with col1:
-                st.info(f"""
-                **🏦 Banco:** {boleto_config['banco']}  
-                **🏢 Agência:** {boleto_config['agencia']}  
-                **💳 Conta:** {boleto_config['conta']}  
-                **🏢 Cedente:** {boleto_config['cedente']}  
-                **📄 CNPJ:** {boleto_config['cnpj']}
-                """)
-            
-            with col2:
-                st.markdown("**⚙️ Ações:**")
-                
-                if st.button("🔧 Editar Boleto", key="edit_boleto", use_container_width=True, type="primary"):
-                    st.session_state.edit_boleto_config = True
-                    st.rerun()
-                
-                if st.button("🗑️ Excluir Boleto", key="delete_boleto", use_container_width=True, type="secondary"):
-                    st.session_state.delete_boleto_config = True
-                    st.rerun()
-        
-        # Modal de confirmação de exclusão Boleto
-        if st.session_state.get('delete_boleto_config', False):
-            st.markdown("---")
-            st.markdown("### ⚠️ Confirmar Exclusão Boleto")
-            st.warning("**Você tem certeza que deseja excluir a configuração de Boleto?**")
-            st.info("💡 **Importante:** Isso desabilitará completamente os pagamentos via Boleto.")
-            
-            col1, col2, col3 = st.columns([1, 1, 1])
+        with col1:
+            merchant_id = st.text_input(
+                "🆔 Merchant ID",
+                value=cartao_config.get("merchant_id") or "",
+                placeholder="ID do comerciante"
+            )
             
-            with col1:
-                if st.button("✅ Sim, Excluir Boleto", key="confirm_delete_boleto", type="primary", use_container_width=True):
-                    if config.clear_boleto_config():
-                        st.success("✅ Configuração Boleto excluída com sucesso!")
-                        st.session_state.pop('delete_boleto_config', None)
-                        st.rerun()
-                    else:
-                        st.error("❌ Erro ao excluir configuração Boleto!")
+            api_key = st.text_input(
+                "🔑 API Key",
+                value=cartao_config.get("api_key") or "",
+                type="password",
+                placeholder="Chave da API"
+            )
+        
+        with col2:
+            taxa_porcentagem = st.number_input(
+                "📊 Taxa (%)",
+                value=cartao_config.get("taxa_porcentagem", 2.99),
+                min_value=0.0,
+                max_value=10.0,
+                step=0.01,
+                format="%.2f"
+            )
             
-            with col2:
-                if st.button("❌ Cancelar", key="cancel_delete_boleto", use_container_width=True):
-                    st.session_state.pop('delete_boleto_config', None)
-                    st.rerun()
+            taxa_fixa = st.number_input(
+                "💰 Taxa Fixa (R$)",
+                value=cartao_config.get("taxa_fixa", 0.50),
+                min_value=0.0,
+                step=0.01,
+                format="%.2f"
+            )
+        
+        if st.form_submit_button("💾 Salvar Configuração Cartão", use_container_width=True):
+            if merchant_id and api_key:
+                if config.update_cartao_config(
+                    merchant_id, taxa_porcentagem, taxa_fixa,
+                    cartao_config.get("gateway", "Simulado"), api_key=api_key
+                ) and config.flush():
+                    st.success("✅ Configuração de cartão salva com sucesso!")
+                else:
+                    st.error("❌ Erro ao salvar configuração de cartão!")
+            else:
+                st.error("❌ Preencha todos os campos obrigatórios!")
+    
+    # Mostrar configuração atual (relida: um flush acima troca a seção)
+    cartao_config = config.get_cartao_config()
+    if cartao_config.get("merchant_id"):
+        st.markdown("### 📋 Configuração Cartão Atual")
+        
+        col1, col2 = st.columns([3, 1])
         
-        # Formulário de edição Boleto
-        if st.session_state.get('edit_boleto_config', False):
-            st.markdown("---")
-            st.markdown("### ✏️ Editando Configuração Boleto")
+        with col1:
+            st.info(_fmt_cartao_info(
+                cartao_config['merchant_id'], cartao_config['taxa_porcentagem'],
+                cartao_config['taxa_fixa'], cartao_config.get('gateway', 'Simulado')
+            ))
+        
+        with col2:
+            st.markdown("**⚙️ Ações:**")
             
-            if st.button("❌ Cancelar Edição Boleto", key="cancel_edit_boleto"):
-                st.session_state.pop('edit_boleto_config', None)
-                st.rerun()
+            if st.button("🔧 Editar Cartão", key="edit_cartao", use_container_width=True, type="primary"):
+                st.session_state.edit_cartao_config = True
+                _rerun_tab()
             
-            with st.form("edit_boleto_config_form"):
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    new_banco = st.selectbox(
-                        "🏦 Novo Banco",
-                        options=["341", "001", "104", "237", "033", "756"],
-                        format_func=lambda x: {
-                            "341": "Itaú (341)",
-                            "001": "Banco do Brasil (001)",
-                            "104": "Caixa Econômica (104)",
-                            "237": "Bradesco (237)",
-                            "033": "Santander (033)",
-                            "756": "Sicoob (756)"
-                        }.get(x, x),
-                        index=["341", "001", "104", "237", "033", "756"].index(boleto_config.get("banco", "341"))
-                    )
-                    
-                    new_agencia = st.text_input(
-                        "🏢 Nova Agência",
-                        value=boleto_config.get("agencia", ""),
-                        placeholder="1234"
-                    )
-                    
-                    new_conta = st.text_input(
-                        "💳 Nova Conta",
-                        value=boleto_config.get("conta", ""),
-                        placeholder="12345-6"
-                    )
-                
-                with col2:
-                    new_cedente = st.text_input(
-                        "🏢 Novo Nome do Cedente",
-                        value=boleto_config.get("cedente", ""),
-                        placeholder="Nome da empresa"
-                    )
-                    
-                    new_cnpj = st.text_input(
-                        "📄 Novo CNPJ",
-                        value=boleto_config.get("cnpj", ""),
-                        placeholder="12.345.678/0001-90"
-                    )
-                    
-                    new_dias_vencimento = st.number_input(
-                        "📅 Novos Dias para Vencimento",
-                        value=boleto_config.get("dias_vencimento", 3),
-                        min_value=1,
-                        max_value=30
-                    )
-                
-                if st.form_submit_button("💾 Salvar Alterações Boleto", use_container_width=True):
-                    if new_banco and new_agencia and new_conta and new_cedente and new_cnpj:
-                        if config.update_boleto_config(new_banco, new_agencia, new_conta, new_cedente, new_cnpj, new_dias_vencimento):
-                            st.success("✅ Configuração Boleto atualizada com sucesso!")
-                            st.session_state.pop('edit_boleto_config', None)
-                            st.rerun()
-                        else:
-                            st.error("❌ Erro ao atualizar configuração Boleto!")
-                    else:
-                        st.error("❌ Preencha todos os campos obrigatórios!")
+            if st.button("🗑️ Excluir Cartão", key="delete_cartao", use_container_width=True, type="secondary"):
+                st.session_state.delete_cartao_config = True
+                _rerun_tab()
     
-    with tab3:
-        st.markdown("### 💳 Configuração Gateway de Cartão")
+    # Modal de confirmação de exclusão Cartão
+    if st.session_state.get('delete_cartao_config', False):
+        st.markdown("---")
+        st.markdown("### ⚠️ Confirmar Exclusão Cartão")
+        st.warning("**Você tem certeza que deseja excluir a configuração de Cartão?**")
+        st.info("💡 **Importante:** Isso desabilitará completamente os pagamentos via Cartão de Crédito e Débito.")
         
-        cartao_config = config.get_cartao_config()
+        col1, col2, col3 = st.columns([1, 1, 1])
         
-        with st.form("cartao_config_form"):
+        with col1:
+            if st.button("✅ Sim, Excluir Cartão", key="confirm_delete_cartao", type="primary", use_container_width=True):
+                if config.clear_cartao_config() and config.flush():
+                    st.success("✅ Configuração Cartão excluída com sucesso!")
+                    st.session_state.pop('delete_cartao_config', None)
+                    _rerun_tab()
+                else:
+                    st.error("❌ Erro ao excluir configuração Cartão!")
+        
+        with col2:
+            if st.button("❌ Cancelar", key="cancel_delete_cartao", use_container_width=True):
+                st.session_state.pop('delete_cartao_config', None)
+                _rerun_tab()
+    
+    # Formulário de edição Cartão
+    if st.session_state.get('edit_cartao_config', False):
+        st.markdown("---")
+        st.markdown("### ✏️ Editando Configuração Cartão")
+        
+        if st.button("❌ Cancelar Edição Cartão", key="cancel_edit_cartao"):
+            st.session_state.pop('edit_cartao_config', None)
+            _rerun_tab()
+        
+        with st.form("edit_cartao_config_form"):
             col1, col2 = st.columns(2)
             
             with col1:
-                merchant_id = st.text_input(
-                    "🆔 Merchant ID",
-                    value=cartao_config.get("merchant_id", ""),
-                    placeholder="ID do comerciante"
+                new_merchant_id = st.text_input(
+                    "🆔 Novo Merchant ID",
+                    value=cartao_config.get("merchant_id") or "",
+                    placeholder="MERCHANT123456"
                 )
                 
-                api_key = st.text_input(
-                    "🔑 API Key",
-                    value=cartao_config.get("api_key", ""),
-                    type="password",
-                    placeholder="Chave da API"
+                new_taxa_porcentagem = st.number_input(
+                    "📊 Nova Taxa (%)",
+                    value=cartao_config.get("taxa_porcentagem", 3.5),
+                    min_value=0.0,
+                    max_value=10.0,
+                    step=0.1,
+                    format="%.2f"
                 )
             
             with col2:
-                taxa_porcentagem = st.number_input(
-                    "📊 Taxa (%)",
-                    value=cartao_config.get("taxa_porcentagem", 2.99),
+                new_taxa_fixa = st.number_input(
+                    "💰 Nova Taxa Fixa (R$)",
+                    value=cartao_config.get("taxa_fixa", 0.39),
                     min_value=0.0,
-                    max_value=10.0,
                     step=0.01,
                     format="%.2f"
                 )
                 
-                taxa_fixa = st.number_input(
-                    "💰 Taxa Fixa (R$)",
-                    value=cartao_config.get("taxa_fixa", 0.50),
-                    min_value=0.0,
-                    step=0.01,
-                    format="%.2f"
+                new_gateway = st.selectbox(
+                    "🔧 Novo Gateway",
+                    options=_GATEWAYS,
+                    index=_gateway_index(cartao_config.get("gateway", "Simulado"))
                 )
             
-            if st.form_submit_button("💾 Salvar Configuração Cartão", use_container_width=True):
-                if merchant_id and api_key:
-                    if config.update_cartao_config(merchant_id, api_key, taxa_porcentagem):
-                        st.success("✅ Configuração de cartão salva com sucesso!")
+            if st.form_submit_button("💾 Salvar Alterações Cartão", use_container_width=True):
+                if new_merchant_id:
+                    if config.update_cartao_config(new_merchant_id, new_taxa_porcentagem, new_taxa_fixa, new_gateway) and config.flush():
+                        st.success("✅ Configuração Cartão atualizada com sucesso!")
+                        st.session_state.pop('edit_cartao_config', None)
+                        _rerun_tab()
                     else:
-                        st.error("❌ Erro ao salvar configuração de cartão!")
+                        st.error("❌ Erro ao atualizar configuração Cartão!")
                 else:
-                    st.error("❌ Preencha todos os campos obrigatórios!")
-        
-        # Mostrar configuração atual
-        if cartao_config.get("merchant_id"):
-            st.markdown("### 📋 Configuração Cartão Atual")
-            
-            col1, col2 = st.columns([3, 1])
-            
-            with col1:
-                st.info(f"""
-                **🆔 Merchant ID:** {cartao_config['merchant_id']}  
-                **📊 Taxa:** {cartao_config['taxa_porcentagem']}% + R$ {cartao_config['taxa_fixa']}  
-                **🔧 Gateway:** {cartao_config.get('gateway', 'Simulado')}
-                """)
-            
-            with col2:
-                st.markdown("**⚙️ Ações:**")
-                
-                if st.button("🔧 Editar Cartão", key="edit_cartao", use_container_width=True, type="primary"):
-                    st.session_state.edit_cartao_config = True
-                    st.rerun()
-                
-                if st.button("🗑️ Excluir Cartão", key="delete_cartao", use_container_width=True, type="secondary"):
-                    st.session_state.delete_cartao_config = True
-                    st.rerun()
-        
-        # Modal de confirmação de exclusão Cartão
-        if st.session_state.get('delete_cartao_config', False):
-            st.markdown("---")
-            st.markdown("### ⚠️ Confirmar Exclusão Cartão")
-            st.warning("**Você tem certeza que deseja excluir a configuração de Cartão?**")
-            st.info("💡 **Importante:** Isso desabilitará completamente os pagamentos via Cartão de Crédito e Débito.")
-            
-            col1, col2, col3 = st.columns([1, 1, 1])
-            
-            with col1:
-                if st.button("✅ Sim, Excluir Cartão", key="confirm_delete_cartao", type="primary", use_container_width=True):
-                    if config.clear_cartao_config():
-                        st.success("✅ Configuração Cartão excluída com sucesso!")
-                        st.session_state.pop('delete_cartao_config', None)
-                        st.rerun()
-                    else:
-                        st.error("❌ Erro ao excluir configuração Cartão!")
-            
-            with col2:
-                if st.button("❌ Cancelar", key="cancel_delete_cartao", use_container_width=True):
-                    st.session_state.pop('delete_cartao_config', None)
-                    st.rerun()
-        
-        # Formulário de edição Cartão
-        if st.session_state.get('edit_cartao_config', False):
-            st.markdown("---")
-            st.markdown("### ✏️ Editando Configuração Cartão")
-            
-            if st.button("❌ Cancelar Edição Cartão", key="cancel_edit_cartao"):
-                st.session_state.pop('edit_cartao_config', None)
-                st.rerun()
-            
-            with st.form("edit_cartao_config_form"):
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    new_merchant_id = st.text_input(
-                        "🆔 Novo Merchant ID",
-                        value=cartao_config.get("merchant_id", ""),
-                        placeholder="MERCHANT123456"
-                    )
-                    
-                    new_taxa_porcentagem = st.number_input(
-                        "📊 Nova Taxa (%)",
-                        value=cartao_config.get("taxa_porcentagem", 3.5),
-                        min_value=0.0,
-                        max_value=10.0,
-                        step=0.1,
-                        format="%.2f"
-                    )
-                
-                with col2:
-                    new_taxa_fixa = st.number_input(
-                        "💰 Nova Taxa Fixa (R$)",
-                        value=cartao_config.get("taxa_fixa", 0.39),
-                        min_value=0.0,
-                        step=0.01,
-                        format="%.2f"
-                    )
-                    
-                    new_gateway = st.selectbox(
-                        "🔧 Novo Gateway",
-                        options=["Simulado", "Stripe", "PagSeguro", "Mercado Pago"],
-                        index=["Simulado", "Stripe", "PagSeguro", "Mercado Pago"].index(cartao_config.get("gateway", "Simulado"))
-                    )
-                
-                if st.form_submit_button("💾 Salvar Alterações Cartão", use_container_width=True):
-                    if new_merchant_id:
-                        if config.update_cartao_config(new_merchant_id, new_taxa_porcentagem, new_taxa_fixa, new_gateway):
-                            st.success("✅ Configuração Cartão atualizada com sucesso!")
-                            st.session_state.pop('edit_cartao_config', None)
-                            st.rerun()
-                        else:
-                            st.error("❌ Erro ao atualizar configuração Cartão!")
-                    else:
-                        st.error("❌ Preencha o Merchant ID!")
+                    st.error("❌ Preencha o Merchant ID!")
+
+
+@st.fragment
+def _render_notificacoes_tab():
+    """Aba de configuração de notificações (fragmento: reexecuta só esta aba)"""
+    config = _get_payment_config()
     
-    with tab4:
-        st.markdown("### 📧 Configuração de Notificações")
-        
-        st.info("""
-        **📧 Email:** Configure SMTP para envio de notificações  
-        **🔗 Webhook:** Configure URL para notificações em tempo real  
-        **📱 SMS:** Integração com provedores de SMS (futuro)
-        """)
-        
-        # Configuração de email
-        st.markdown("#### 📧 Configuração de Email")
-        email_config = config.config.get("notificacoes", {}).get("email", {})
+    st.markdown("### 📧 Configuração de Notificações")
+    
+    st.info("""
+    **📧 Email:** Configure SMTP para envio de notificações  
+    **🔗 Webhook:** Configure URL para notificações em tempo real  
+    **📱 SMS:** Integração com provedores de SMS (futuro)
+    """)
+    
+    # Configuração de email
+    st.markdown("#### 📧 Configuração de Email")
+    email_config = config.notif.get("email", {})
+    
+    with st.form("email_config_form"):
+        col1, col2 = st.columns(2)
         
-        with st.form("email_config_form"):
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                smtp_server = st.text_input(
-                    "📧 Servidor SMTP",
-                    value=email_config.get("smtp_server", ""),
-                    placeholder="smtp.gmail.com"
-                )
-                
-                smtp_port = st.number_input(
-                    "🔌 Porta SMTP",
-                    value=email_config.get("smtp_port", 587),
-                    min_value=1,
-                    max_value=65535
-                )
-            
-            with col2:
-                email = st.text_input(
-                    "📬 Email",
-                    value=email_config.get("email", ""),
-                    placeholder="contato@estore.com"
-                )
-                
-                senha = st.text_input(
-                    "🔑 Senha",
-                    value=email_config.get("senha", ""),
-                    type="password",
-                    placeholder="Senha do email"
-                )
+        with col1:
+            smtp_server = st.text_input(
+                "📧 Servidor SMTP",
+                value=email_config.get("smtp_server") or "",
+                placeholder="smtp.gmail.com"
+            )
             
-            if st.form_submit_button("💾 Salvar Configuração Email", use_container_width=True):
-                st.success("✅ Configuração de email salva! (Funcionalidade em desenvolvimento)")
-        
-        # Configuração de webhook
-        st.markdown("#### 🔗 Configuração de Webhook")
-        webhook_config = config.config.get("notificacoes", {}).get("webhook", {})
-        
-        with st.form("webhook_config_form"):
-            webhook_url = st.text_input(
-                "🔗 URL do Webhook",
-                value=webhook_config.get("url", ""),
-                placeholder="https://seudominio.com/webhook"
+            smtp_port = st.number_input(
+                "🔌 Porta SMTP",
+                value=email_config.get("smtp_port", 587),
+                min_value=1,
+                max_value=65535
+            )
+        
+        with col2:
+            email = st.text_input(
+                "📬 Email",
+                value=email_config.get("email") or "",
+                placeholder="contato@estore.com"
             )
             
-            webhook_secret = st.text_input(
-                "🔐 Secret do Webhook",
-                value=webhook_config.get("secret", ""),
+            senha = st.text_input(
+                "🔑 Senha",
+                value=email_config.get("senha") or "",
                 type="password",
-                placeholder="Chave secreta para validação"
+                placeholder="Senha do email"
             )
-            
-            if st.form_submit_button("💾 Salvar Configuração Webhook", use_container_width=True):
-                st.success("✅ Configuração de webhook salva! (Funcionalidade em desenvolvimento)")
+        
+        if st.form_submit_button("💾 Salvar Configuração Email", use_container_width=True):
+            st.success("✅ Configuração de email salva! (Funcionalidade em desenvolvimento)")
+    
+    # Configuração de webhook
+    st.markdown("#### 🔗 Configuração de Webhook")
+    webhook_config = config.notif.get("webhook", {})
+    
+    with st.form("webhook_config_form"):
+        webhook_url = st.text_input(
+            "🔗 URL do Webhook",
+            value=webhook_config.get("url") or "",
+            placeholder="https://seudominio.com/webhook"
+        )
+        
+        webhook_secret = st.text_input(
+            "🔐 Secret do Webhook",
+            value=webhook_config.get("secret") or "",
+            type="password",
+            placeholder="Chave secreta para validação"
+        )
+        
+        if st.form_submit_button("💾 Salvar Configuração Webhook", use_container_width=True):
+            st.success("✅ Configuração de webhook salva! (Funcionalidade em desenvolvimento)")
+
+
+def render_payment_config_page():
+    """Renderiza página de configuração de pagamentos"""
+    st.markdown("## ⚙️ Configuração de Pagamentos")
+    
+    # Tabs para diferentes configurações
+    tab1, tab2, tab3, tab4 = st.tabs(["📱 PIX", "🏦 Boleto", "💳 Cartão", "📧 Notificações"])
+    
+    with tab1:
+        _render_pix_tab()
+    
+    with tab2:
+        _render_boleto_tab()
+    
+    with tab3:
+        _render_cartao_tab()
+    
+    with tab4:
+        _render_notificacoes_tab()
+
+
+@st.cache_resource
+def _get_payment_config() -> PaymentConfig:
+    """Instância única de PaymentConfig, reaproveitada entre reruns e sessões
+    
+    Nunca é descartada ao salvar: o flush troca a config no próprio objeto e
+    avisa os listeners, então quem guardou o gateway continua atualizado.
+    """
+    return PaymentConfig()
 
 
+@st.cache_resource
 def get_payment_gateway() -> PaymentGateway:
     """Retorna instância do gateway de pagamento"""
-    config = PaymentConfig()
-    return PaymentGateway(config)
+    return PaymentGateway(_get_payment_config())
 
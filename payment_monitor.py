@@ -4,11 +4,31 @@ Verifica status de pagamentos PIX, boleto e cartão
 """
 
 import streamlit as st
+import random
+import threading
 import time
 import json
+import numpy as np
+from dataclasses import asdict, dataclass
 from datetime import datetime, timedelta
-from typing import Dict, List
-from database import get_payment_transaction, update_payment_status, create_payment_notification
+from typing import Dict, List, Optional, Tuple
+from database import (
+    get_conn, get_payment_transaction,
+    apply_payment_checks,
+)
+
+
+# Chance de um pendente ser confirmado a cada verificação, por método
+_APPROVAL_RATES = {'PIX': 0.7, 'Boleto Bancário': 0.6}
+_APPROVAL_MESSAGES = {'PIX': "Pagamento PIX confirmado", 'Boleto Bancário': "Boleto pago confirmado"}
+
+
+@dataclass(slots=True)
+class PayStatus:
+    """Resultado de uma verificação de pagamento"""
+    status: str
+    message: str
+    confirmed_at: Optional[float] = None
 
 
 class PaymentMonitor:
@@ -16,74 +36,71 @@ class PaymentMonitor:
     
     def __init__(self):
         self.check_interval = 30  # segundos
+        # Conexão de leitura reaproveitada; a instância é compartilhada entre sessões (threads)
+        self._conn = None
+        self._conn_lock = threading.Lock()
+    
+    def _conn_get(self):
+        """Conexão persistente do monitor (usar sob self._conn_lock)"""
+        if self._conn is None:
+            self._conn = get_conn(check_same_thread=False)
+        return self._conn
     
-    def check_pix_payment(self, transaction_id: str) -> Dict:
+    def check_pix_payment(self, transaction_id: str) -> PayStatus:
         """Verifica status do pagamento PIX"""
         # Simular verificação de PIX
-        import random
-        
         # 70% de chance de pagamento aprovado após 2 minutos
-        if random.random() < 0.7:
-            return {
-                "status": "approved",
-                "message": "Pagamento PIX confirmado",
-                "confirmed_at": datetime.now().timestamp()
-            }
+        if random.random() < _APPROVAL_RATES['PIX']:
+            return PayStatus(
+                status="approved",
+                message=_APPROVAL_MESSAGES['PIX'],
+                confirmed_at=datetime.now().timestamp()
+            )
         else:
-            return {
-                "status": "pending",
-                "message": "Aguardando pagamento PIX"
-            }
+            return PayStatus(status="pending", message="Aguardando pagamento PIX")
     
-    def check_boleto_payment(self, transaction_id: str) -> Dict:
+    def check_boleto_payment(self, transaction_id: str) -> PayStatus:
         """Verifica status do pagamento via boleto"""
         # Simular verificação de boleto
-        import random
-        
         # 60% de chance de pagamento aprovado após 1 dia
-        if random.random() < 0.6:
-            return {
-                "status": "approved",
-                "message": "Boleto pago confirmado",
-                "confirmed_at": datetime.now().timestamp()
-            }
+        if random.random() < _APPROVAL_RATES['Boleto Bancário']:
+            return PayStatus(
+                status="approved",
+                message=_APPROVAL_MESSAGES['Boleto Bancário'],
+                confirmed_at=datetime.now().timestamp()
+            )
         else:
-            return {
-                "status": "pending",
-                "message": "Aguardando pagamento do boleto"
-            }
+            return PayStatus(status="pending", message="Aguardando pagamento do boleto")
     
-    def check_credit_card_payment(self, transaction_id: str) -> Dict:
-        """Verifica status do pagamento via cartão"""
+    def check_credit_card_payment(self, transaction_id: str, transaction: Optional[Dict] = None) -> PayStatus:
+        """Verifica status do pagamento via cartão (transaction: linha já lida, evita o SELECT)"""
         # Cartão de crédito é processado imediatamente
-        transaction = get_payment_transaction(transaction_id)
+        if transaction is None:
+            transaction = get_payment_transaction(transaction_id)
         
         if transaction and transaction['status'] == 'approved':
-            return {
-                "status": "approved",
-                "message": "Pagamento com cartão aprovado",
-                "confirmed_at": transaction['created_at']
-            }
+            return PayStatus(
+                status="approved",
+                message="Pagamento com cartão aprovado",
+                confirmed_at=transaction['created_at']
+            )
         else:
-            return {
-                "status": "failed",
-                "message": "Pagamento com cartão recusado"
-            }
+            return PayStatus(status="failed", message="Pagamento com cartão recusado")
     
-    def check_payment_status(self, transaction_id: str) -> Dict:
-        """Verifica status de qualquer tipo de pagamento"""
+    def check_payment_status(self, transaction_id: str) -> PayStatus:
+        """Verifica status de qualquer tipo de pagamento (sempre pela linha atual do banco)"""
         transaction = get_payment_transaction(transaction_id)
         
         if not transaction:
-            return {"status": "not_found", "message": "Transação não encontrada"}
+            return PayStatus(status="not_found", message="Transação não encontrada")
         
         # Se já foi processado, retornar status atual
         if transaction['status'] in ['approved', 'failed', 'cancelled']:
-            return {
-                "status": transaction['status'],
-                "message": f"Status: {transaction['status']}",
-                "confirmed_at": transaction['updated_at']
-            }
+            return PayStatus(
+                status=transaction['status'],
+                message=f"Status: {transaction['status']}",
+                confirmed_at=transaction['updated_at']
+            )
         
         # Verificar baseado no método de pagamento
         payment_method = transaction['payment_method']
@@ -93,106 +110,148 @@ class PaymentMonitor:
         elif payment_method == 'Boleto Bancário':
             return self.check_boleto_payment(transaction_id)
         elif payment_method == 'Cartão de Crédito':
-            return self.check_credit_card_payment(transaction_id)
+            return self.check_credit_card_payment(transaction_id, transaction)
         else:
-            return {"status": "unknown", "message": "Método de pagamento não reconhecido"}
+            return PayStatus(status="unknown", message="Método de pagamento não reconhecido")
     
-    def update_payment_if_approved(self, transaction_id: str) -> bool:
-        """Atualiza status do pagamento se foi aprovado"""
-        status_check = self.check_payment_status(transaction_id)
+    def update_payment_if_approved(self, transaction_id: str, status_check: Optional[PayStatus] = None) -> bool:
+        """Atualiza status do pagamento se foi aprovado
         
-        if status_check['status'] == 'approved':
-            # Atualizar no banco de dados
-            success = update_payment_status(
-                transaction_id, 
-                'approved', 
-                json.dumps(status_check)
-            )
-            
-            if success:
-                # Criar notificação
-                create_payment_notification(
-                    transaction_id,
-                    'payment_approved',
-                    'success',
-                    status_check['message']
-                )
-                return True
-        
-        return False
-    
-    def get_pending_payments(self) -> List[Dict]:
-        """Retorna lista de pagamentos pendentes"""
-        from database import get_conn
-        
-        conn = get_conn()
-        cur = conn.cursor()
-        
-        cur.execute("""
-            SELECT pt.*, o.order_number, u.first_name, u.last_name
-            FROM payment_transactions pt
-            JOIN orders o ON pt.order_id = o.id
-            JOIN users u ON o.user_id = u.id
-            WHERE pt.status = 'pending'
-            ORDER BY pt.created_at ASC
-        """)
+        status_check: resultado de check_payment_status já obtido (evita um novo sorteio).
+        A gravação só altera a transação se ela ainda estiver pendente no banco,
+        então uma linha desatualizada não sobrescreve um 'failed' nem duplica a notificação.
+        """
+        if status_check is None:
+            status_check = self.check_payment_status(transaction_id)
         
-        pending_payments = cur.fetchall()
-        conn.close()
+        if status_check.status != 'approved':
+            return False
         
-        return [dict(payment) for payment in pending_payments]
+        applied = apply_payment_checks(
+            [(transaction_id, json.dumps(asdict(status_check), separators=(",", ":")), status_check.message)],
+            []
+        )
+        return bool(applied and applied[0])
+    
+    def get_pending_payments(self) -> List[tuple]:
+        """Retorna lista de pagamentos pendentes (linhas imutáveis com acesso payment['coluna'])"""
+        with self._conn_lock:
+            cur = self._conn_get().cursor()
+            cur.execute("""
+                SELECT pt.*, o.order_number, u.first_name, u.last_name
+                FROM payment_transactions pt
+                JOIN orders o ON pt.order_id = o.id
+                JOIN users u ON o.user_id = u.id
+                WHERE pt.status = 'pending'
+                ORDER BY pt.created_at ASC
+            """)
+            return cur.fetchall()
     
     def process_pending_payments(self) -> Dict:
         """Processa todos os pagamentos pendentes"""
         pending_payments = self.get_pending_payments()
         
-        results = {
-            'total_checked': len(pending_payments),
-            'approved': 0,
-            'still_pending': 0,
-            'failed': 0
-        }
+        approved = []
+        failed = []
+        still_pending = 0
         
-        for payment in pending_payments:
+        # Todos os sorteios de uma vez; cartão (taxa 0) é decidido na hora, sem aprovação tardia
+        rates = np.fromiter(
+            (_APPROVAL_RATES.get(p['payment_method'], 0.0) for p in pending_payments),
+            dtype=float, count=len(pending_payments)
+        )
+        is_approved = np.random.random(len(pending_payments)) < rates
+        confirmed_at = datetime.now().timestamp()
+        expired_ids = self.get_expired_pending_ids(int(confirmed_at)) if pending_payments else set()
+        
+        # Decide tudo em memória e grava em uma única transação
+        for payment, ok in zip(pending_payments, is_approved.tolist()):
             transaction_id = payment['transaction_id']
-            
-            # Verificar se foi aprovado
-            if self.update_payment_if_approved(transaction_id):
-                results['approved'] += 1
+            if ok:
+                message = _APPROVAL_MESSAGES[payment['payment_method']]
+                status_check = PayStatus("approved", message, confirmed_at)
+                approved.append((transaction_id, json.dumps(asdict(status_check), separators=(",", ":")), message))
+            elif transaction_id in expired_ids:
+                # Falhou por prazo (ex: PIX expirado)
+                failed.append(transaction_id)
             else:
-                # Verificar se falhou (ex: PIX expirado)
-                if self._is_payment_expired(payment):
-                    update_payment_status(transaction_id, 'failed', 'Pagamento expirado')
-                    results['failed'] += 1
-                else:
-                    results['still_pending'] += 1
-        
-        return results
-    
-    def _is_payment_expired(self, payment: Dict) -> bool:
-        """Verifica se o pagamento expirou"""
-        payment_method = payment['payment_method']
-        created_at = payment['created_at']
-        
-        # PIX expira em 30 minutos
-        if payment_method == 'PIX':
-            expiry_time = created_at + (30 * 60)  # 30 minutos
-            return time.time() > expiry_time
+                still_pending += 1
         
-        # Boleto expira em 3 dias
-        elif payment_method == 'Boleto Bancário':
-            expiry_time = created_at + (3 * 24 * 60 * 60)  # 3 dias
-            return time.time() > expiry_time
+        applied = apply_payment_checks(approved, failed)
+        if applied is None:
+            # Nada foi gravado: tudo continua pendente
+            still_pending = len(pending_payments)
+            applied = (0, 0)
+        # Linhas já resolvidas por outra verificação simultânea não entram na contagem
+        approved_count, failed_count = applied
         
-        # Cartão não expira (é processado imediatamente)
-        return False
+        return {
+            'total_checked': len(pending_payments),
+            'approved': approved_count,
+            'still_pending': still_pending,
+            'failed': failed_count
+        }
+    
+    def get_expired_pending_ids(self, now: int) -> set:
+        """transaction_ids pendentes cujo prazo (expires_at) já passou"""
+        with self._conn_lock:
+            cur = self._conn_get().cursor()
+            cur.execute("""
+                SELECT transaction_id FROM payment_transactions
+                WHERE status = 'pending' AND expires_at < ?
+            """, (now,))
+            return {row[0] for row in cur.fetchall()}
+    
+    def get_status_stats(self) -> Dict[str, tuple]:
+        """Contagem e soma de valores por status: {status: (quantidade, soma)}"""
+        with self._conn_lock:
+            cur = self._conn_get().cursor()
+            cur.execute("""
+                SELECT status, COUNT(*) AS c, COALESCE(SUM(amount), 0) AS s
+                FROM payment_transactions
+                GROUP BY status
+            """)
+            return {row['status']: (row['c'], row['s']) for row in cur.fetchall()}
+
+
+@st.cache_resource(ttl=5)
+def _cached_pending() -> List[Tuple[tuple, str]]:
+    """Pendentes (com cliente/pedido já unidos) e data de criação já formatada.
+    
+    cache_resource e não cache_data: as linhas são imutáveis e podem ser
+    compartilhadas sem a cópia via pickle (que o tipo de linha não suporta).
+    """
+    return [
+        (payment, datetime.fromtimestamp(payment['created_at']).strftime('%d/%m/%Y %H:%M'))
+        for payment in get_payment_monitor().get_pending_payments()
+    ]
+
+
+@st.fragment(run_every=30)
+def _auto_monitor_tick():
+    """Verificação automática; o Streamlit reexecuta o fragmento a cada 30s sem bloquear a sessão
+    
+    O fragmento também roda em todo rerun completo da página (outros botões):
+    a verificação só acontece se a última tiver mais de check_interval segundos.
+    """
+    monitor = get_payment_monitor()
+    now = time.monotonic()
+    last = st.session_state.get('auto_monitor_last')
+    if last is None or now - last[0] >= monitor.check_interval:
+        results = monitor.process_pending_payments()
+        _cached_pending.clear()
+        last = (now, datetime.now().strftime('%H:%M:%S'), results)
+        st.session_state['auto_monitor_last'] = last
+    _, checked_at, results = last
+    st.write(f"🔄 Última verificação: {checked_at} - "
+             f"✅ {results['approved']} aprovados, ⏳ {results['still_pending']} pendentes")
 
 
 def render_payment_monitor_page():
     """Renderiza página de monitoramento de pagamentos"""
     st.markdown("## 🔍 Monitor de Pagamentos")
     
-    monitor = PaymentMonitor()
+    monitor = get_payment_monitor()
     
     # Botões de ação
     col1, col2, col3 = st.columns(3)
@@ -201,6 +260,7 @@ def render_payment_monitor_page():
         if st.button("🔄 Verificar Pagamentos Pendentes", use_container_width=True):
             with st.spinner("Verificando pagamentos..."):
                 results = monitor.process_pending_payments()
+                _cached_pending.clear()
                 
                 st.success(f"""
                 **📊 Resultado da Verificação:**
@@ -212,62 +272,49 @@ def render_payment_monitor_page():
     
     with col2:
         if st.button("📋 Listar Pendentes", use_container_width=True):
-            pending_payments = monitor.get_pending_payments()
+            pending_payments = _cached_pending()
             
             if pending_payments:
                 st.markdown("### ⏳ Pagamentos Pendentes")
                 
-                for payment in pending_payments:
+                for payment, created in pending_payments:
                     with st.expander(f"💳 {payment['transaction_id']} - {payment['payment_method']} - R$ {payment['amount']:,.2f}"):
                         col1, col2 = st.columns(2)
                         
                         with col1:
-                            st.markdown(f"**👤 Cliente:** {payment['first_name']} {payment['last_name']}")
-                            st.markdown(f"**📋 Pedido:** {payment['order_number']}")
-                            st.markdown(f"**💰 Valor:** R$ {payment['amount']:,.2f}")
-                            st.markdown(f"**📅 Criado:** {datetime.fromtimestamp(payment['created_at']).strftime('%d/%m/%Y %H:%M')}")
+                            st.markdown(
+                                f"**👤 Cliente:** {payment['first_name']} {payment['last_name']}\n\n"
+                                f"**📋 Pedido:** {payment['order_number']}\n\n"
+                                f"**💰 Valor:** R$ {payment['amount']:,.2f}\n\n"
+                                f"**📅 Criado:** {created}"
+                            )
                         
                         with col2:
                             # Verificar status individual
                             if st.button(f"🔍 Verificar", key=f"check_{payment['transaction_id']}"):
+                                # Linha do cache só para exibição: a verificação relê a transação
                                 status = monitor.check_payment_status(payment['transaction_id'])
                                 
-                                if status['status'] == 'approved':
-                                    st.success(f"✅ {status['message']}")
+                                if status.status == 'approved':
+                                    st.success(f"✅ {status.message}")
                                     # Atualizar automaticamente
-                                    monitor.update_payment_if_approved(payment['transaction_id'])
+                                    if monitor.update_payment_if_approved(payment['transaction_id'], status):
+                                        _cached_pending.clear()
                                     st.rerun()
                                 else:
-                                    st.info(f"⏳ {status['message']}")
+                                    st.info(f"⏳ {status.message}")
             else:
                 st.info("🎉 Nenhum pagamento pendente!")
     
     with col3:
         if st.button("📊 Estatísticas", use_container_width=True):
-            # Mostrar estatísticas
-            from database import get_conn
-            
-            conn = get_conn()
-            cur = conn.cursor()
-            
-            # Estatísticas gerais
-            cur.execute("SELECT COUNT(*) FROM payment_transactions")
-            total_transactions = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(*) FROM payment_transactions WHERE status = 'approved'")
-            approved_transactions = cur.fetchone()[0]
+            # Estatísticas gerais: contagem e soma por status em uma única varredura
+            stats = monitor.get_status_stats()
             
-            cur.execute("SELECT COUNT(*) FROM payment_transactions WHERE status = 'pending'")
-            pending_transactions = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(*) FROM payment_transactions WHERE status = 'failed'")
-            failed_transactions = cur.fetchone()[0]
-            
-            # Receita total
-            cur.execute("SELECT SUM(amount) FROM payment_transactions WHERE status = 'approved'")
-            total_revenue = cur.fetchone()[0] or 0
-            
-            conn.close()
+            total_transactions = sum(c for c, _ in stats.values())
+            approved_transactions, total_revenue = stats.get('approved', (0, 0))
+            pending_transactions = stats.get('pending', (0, 0))[0]
+            failed_transactions = stats.get('failed', (0, 0))[0]
             
             # Exibir estatísticas
             col1, col2, col3, col4 = st.columns(4)
@@ -292,21 +339,7 @@ def render_payment_monitor_page():
     
     if st.checkbox("🔄 Ativar verificação automática"):
         st.info("💡 O sistema verificará pagamentos pendentes automaticamente a cada 30 segundos.")
-        
-        # Simular verificação automática
-        if st.button("▶️ Iniciar Monitoramento"):
-            placeholder = st.empty()
-            
-            for i in range(5):  # Simular 5 verificações
-                with placeholder.container():
-                    st.write(f"🔄 Verificação {i+1}/5...")
-                    time.sleep(1)
-                    
-                    # Simular verificação
-                    results = monitor.process_pending_payments()
-                    st.write(f"✅ {results['approved']} aprovados, ⏳ {results['still_pending']} pendentes")
-            
-            st.success("✅ Monitoramento concluído!")
+        _auto_monitor_tick()
     
     # Histórico de verificações
     st.markdown("### 📋 Histórico de Verificações")
@@ -318,11 +351,15 @@ def render_payment_monitor_page():
         {"time": "16:29:15", "approved": 0, "pending": 3, "failed": 0},
     ]
     
-    for entry in verification_history:
-        st.markdown(f"🕐 **{entry['time']}** - ✅ {entry['approved']} aprovados, ⏳ {entry['pending']} pendentes, ❌ {entry['failed']} falharam")
+    # Um único elemento em vez de um st.markdown por linha
+    st.markdown("\n\n".join(
+        f"🕐 **{entry['time']}** - ✅ {entry['approved']} aprovados, ⏳ {entry['pending']} pendentes, ❌ {entry['failed']} falharam"
+        for entry in verification_history
+    ))
 
 
+@st.cache_resource
 def get_payment_monitor() -> PaymentMonitor:
-    """Retorna instância do monitor de pagamentos"""
+    """Retorna instância do monitor de pagamentos (compartilhada entre execuções; sem estado por usuário)"""
     return PaymentMonitor()
 
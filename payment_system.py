@@ -4,12 +4,16 @@ Suporte a PIX, Cartão de Crédito e Boleto Bancário
 """
 
 import streamlit as st
+import numpy as np
+import bisect
+import os
 import re
-import hashlib
 import secrets
-import json
+import time
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
 try:
     import qrcode
     import io
@@ -18,7 +22,134 @@ try:
     QRCODE_AVAILABLE = True
 except ImportError:
     QRCODE_AVAILABLE = False
-import requests
+
+# Gateway configurável e APIs reais: importados uma vez por processo
+try:
+    from payment_config import get_payment_gateway
+except ImportError:
+    get_payment_gateway = None
+try:
+    from payment_apis import get_payment_api_manager
+except ImportError:
+    get_payment_api_manager = None
+
+
+# Padrões dos validadores, compilados uma vez. re.ASCII: \d é só 0-9
+_RE_CVV = re.compile(r'\A\d{3,4}\Z', re.ASCII)
+_RE_EXPIRY = re.compile(r'\A(\d{2})/(\d{2})\Z', re.ASCII)
+_RE_EMAIL = re.compile(r'\A[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}\Z')
+
+
+# Bytes que não são dígitos ASCII, removidos por bytes.translate
+_DEL_NONDIGITS = bytes(i for i in range(256) if not 48 <= i <= 57)
+
+
+def _digits_only(value: str) -> str:
+    """Só os dígitos 0-9 (dígitos de outros alfabetos também saem), em uma passada em C"""
+    return value.encode('ascii', 'ignore').translate(None, _DEL_NONDIGITS).decode('ascii')
+
+
+# Pesos do primeiro dígito verificador do CPF (10..2)
+_CPF_W1 = np.arange(10, 1, -1, dtype=np.int64)
+
+# Faixas de BIN (6 primeiros dígitos) por bandeira, ordenadas e sem sobreposição;
+# mesmas regras de prefixo do gateway em payment_config
+_BIN_RANGES = sorted([
+    (300000, 309999, 'Diners Club'),
+    (340000, 349999, 'American Express'),
+    (360000, 369999, 'Diners Club'),
+    (370000, 379999, 'American Express'),
+    (380000, 389999, 'Diners Club'),
+    (400000, 499999, 'Visa'),
+    (510000, 559999, 'Mastercard'),
+    (601100, 601199, 'Discover'),
+])
+_BIN_STARTS = [start for start, _, _ in _BIN_RANGES]
+
+
+def _card_brand(card_number: str) -> str:
+    """Bandeira pelo BIN: uma busca binária nas faixas (Elo se nenhuma casar)"""
+    digits = _digits_only(card_number)[:6]
+    if not digits:
+        return 'Elo'
+    bin6 = int(digits.ljust(6, '0'))
+    i = bisect.bisect_right(_BIN_STARTS, bin6) - 1
+    if i >= 0 and bin6 <= _BIN_RANGES[i][1]:
+        return _BIN_RANGES[i][2]
+    return 'Elo'
+
+
+def _qr_png_b64(amount_cents: int, key: str) -> str:
+    """QR Code PIX (fallback) como data URI PNG; a chave é nova a cada PIX, então não há o que memoizar"""
+    # Dados do PIX (formato simplificado), montados direto: mesmo texto que o
+    # json.dumps do dict; a chave é hex, não precisa de escape
+    payload = (f'{{"amount": {amount_cents / 100!r}, "key": "{key}", '
+               '"merchant": "E-Store", "description": "Pagamento E-commerce"}')
+    
+    # Gerar QR Code
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    
+    # Matriz (com borda) ampliada em blocos box_size x box_size de uma vez;
+    # True = branco no modo '1' do PIL, por isso a inversão
+    modules = np.array(qr.get_matrix(), dtype=bool)
+    pixels = np.kron(~modules, np.ones((qr.box_size, qr.box_size), dtype=bool))
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='PNG', compress_level=1)
+    img_str = base64.b64encode(buffer.getvalue()).decode()
+    
+    return f"data:image/png;base64,{img_str}"
+
+
+# Último segundo formatado para IDs de transação: (segundo epoch, "AAAAMMDDhhmmss")
+_txn_stamp: Tuple[int, str] = (-1, '')
+
+
+def _txn_timestamp() -> str:
+    """Timestamp local AAAAMMDDhhmmss, formatado no máximo uma vez por segundo"""
+    global _txn_stamp
+    sec = int(time.time())
+    cached = _txn_stamp
+    if cached[0] == sec:
+        return cached[1]
+    t = time.localtime(sec)
+    stamp = f"{t.tm_year}{t.tm_mon:02d}{t.tm_mday:02d}{t.tm_hour:02d}{t.tm_min:02d}{t.tm_sec:02d}"
+    _txn_stamp = (sec, stamp)
+    return stamp
+
+
+def to_cents(amount) -> int:
+    """Converte valor em reais para centavos inteiros, arredondando (int(19.99 * 100) daria 1998)"""
+    return int(round(float(amount) * 100))
+
+
+@lru_cache(maxsize=2048)
+def _cpf_check(cpf: str) -> bool:
+    """Dígitos verificadores de um CPF já normalizado (só dígitos); memoizado porque
+    o mesmo CPF é revalidado a cada rerun do Streamlit durante o checkout"""
+    if len(cpf) != 11 or cpf.count(cpf[0]) == 11:
+        return False
+    
+    # Bytes ASCII: cada dígito vale b[i] - 48
+    b = cpf.encode('ascii')
+    
+    # Validação do primeiro dígito (pesos 10..2; 48 * (10+...+2) = 48 * 54)
+    sum1 = 10*b[0] + 9*b[1] + 8*b[2] + 7*b[3] + 6*b[4] + 5*b[5] + 4*b[6] + 3*b[7] + 2*b[8] - 48 * 54
+    digit1 = 11 - (sum1 % 11)
+    if digit1 >= 10:
+        digit1 = 0
+    if b[9] - 48 != digit1:
+        return False
+    
+    # Validação do segundo dígito: pesos 11..2 são os anteriores + 1, então
+    # sum2 = sum1 + (soma dos 9 primeiros dígitos) + 2 * digit1
+    sum2 = sum1 + sum(b[:9]) - 48 * 9 + 2 * digit1
+    digit2 = 11 - (sum2 % 11)
+    if digit2 >= 10:
+        digit2 = 0
+    
+    return b[10] - 48 == digit2
 
 
 class PaymentValidator:
@@ -28,77 +159,81 @@ class PaymentValidator:
     def validate_card_number(card_number: str) -> bool:
         """Valida número do cartão usando algoritmo de Luhn"""
         # Remove espaços e caracteres não numéricos
-        card_number = re.sub(r'\D', '', card_number)
+        card_number = _digits_only(card_number)
         
-        if len(card_number) < 13 or len(card_number) > 19:
+        # Filtro de tamanho antes do laço de Luhn
+        if not 13 <= len(card_number) <= 19:
             return False
         
-        # Algoritmo de Luhn
-        def luhn_checksum(card_num):
-            def digits_of(n):
-                return [int(d) for d in str(n)]
-            digits = digits_of(card_num)
-            odd_digits = digits[-1::-2]
-            even_digits = digits[-2::-2]
-            checksum = sum(odd_digits)
-            for d in even_digits:
-                checksum += sum(digits_of(d*2))
-            return checksum % 10
-        
-        return luhn_checksum(card_number) == 0
+        # Algoritmo de Luhn: da direita para a esquerda, dobrando um dígito sim, outro não
+        total = 0
+        alt = False
+        for ch in reversed(card_number):
+            d = ord(ch) - 48
+            if alt:
+                d <<= 1
+                if d > 9:
+                    d -= 9
+            total += d
+            alt = not alt
+        
+        return total % 10 == 0
     
     @staticmethod
     def validate_cvv(cvv: str) -> bool:
         """Valida CVV"""
-        return re.match(r'^\d{3,4}$', cvv) is not None
+        return _RE_CVV.match(cvv) is not None
     
     @staticmethod
     def validate_expiry_date(expiry: str) -> bool:
         """Valida data de expiração MM/AA"""
-        if not re.match(r'^\d{2}/\d{2}$', expiry):
+        match = _RE_EXPIRY.match(expiry)
+        if not match:
             return False
         
-        month, year = expiry.split('/')
-        month, year = int(month), int(year)
+        month, year = int(match.group(1)), int(match.group(2))
         
         if month < 1 or month > 12:
             return False
         
-        current_year = datetime.now().year % 100
-        current_month = datetime.now().month
-        
-        if year < current_year or (year == current_year and month < current_month):
-            return False
-        
-        return True
+        now = datetime.now()
+        return (year, month) >= (now.year % 100, now.month)
     
     @staticmethod
     def validate_cpf(cpf: str) -> bool:
         """Valida CPF"""
-        cpf = re.sub(r'\D', '', cpf)
-        
-        if len(cpf) != 11 or cpf == cpf[0] * 11:
-            return False
-        
-        # Validação do primeiro dígito
-        sum1 = sum(int(cpf[i]) * (10 - i) for i in range(9))
-        digit1 = 11 - (sum1 % 11)
-        if digit1 >= 10:
-            digit1 = 0
-        
-        # Validação do segundo dígito
-        sum2 = sum(int(cpf[i]) * (11 - i) for i in range(10))
-        digit2 = 11 - (sum2 % 11)
-        if digit2 >= 10:
-            digit2 = 0
-        
-        return cpf[9] == str(digit1) and cpf[10] == str(digit2)
+        # Normaliza antes do cache: "529.982.247-25" e "52998224725" são a mesma entrada
+        return _cpf_check(_digits_only(cpf))
+    
+    @staticmethod
+    def validate_cpf_batch(cpfs: List[str]) -> np.ndarray:
+        """Valida vários CPFs de uma vez (importações em massa); mesmo resultado de validate_cpf"""
+        cleaned = [_digits_only(cpf) for cpf in cpfs]
+        result = np.zeros(len(cleaned), dtype=bool)
+        idx = np.fromiter((i for i, cpf in enumerate(cleaned) if len(cpf) == 11), dtype=np.intp)
+        if idx.size == 0:
+            return result
+        
+        d = (np.frombuffer(''.join(cleaned[i] for i in idx).encode('ascii'), dtype=np.uint8)
+             .reshape(-1, 11).astype(np.int64) - 48)
+        
+        s1 = d[:, :9] @ _CPF_W1
+        d1 = 11 - s1 % 11
+        d1[d1 >= 10] = 0
+        # Pesos 11..2 = pesos anteriores + 1: s2 = s1 + soma dos 9 primeiros + 2 * d[9]
+        s2 = s1 + d[:, :9].sum(axis=1) + 2 * d[:, 9]
+        d2 = 11 - s2 % 11
+        d2[d2 >= 10] = 0
+        
+        # Todos os dígitos iguais (111.111.111-11 etc.) não são CPF válido
+        not_repeated = (d != d[:, :1]).any(axis=1)
+        result[idx] = (d[:, 9] == d1) & (d[:, 10] == d2) & not_repeated
+        return result
     
     @staticmethod
     def validate_email(email: str) -> bool:
         """Valida email"""
-        pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        return re.match(pattern, email) is not None
+        return _RE_EMAIL.match(email) is not None
 
 
 class PaymentProcessor:
@@ -106,41 +241,46 @@ class PaymentProcessor:
     
     def __init__(self):
         self.validator = PaymentValidator()
-        # Importar gateway configurável
-        try:
-            from payment_config import get_payment_gateway
-            self.gateway = get_payment_gateway()
-        except ImportError:
-            self.gateway = None
-        
-        # Importar APIs reais de pagamento
-        try:
-            from payment_apis import get_payment_api_manager
-            self.api_manager = get_payment_api_manager()
-        except ImportError:
-            self.api_manager = None
+        self.gateway = get_payment_gateway() if get_payment_gateway else None
+        self.api_manager = get_payment_api_manager() if get_payment_api_manager else None
+        
+        # Escolha do backend feita uma vez: APIs reais > gateway configurável > simulação
+        api, gateway = self.api_manager, self.gateway
+        if api:
+            self._credit_impl = lambda d: api.process_credit_card_payment(
+                d, to_cents(d['amount']), order_id=d.get('order_id'))
+            self._debit_impl = lambda d: api.process_debit_card_payment(
+                d, to_cents(d['amount']), order_id=d.get('order_id'))
+            self._pix_impl = lambda d: api.process_pix_payment(to_cents(d['amount']), d.get('description', ''))
+        elif gateway:
+            self._credit_impl = gateway.process_credit_card_payment
+            self._debit_impl = gateway.process_debit_card_payment
+            self._pix_impl = lambda d: gateway.process_pix_payment(d['amount'], d.get('description', ''))
+        else:
+            self._credit_impl = self._credit_fallback
+            self._debit_impl = self._debit_fallback
+            self._pix_impl = self._pix_fallback
+        if gateway:
+            self._boleto_impl = lambda d: gateway.process_boleto_payment(d['amount'], d.get('due_days', 3))
+        else:
+            self._boleto_impl = self._boleto_fallback
     
     def process_credit_card(self, card_data: Dict) -> Dict:
         """Processa pagamento com cartão de crédito"""
-        # Validações
-        if not self.validator.validate_card_number(card_data['number']):
-            return {"success": False, "error": "Número do cartão inválido"}
-        
+        # Validações: as baratas (e que mais falham) primeiro, Luhn por último
         if not self.validator.validate_cvv(card_data['cvv']):
             return {"success": False, "error": "CVV inválido"}
         
         if not self.validator.validate_expiry_date(card_data['expiry']):
             return {"success": False, "error": "Data de expiração inválida"}
         
-        # Usar APIs reais se disponível
-        if self.api_manager:
-            return self.api_manager.process_credit_card_payment(card_data, card_data['amount'])
-        
-        # Usar gateway configurável se disponível
-        if self.gateway:
-            return self.gateway.process_credit_card_payment(card_data)
+        if not self.validator.validate_card_number(card_data['number']):
+            return {"success": False, "error": "Número do cartão inválido"}
         
-        # Fallback para simulação simples
+        return self._credit_impl(card_data)
+    
+    def _credit_fallback(self, card_data: Dict) -> Dict:
+        """Simulação simples de crédito (sem APIs nem gateway)"""
         transaction_id = self._generate_transaction_id()
         
         # Simular diferentes cenários
@@ -172,25 +312,20 @@ class PaymentProcessor:
     
     def process_debit_card(self, card_data: Dict) -> Dict:
         """Processa pagamento com cartão de débito"""
-        # Validações
-        if not self.validator.validate_card_number(card_data['number']):
-            return {"success": False, "error": "Número do cartão inválido"}
-        
+        # Validações: as baratas (e que mais falham) primeiro, Luhn por último
         if not self.validator.validate_cvv(card_data['cvv']):
             return {"success": False, "error": "CVV inválido"}
         
         if not self.validator.validate_expiry_date(card_data['expiry']):
             return {"success": False, "error": "Data de expiração inválida"}
         
-        # Usar APIs reais se disponível
-        if self.api_manager:
-            return self.api_manager.process_debit_card_payment(card_data, card_data['amount'])
-        
-        # Usar gateway configurável se disponível
-        if self.gateway:
-            return self.gateway.process_debit_card_payment(card_data)
+        if not self.validator.validate_card_number(card_data['number']):
+            return {"success": False, "error": "Número do cartão inválido"}
         
-        # Fallback para simulação simples
+        return self._debit_impl(card_data)
+    
+    def _debit_fallback(self, card_data: Dict) -> Dict:
+        """Simulação simples de débito (sem APIs nem gateway)"""
         transaction_id = self._generate_transaction_id()
         
         # Simular diferentes cenários (débito tem taxa de sucesso maior)
@@ -222,15 +357,10 @@ class PaymentProcessor:
     
     def process_pix(self, pix_data: Dict) -> Dict:
         """Processa pagamento via PIX"""
-        # Usar APIs reais se disponível
-        if self.api_manager:
-            return self.api_manager.process_pix_payment(pix_data['amount'], pix_data.get('description', ''))
-        
-        # Usar gateway configurável se disponível
-        if self.gateway:
-            return self.gateway.process_pix_payment(pix_data['amount'], pix_data.get('description', ''))
-        
-        # Fallback para simulação simples
+        return self._pix_impl(pix_data)
+    
+    def _pix_fallback(self, pix_data: Dict) -> Dict:
+        """Simulação simples de PIX (sem APIs nem gateway)"""
         pix_key = self._generate_pix_key()
         qr_code_data = self._generate_pix_qr_code(pix_data['amount'], pix_key)
         
@@ -247,11 +377,10 @@ class PaymentProcessor:
     
     def process_boleto(self, boleto_data: Dict) -> Dict:
         """Processa pagamento via boleto"""
-        # Usar gateway configurável se disponível
-        if self.gateway:
-            return self.gateway.process_boleto_payment(boleto_data['amount'], boleto_data.get('due_days', 3))
-        
-        # Fallback para simulação simples
+        return self._boleto_impl(boleto_data)
+    
+    def _boleto_fallback(self, boleto_data: Dict) -> Dict:
+        """Simulação simples de boleto (sem gateway)"""
         boleto_number = self._generate_boleto_number()
         due_date = datetime.now() + timedelta(days=3)
         
@@ -266,11 +395,13 @@ class PaymentProcessor:
             "message": "Boleto gerado com sucesso. Vence em 3 dias úteis."
         }
     
+    def _detect_card_brand(self, card_number: str) -> str:
+        """Detecta a bandeira do cartão"""
+        return _card_brand(card_number)
+    
     def _generate_transaction_id(self) -> str:
         """Gera ID único para transação"""
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        random_part = secrets.token_hex(4).upper()
-        return f"TXN{timestamp}{random_part}"
+        return f"TXN{_txn_timestamp()}{secrets.token_hex(4).upper()}"
     
     def _generate_pix_key(self) -> str:
         """Gera chave PIX aleatória"""
@@ -279,33 +410,20 @@ class PaymentProcessor:
     def _generate_pix_qr_code(self, amount: float, pix_key: str) -> str:
         """Gera QR Code PIX"""
         if QRCODE_AVAILABLE:
-            # Dados do PIX (formato simplificado)
-            pix_data = {
-                "amount": amount,
-                "key": pix_key,
-                "merchant": "E-Store",
-                "description": "Pagamento E-commerce"
-            }
-            
-            # Gerar QR Code
-            qr = qrcode.QRCode(version=1, box_size=10, border=5)
-            qr.add_data(json.dumps(pix_data))
-            qr.make(fit=True)
-            
-            # Converter para base64
-            img = qr.make_image(fill_color="black", back_color="white")
-            buffer = io.BytesIO()
-            img.save(buffer, format='PNG')
-            img_str = base64.b64encode(buffer.getvalue()).decode()
-            
-            return f"data:image/png;base64,{img_str}"
+            return _qr_png_b64(to_cents(amount), pix_key)
         else:
             # Fallback: retornar URL de placeholder
             return "https://via.placeholder.com/200x200/667eea/white?text=PIX+QR+Code"
     
     def _generate_boleto_number(self) -> str:
         """Gera número do boleto"""
-        return f"34191.{secrets.randbelow(10000):04d}.{secrets.randbelow(10000):04d}.{secrets.randbelow(100000):05d}.{secrets.randbelow(100000):05d}"
+        # Uma única leitura de entropia, fatiada em quatro inteiros de 32 bits
+        raw = os.urandom(16)
+        a = int.from_bytes(raw[0:4], 'big') % 10000
+        b = int.from_bytes(raw[4:8], 'big') % 10000
+        c = int.from_bytes(raw[8:12], 'big') % 100000
+        d = int.from_bytes(raw[12:16], 'big') % 100000
+        return f"34191.{a:04d}.{b:04d}.{c:05d}.{d:05d}"
     
     def _generate_boleto_barcode(self, boleto_number: str) -> str:
         """Gera código de barras do boleto"""
@@ -463,7 +581,8 @@ class PaymentUI:
                         "cvv": cvv,
                         "name": cardholder_name,
                         "amount": order_data['total'],
-                        "installments": installments
+                        "installments": installments,
+                        "order_id": order_data['order_id']
                     })
                     
                     if result['success']:
@@ -562,7 +681,8 @@ class PaymentUI:
                         "expiry": expiry_date,
                         "cvv": cvv,
                         "name": cardholder_name,
-                        "amount": order_data['total']
+                        "amount": order_data['total'],
+                        "order_id": order_data['order_id']
                     })
                     
                     if result['success']:
@@ -698,44 +818,52 @@ class PaymentUI:
         return payment_result
 
 
-def get_payment_methods() -> List[Dict]:
-    """Retorna métodos de pagamento disponíveis"""
-    return [
-        {
-            "id": "pix",
-            "name": "PIX",
-            "description": "Pagamento instantâneo",
-            "icon": "📱",
-            "fees": "Sem taxas",
-            "processing_time": "Imediato"
-        },
-        {
-            "id": "credit_card",
-            "name": "Cartão de Crédito",
-            "description": "Visa, Mastercard, Elo",
-            "icon": "💳",
-            "fees": "Taxa do gateway",
-            "processing_time": "Imediato"
-        },
-        {
-            "id": "debit_card",
-            "name": "Cartão de Débito",
-            "description": "Visa, Mastercard, Elo",
-            "icon": "💳",
-            "fees": "Taxa reduzida",
-            "processing_time": "Imediato"
-        },
-        {
-            "id": "boleto",
-            "name": "Boleto Bancário",
-            "description": "Pagamento em banco ou lotérica",
-            "icon": "🏦",
-            "fees": "Sem taxas",
-            "processing_time": "2-3 dias úteis"
-        }
-    ]
+# Métodos de pagamento: montados uma vez, imutáveis (compartilhados entre reruns)
+_PAYMENT_METHODS: Tuple[Mapping[str, str], ...] = (
+    MappingProxyType({
+        "id": "pix",
+        "name": "PIX",
+        "description": "Pagamento instantâneo",
+        "icon": "📱",
+        "fees": "Sem taxas",
+        "processing_time": "Imediato"
+    }),
+    MappingProxyType({
+        "id": "credit_card",
+        "name": "Cartão de Crédito",
+        "description": "Visa, Mastercard, Elo",
+        "icon": "💳",
+        "fees": "Taxa do gateway",
+        "processing_time": "Imediato"
+    }),
+    MappingProxyType({
+        "id": "debit_card",
+        "name": "Cartão de Débito",
+        "description": "Visa, Mastercard, Elo",
+        "icon": "💳",
+        "fees": "Taxa reduzida",
+        "processing_time": "Imediato"
+    }),
+    MappingProxyType({
+        "id": "boleto",
+        "name": "Boleto Bancário",
+        "description": "Pagamento em banco ou lotérica",
+        "icon": "🏦",
+        "fees": "Sem taxas",
+        "processing_time": "2-3 dias úteis"
+    })
+)
+
+
+def get_payment_methods() -> Tuple[Mapping[str, str], ...]:
+    """Retorna métodos de pagamento disponíveis (somente leitura)"""
+    return _PAYMENT_METHODS
+
+
+# Troca separadores do formato americano (1,234.56) pelos brasileiros (1.234,56)
+_BRL_SEPARATORS = str.maketrans(',.', '.,')
 
 
 def format_currency(value: float) -> str:
     """Formata valor em moeda brasileira"""
-    return f"R$ {value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    return f"R$ {value:,.2f}".translate(_BRL_SEPARATORS)